@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+'''
+This module holds the activity store.  Every line status_update writes to a
+<cust_dir>/activity.log is also appended to an SQLite store (activity.db in
+the tools directory) shared by all customers, so questions about past runs
+are indexed queries rather than a parse of every activity.log:
+
+runs    one row per tool run per customer: the tool and when it started
+events  one row per device per run: ip, hostname, status, whether it
+        succeeded, how long the device took and when
+
+events are indexed on customer, device and time and on customer, status and
+time.  The store is pruned once per process when it is opened: runs older
+than KEEP_DAYS go, then the oldest runs until there are no more than
+MAX_EVENTS events, so activity.db stops growing (SQLite reuses the freed
+pages).  The activity.log text files themselves are rotated once they reach
+ROTATE_BYTES, the last ROTATE_KEEP are kept as activity.log.1 (newest) to
+activity.log.<ROTATE_KEEP>.
+
+The pipeline notes how long each device took with device_seconds() before
+it reports the device, see run_pipeline.  import_log() loads an existing
+activity.log, splitting it into runs wherever an hour passes without an
+entry and skipping entries older than KEEP_DAYS.  See activity_report.py for
+the queries.
+'''
+
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+
+
+ROTATE_BYTES = 5 * 1024 * 1024
+ROTATE_KEEP = 5
+
+KEEP_DAYS = 730
+MAX_EVENTS = 5000000
+
+FAILURE_RE = re.compile(r"(?i)error|fail|could not|mismatch|rejected")
+
+# A gap this long between two lines of an imported activity.log starts a new run
+RUN_GAP = 3600
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS runs (
+           id INTEGER PRIMARY KEY,
+           customer TEXT NOT NULL,
+           tool TEXT,
+           started REAL NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS events (
+           id INTEGER PRIMARY KEY,
+           run INTEGER NOT NULL,
+           customer TEXT NOT NULL,
+           ip TEXT NOT NULL,
+           hostname TEXT,
+           status TEXT NOT NULL,
+           ok INTEGER NOT NULL,
+           seconds REAL,
+           at REAL NOT NULL)''',
+    '''CREATE INDEX IF NOT EXISTS runs_customer ON runs (customer, started)''',
+    '''CREATE INDEX IF NOT EXISTS events_device ON events (customer, ip, at)''',
+    '''CREATE INDEX IF NOT EXISTS events_status ON events (customer, status, at)''',
+    '''CREATE INDEX IF NOT EXISTS events_run ON events (run)''',
+]
+
+# The seconds the device being reported took, set by the pipeline
+_current = threading.local()
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def is_failure(status):
+
+    '''
+    True for a failed device.  The statuses have started with *** since the
+    pipeline, older activity.logs only say what went wrong.
+    '''
+
+    return status.startswith("***") or bool(FAILURE_RE.search(status))
+
+
+def device_seconds(seconds):
+
+    '''
+    Notes how long the device about to be reported by this thread took
+    '''
+
+    _current.seconds = seconds
+
+
+def rotate_log(filename, max_bytes=ROTATE_BYTES, keep=ROTATE_KEEP):
+
+    '''
+    Moves filename to filename.1 (and .1 to .2 and so on) once it is over
+    max_bytes
+    '''
+
+    try:
+        if os.path.getsize(filename) < max_bytes:
+            return
+    except OSError:
+        return
+    for number in range(keep - 1, 0, -1):
+        older = "%s.%d" % (filename, number)
+        if os.path.exists(older):
+            os.rename(older, "%s.%d" % (filename, number + 1))
+    os.rename(filename, filename + ".1")
+
+
+def store():
+
+    '''
+    Returns the ActivityStore shared by the tools, opened on first use
+    '''
+
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ActivityStore()
+            _store.prune()
+        return _store
+
+
+def record_activity(folder, host_ip, name, status):
+
+    '''
+    Appends a status_update to the store
+    '''
+
+    seconds = getattr(_current, 'seconds', None)
+    _current.seconds = None
+    store().add(folder, host_ip, name, status, seconds)
+
+
+class ActivityStore(object):
+
+    '''
+    The activity store, safe to share between the pipeline worker threads
+    '''
+
+    def __init__(self, filename="activity.db"):
+        # Only loaded once there is something to record
+        import sqlite3
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+        self.runs = {}
+
+    def _run(self, customer, started=None, tool=None):
+        if customer not in self.runs:
+            tool = tool or os.path.basename(sys.argv[0]).replace(".py", "")
+            cur = self.conn.execute("INSERT INTO runs (customer, tool, started) VALUES (?, ?, ?)",
+                                    (customer, tool, started or time.time()))
+            self.runs[customer] = cur.lastrowid
+        return self.runs[customer]
+
+    def add(self, customer, host_ip, name, status, seconds=None, at=None):
+
+        '''
+        Appends an event to this process's run for the customer
+        '''
+
+        at = at or time.time()
+        with self.lock:
+            run = self._run(customer, at)
+            self.conn.execute("INSERT INTO events (run, customer, ip, hostname, status, ok, seconds, at) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (run, customer, host_ip, name or None, status,
+                               0 if is_failure(status) else 1, seconds, at))
+            self.conn.commit()
+
+    def import_log(self, customer, filename):
+
+        '''
+        Loads an existing activity.log, returns the number of events loaded
+        and the number skipped.  Events older than KEEP_DAYS are skipped, the
+        next prune would only drop them again.
+        '''
+
+        cutoff = time.time() - KEEP_DAYS * 86400
+        fileh = open(filename)
+        events = 0
+        skipped = 0
+        last = None
+        with self.lock:
+            for line in fileh:
+                event = parse_log_line(line)
+                if not event:
+                    continue
+                at, host_ip, name, status = event
+                if at < cutoff:
+                    skipped += 1
+                    continue
+                if last is None or at - last > RUN_GAP:
+                    self.runs.pop(customer, None)
+                    self._run(customer, at, "import")
+                last = at
+                self.conn.execute("INSERT INTO events (run, customer, ip, hostname, status, ok, seconds, at) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, NULL, ?)",
+                                  (self.runs[customer], customer, host_ip, name, status,
+                                   0 if is_failure(status) else 1, at))
+                events += 1
+            self.runs.pop(customer, None)
+            self.conn.commit()
+        fileh.close()
+        return events, skipped
+
+    def prune(self, days=KEEP_DAYS, max_events=MAX_EVENTS):
+
+        '''
+        Drops the runs older than days, then the oldest runs until at most
+        max_events events are left.  Returns the number of runs dropped.
+        '''
+
+        cutoff = time.time() - days * 86400
+        with self.lock:
+            old = [row[0] for row in self.conn.execute("SELECT id FROM runs WHERE started < ?", (cutoff,))]
+            self._drop(old)
+            excess = self.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] - max_events
+            runs = self.conn.execute("SELECT r.id, (SELECT COUNT(*) FROM events e WHERE e.run=r.id) "
+                                     "FROM runs r ORDER BY started").fetchall() if excess > 0 else []
+            oldest = []
+            for run, events in runs:
+                if excess <= 0:
+                    break
+                oldest.append(run)
+                excess -= events
+            self._drop(oldest)
+            self.conn.commit()
+        return len(old) + len(oldest)
+
+    def _drop(self, runs):
+        for run in runs:
+            self.conn.execute("DELETE FROM events WHERE run=?", (run,))
+            self.conn.execute("DELETE FROM runs WHERE id=?", (run,))
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+
+def parse_log_line(line):
+
+    '''
+    Splits an activity.log line into (time, ip, hostname, status), None if
+    it is not one.  The hostname is only there for devices that completed,
+    it is the word before the status ending in .txt or it is left out.
+    '''
+
+    if len(line) < 43:
+        return None
+    try:
+        stamp = datetime.datetime.strptime(line[:26].strip(), "%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        try:
+            stamp = datetime.datetime.strptime(line[:26].strip(), "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None
+    fields = line[26:].split(None, 1)
+    if len(fields) < 2:
+        return None
+    host_ip, rest = fields[0], fields[1].rstrip("\n")
+    name = None
+    words = rest.split(" ", 1)
+    if len(words) == 2 and words[0].endswith(".txt"):
+        name, rest = words
+    return time.mktime(stamp.timetuple()) + stamp.microsecond / 1e6, host_ip, name, rest.strip()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+'''
+This module answers questions about past runs from the activity store (see
+activity_log.py).  <cust_dir> can be all for every customer.
+
+activity_report.py trend <cust_dir> [runs]          done/failed per run
+activity_report.py failures <cust_dir> [runs]       failures by status and device
+activity_report.py flapping <cust_dir> [runs]       devices that keep going up and down
+activity_report.py durations <cust_dir> [days]      mean seconds per device
+activity_report.py history <cust_dir> <ip> [runs]   one device's runs
+activity_report.py import <cust_dir>                load an existing activity.log, once
+
+runs defaults to the last 30 runs, days to 30.
+'''
+
+import datetime
+import os
+import sys
+import time
+
+from activity_log import store
+from activity_log import ROTATE_KEEP
+from activity_log import KEEP_DAYS
+
+
+'''
+Functions
+'''
+
+RUNS = 30
+DAYS = 30
+
+# Changes between success and failure over the runs that make a device flap
+FLAP_CHANGES = 3
+
+def last_runs(customer, runs):
+
+    '''
+    This function returns the SQL condition and arguments that pick the
+    events of the last runs of a customer
+    '''
+
+    if customer == "all":
+        return "run IN (SELECT id FROM runs ORDER BY started DESC LIMIT ?)", (runs,)
+    return ("run IN (SELECT id FROM runs WHERE customer=? ORDER BY started DESC LIMIT ?)",
+            (customer, runs))
+
+def customer_filter(customer):
+    if customer == "all":
+        return "1", ()
+    return "customer=?", (customer,)
+
+def when(stamp):
+    return datetime.datetime.fromtimestamp(stamp).strftime("%Y-%m-%d %H:%M")
+
+def trend(customer, runs):
+
+    '''
+    This function prints done, failed and the mean device time for each run
+    '''
+
+    where, args = customer_filter(customer)
+    rows = store().query(
+        "SELECT r.id, r.customer, r.tool, r.started, "
+        "(SELECT COUNT(*) FROM events e WHERE e.run=r.id AND e.ok=1), "
+        "(SELECT COUNT(*) FROM events e WHERE e.run=r.id AND e.ok=0), "
+        "(SELECT AVG(seconds) FROM events e WHERE e.run=r.id) "
+        "FROM runs r WHERE %s ORDER BY r.started DESC LIMIT ?" % where.replace("customer", "r.customer"),
+        args + (runs,))
+    print "%-16s %-20s %-18s %6s %6s %8s" % ("started", "customer", "tool", "done", "failed", "mean s")
+    for run_id, cust, tool, started, done, failed, mean in reversed(rows):
+        print "%-16s %-20s %-18s %6d %6d %8s" % (when(started), cust, tool, done, failed,
+                                                  "%.1f" % mean if mean is not None else "-")
+
+def failures(customer, runs):
+
+    '''
+    This function prints the failures over the runs by status, then the
+    devices that failed authentication
+    '''
+
+    where, args = last_runs(customer, runs)
+    rows = store().query("SELECT status, COUNT(*), COUNT(DISTINCT ip) FROM events "
+                         "WHERE ok=0 AND %s GROUP BY status ORDER BY 2 DESC" % where, args)
+    print "%8s %8s  %s" % ("events", "devices", "status")
+    for status, count, devices in rows:
+        print "%8d %8d  %s" % (count, devices, status)
+
+    rows = store().query("SELECT customer, ip, COUNT(*), MAX(at) FROM events "
+                         "WHERE status LIKE '*** Authentication failed%%' AND %s "
+                         "GROUP BY customer, ip ORDER BY 3 DESC" % where, args)
+    if rows:
+        print "\nAuthentication failures:\n"
+        for cust, host_ip, count, last in rows:
+            print "%-20s %-15s %4d  last %s" % (cust, host_ip, count, when(last))
+
+def flapping(customer, runs):
+
+    '''
+    This function prints the devices whose result changed between success
+    and failure at least FLAP_CHANGES times over the runs
+    '''
+
+    where, args = last_runs(customer, runs)
+    rows = store().query("SELECT customer, ip, ok FROM events WHERE %s "
+                         "ORDER BY customer, ip, at" % where, args)
+    flaps = []
+    device = None
+    for cust, host_ip, ok in rows:
+        if (cust, host_ip) != device:
+            device = (cust, host_ip)
+            previous = ok
+            flaps.append([0, 0, cust, host_ip])
+        if ok != previous:
+            flaps[-1][0] += 1
+        flaps[-1][1] += 1 - ok
+        previous = ok
+    flaps = [flap for flap in flaps if flap[0] >= FLAP_CHANGES]
+    flaps.sort(reverse=True)
+    print "%7s %7s  %-20s %s" % ("changes", "failed", "customer", "ip")
+    for changes, failed, cust, host_ip in flaps:
+        print "%7d %7d  %-20s %s" % (changes, failed, cust, host_ip)
+
+def durations(customer, days):
+
+    '''
+    This function prints the mean and worst seconds per device over the days
+    '''
+
+    where, args = customer_filter(customer)
+    rows = store().query("SELECT customer, ip, COUNT(seconds), AVG(seconds), MAX(seconds) FROM events "
+                         "WHERE %s AND at >= ? AND seconds IS NOT NULL "
+                         "GROUP BY customer, ip ORDER BY 4 DESC" % where,
+                         args + (time.time() - days * 86400,))
+    print "%-20s %-15s %5s %8s %8s" % ("customer", "ip", "runs", "mean s", "max s")
+    for cust, host_ip, count, mean, worst in rows:
+        print "%-20s %-15s %5d %8.1f %8.1f" % (cust, host_ip, count, mean, worst)
+
+def history(customer, host_ip, runs):
+
+    '''
+    This function prints a device's events, oldest first
+    '''
+
+    where, args = customer_filter(customer)
+    rows = store().query("SELECT e.at, r.tool, e.hostname, e.status, e.seconds "
+                         "FROM events e JOIN runs r ON r.id=e.run "
+                         "WHERE %s AND e.ip=? ORDER BY e.at DESC LIMIT ?"
+                         % where.replace("customer", "e.customer"), args + (host_ip, runs))
+    for at, tool, name, status, seconds in reversed(rows):
+        print "%-16s %-18s %-20s %6s  %s" % (when(at), tool, name or "",
+                                             "%.1f" % seconds if seconds is not None else "-", status)
+
+def import_logs(customer):
+
+    '''
+    This function loads the activity.log of a customer dir, the rotated ones
+    first
+    '''
+
+    if store().query("SELECT id FROM runs WHERE customer=? AND tool='import' LIMIT 1", (customer,)):
+        print "%s has been imported already" % customer
+        return
+    filename = "".join([customer, "/activity.log"])
+    names = ["%s.%d" % (filename, number) for number in range(ROTATE_KEEP, 0, -1)] + [filename]
+    for name in names:
+        if os.path.exists(name):
+            events, skipped = store().import_log(customer, name)
+            print "%s: %d events" % (name, events)
+            if skipped:
+                print "%s: %d events older than %d days skipped" % (name, skipped, KEEP_DAYS)
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    if len(args) < 2:
+        print __doc__
+        raise SystemExit(1)
+
+    query, customer = args[0], args[1].rstrip("/")
+    started = time.time()
+    if query == "trend":
+        trend(customer, int(args[2]) if len(args) > 2 else RUNS)
+    elif query == "failures":
+        failures(customer, int(args[2]) if len(args) > 2 else RUNS)
+    elif query == "flapping":
+        flapping(customer, int(args[2]) if len(args) > 2 else RUNS)
+    elif query == "durations":
+        durations(customer, int(args[2]) if len(args) > 2 else DAYS)
+    elif query == "history" and len(args) > 2:
+        history(customer, args[2], int(args[3]) if len(args) > 3 else RUNS)
+    elif query == "import":
+        import_logs(customer)
+    else:
+        print __doc__
+        raise SystemExit(1)
+
+    print "\n(%.0fms)\n" % ((time.time() - started) * 1000)
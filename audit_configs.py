@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+'''
+This module checks every config stored by grab_configs.py for a customer
+against a rules file, see audit_rules.py for the rule format.
+
+The configs are checked on a process pool, one config per task.  Results are
+cached in <customer dir>/audit.cache against the config file name, its
+digest and the rules digest, so on the next run only configs (or rules) that have changed are
+checked again.
+
+The violations are printed and written to <customer dir>/audit.log
+'''
+
+import glob
+import json
+import multiprocessing
+import os
+
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from audit_rules import load_rules
+# The digest of the normalised config, a new timestamp line is not a change
+from normalise import file_digest
+
+
+'''
+Functions
+'''
+
+# Set in each pool worker by init_worker so the rules are compiled once per process
+worker_rules = None
+
+def init_worker(rules_filename):
+    global worker_rules
+    worker_rules = load_rules(rules_filename)
+
+def audit_file(task):
+
+    '''
+    Pool task, checks one config.  task is (filename, digest)
+    '''
+
+    filename, digest = task
+    fileh = open(filename)
+    violations = worker_rules.evaluate(fileh)
+    fileh.close()
+    return filename, digest, violations
+
+def load_cache(folder):
+    try:
+        fileh = open("".join([folder, "/audit.cache"]))
+    except IOError:
+        return {}
+    try:
+        cache = json.load(fileh)
+    except ValueError:
+        cache = {}
+    fileh.close()
+    return cache
+
+def save_cache(folder, cache):
+    fileh = open("".join([folder, "/audit.cache"]), "w")
+    json.dump(cache, fileh)
+    fileh.close()
+
+def audit_folder(folder, rules_filename, processes=None):
+
+    '''
+    This function checks every <hostname>.txt in the customer dir, returns a
+    dict of device -> list of violations.  Configs whose name, digest and
+    rules version match the cache are not read again.
+    '''
+
+    rules = load_rules(rules_filename)
+    cache = load_cache(folder)
+    results = {}
+    new_cache = {}
+    tasks = []
+
+    for filename in sorted(glob.glob("".join([folder, "/*.txt"]))):
+        digest = file_digest(filename)
+        key = ":".join([os.path.basename(filename), digest, rules.version])
+        if key in cache:
+            results[filename] = cache[key]
+            new_cache[key] = cache[key]
+        else:
+            tasks.append((filename, digest))
+
+    if tasks:
+        pool = multiprocessing.Pool(processes, init_worker, (rules_filename,))
+        try:
+            for filename, digest, violations in pool.imap_unordered(audit_file, tasks, 8):
+                results[filename] = violations
+                new_cache[":".join([os.path.basename(filename), digest, rules.version])] = violations
+        finally:
+            pool.close()
+            pool.join()
+
+    # Only entries for the current configs and rules are kept
+    save_cache(folder, new_cache)
+
+    return dict((os.path.basename(filename)[:-4], violations)
+                for filename, violations in results.items()), len(tasks)
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    print
+    print "============================="
+    print "  Audit configs against rules"
+    print "=============================\n"
+
+    cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+    rules_filename = raw_input_def("Input the rules file [policy.rules]: ", "policy.rules")
+
+    fileh = open(cust)
+    cust_dir = fileh.readline().strip()
+    fileh.close()
+
+    (results, checked) = audit_folder(cust_dir, rules_filename)
+
+    log_fileh = open("".join([cust_dir, "/audit.log"]), "w")
+    failed = 0
+    for device in sorted(results):
+        violations = results[device]
+        if violations:
+            failed += 1
+        for name, lineno, line in violations:
+            msg = "%-30s %-20s %5d  %s" % (device, name, lineno, line)
+            print msg
+            log_fileh.write(msg + "\n")
+    log_fileh.close()
+
+    print "\n%d configs, %d checked this run, %d with violations.  See %s/audit.log\n" % (
+        len(results), checked, failed, cust_dir)
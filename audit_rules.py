@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+'''
+This module holds the compliance rule engine used by audit_configs.py.
+
+Rules are read from a rules file, one rule per line, fields separated by a
+| with whitespace either side.  Regexes are searched against single lines.
+
+# name          | type    | regex
+svc-pwd-enc     | require | ^service password-encryption
+no-public-snmp  | forbid  | ^snmp-server community public
+# name          | type    | section   | when                   | check   | regex
+access-portfast | section | ^interface Gi | switchport mode access | require | spanning-tree portfast
+
+require - at least one line of the config must match
+forbid  - no line of the config may match, every matching line is reported
+section - for every section (an unindented line and the indented lines
+          below it) whose first line matches, and whose body has a line
+          matching when (use - for when to check every section), the body
+          must have (require) or must not have (forbid) a line matching regex
+
+All of the rules are compiled into combined matchers so each config is read
+once and each line is tested against every rule in a couple of regex calls,
+rather than once per rule.  A regex with inline flags such as (?i), named
+groups or backreferences would change the other rules or stop matching once
+combined, those are matched on their own.
+'''
+
+import hashlib
+import re
+
+
+# Python 2 re allows 100 groups per pattern, leave room for the rules' own
+MAX_GROUPS = 90
+
+# Inline flags, named groups, backreferences and group conditionals only
+# work in a pattern of their own
+SOLO_RE = re.compile(r"\(\?[iLmsux]+\)|\(\?P[<=]|\(\?\(|\\[1-9]")
+
+
+class RuleError(Exception):
+
+    '''
+    Raised for a line in the rules file that cannot be used
+    '''
+
+
+class CombinedMatcher(object):
+
+    '''
+    Matches a line against many regexes at once.  A plain alternation of all
+    the patterns rejects lines that match nothing in a single search, lines
+    that do match are run through a chain of optional lookaheads which
+    captures every pattern that matches.
+    '''
+
+    def __init__(self, patterns):
+        self.batches = []
+        self.solo = []
+        batch = []
+        groups = 0
+        for index, pattern in enumerate(patterns):
+            if SOLO_RE.search(pattern):
+                self.solo.append((index, re.compile(pattern)))
+                continue
+            size = re.compile(pattern).groups + 1
+            if batch and groups + size > MAX_GROUPS:
+                self.batches.append(self._compile(batch))
+                batch = []
+                groups = 0
+            batch.append((index, pattern, size))
+            groups += size
+        if batch:
+            self.batches.append(self._compile(batch))
+
+    def _compile(self, batch):
+        prefilter = re.compile("|".join(["(?:%s)" % pattern for index, pattern, size in batch]))
+        parts = []
+        slots = []
+        group = 1
+        for index, pattern, size in batch:
+            parts.append("(?:(?=.*?(%s)))?" % pattern)
+            slots.append((group, index))
+            group += size
+        return prefilter, re.compile("".join(parts)), slots
+
+    def matches(self, line):
+
+        '''
+        Returns the indexes of every pattern that matches the line
+        '''
+
+        hits = []
+        for prefilter, matcher, slots in self.batches:
+            if not prefilter.search(line):
+                continue
+            found = matcher.match(line)
+            for group, index in slots:
+                if found.group(group) is not None:
+                    hits.append(index)
+        for index, pattern in self.solo:
+            if pattern.search(line):
+                hits.append(index)
+        return hits
+
+
+class RuleSet(object):
+
+    '''
+    A compiled set of rules.  version is a digest of the rules so cached
+    results can be tied to the rules that produced them.
+    '''
+
+    def __init__(self, rules, version):
+        self.version = version
+        self.line_rules = [rule for rule in rules if rule['type'] != 'section']
+        self.section_rules = [rule for rule in rules if rule['type'] == 'section']
+
+        self.line_matcher = CombinedMatcher([rule['regex'] for rule in self.line_rules])
+        self.header_matcher = CombinedMatcher([rule['section'] for rule in self.section_rules])
+        # when and the section check are both tested against body lines
+        body_patterns = []
+        for rule in self.section_rules:
+            body_patterns.append(rule['when'] or '')
+            body_patterns.append(rule['regex'])
+        self.body_matcher = CombinedMatcher(body_patterns)
+
+    def evaluate(self, lines):
+
+        '''
+        Checks an iterable of config lines (an open file will do), returns a
+        list of violations, each (rule name, line number, line)
+        '''
+
+        violations = []
+        required = set(index for index, rule in enumerate(self.line_rules)
+                       if rule['type'] == 'require')
+        section = None
+
+        for lineno, line in enumerate(lines, 1):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+
+            if line[0] not in ' \t':
+                if section:
+                    violations.extend(self._check_section(*section))
+                headers = self.header_matcher.matches(line)
+                section = (lineno, line, headers, set()) if headers else None
+            elif section:
+                section[3].update(self.body_matcher.matches(line))
+
+            for index in self.line_matcher.matches(line):
+                rule = self.line_rules[index]
+                if rule['type'] == 'forbid':
+                    violations.append((rule['name'], lineno, line))
+                else:
+                    required.discard(index)
+
+        if section:
+            violations.extend(self._check_section(*section))
+
+        for index in sorted(required):
+            violations.append((self.line_rules[index]['name'], 0, "missing: " + self.line_rules[index]['regex']))
+
+        return violations
+
+    def _check_section(self, lineno, header, headers, body_hits):
+        violations = []
+        for index in headers:
+            rule = self.section_rules[index]
+            if rule['when'] and index * 2 not in body_hits:
+                continue
+            present = index * 2 + 1 in body_hits
+            if present != (rule['check'] == 'require'):
+                violations.append((rule['name'], lineno, header))
+        return violations
+
+
+def parse_rules(text):
+
+    '''
+    Converts the text of a rules file into a list of rule dicts, raises
+    RuleError for a line that cannot be used
+    '''
+
+    rules = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = re.split(r'\s+\|\s+', line)
+        fields = [field.strip() for field in fields]
+
+        if len(fields) == 3 and fields[1] in ('require', 'forbid'):
+            rule = {'name': fields[0], 'type': fields[1], 'regex': fields[2]}
+        elif len(fields) == 6 and fields[1] == 'section' and fields[4] in ('require', 'forbid'):
+            rule = {'name': fields[0], 'type': 'section', 'section': fields[2],
+                    'when': '' if fields[3] == '-' else fields[3],
+                    'check': fields[4], 'regex': fields[5]}
+        else:
+            raise RuleError("Rules line %d not understood: %s" % (lineno, line))
+
+        for name in ('regex', 'section', 'when'):
+            try:
+                re.compile(rule.get(name) or '')
+            except re.error as err:
+                raise RuleError("Rules line %d bad regex (%s): %s" % (lineno, err, line))
+        rules.append(rule)
+    return rules
+
+
+def load_rules(filename):
+
+    '''
+    Reads and compiles a rules file
+    '''
+
+    fileh = open(filename)
+    text = fileh.read()
+    fileh.close()
+    return RuleSet(parse_rules(text), hashlib.sha1(text).hexdigest())
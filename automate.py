@@ -24,12 +24,7 @@ Automation Tasks:
 '''
 
 
-import netmiko
-import paramiko
 import getpass
-import telnetlib
-import sys
-import re
 
 
 '''
@@ -132,6 +127,11 @@ if __name__ == "__main__":
 
     print
 
+    # netmiko pulls in a large dependency tree, only load it once there is
+    # work for it rather than to draw the menu
+    import netmiko
+    import paramiko
+
 
     '''
     Read the customer file to determine the folder and a list of IPs
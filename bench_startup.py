@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+'''
+This module measures how long each tool takes to start, i.e. to import,
+against a budget.  Each import is timed in a fresh interpreter RUNS times and
+the median is compared with the budget, the interpreter's own start up is
+shown but not counted.  Importing a tool must not load any of the HEAVY
+modules, they are left for when a device is contacted.
+
+bench_startup.py              checks every tool against BUDGET
+bench_startup.py 0.05         checks against a 50ms budget
+
+Exits 1 if a tool is over budget or loads a heavy module, so it can be run
+before committing.
+'''
+
+import subprocess
+import sys
+import time
+
+from nettools import TOOLS
+
+
+'''
+Functions
+'''
+
+# Seconds a tool may add to the start of a bare interpreter
+BUDGET = 0.05
+
+RUNS = 7
+
+HEAVY = ("paramiko", "netmiko", "telnetlib", "Crypto", "cryptography")
+
+PROBE = r'''
+import sys, time
+started = time.time()
+%s
+took = time.time() - started
+print "%%f %%s" %% (took, ",".join(sorted(name for name in %r if name in sys.modules)))
+'''
+
+
+def time_import(statement):
+
+    '''
+    Returns (median seconds, heavy modules loaded) for an import statement
+    run in a fresh interpreter
+    '''
+
+    timings = []
+    heavy = ""
+    for run in range(RUNS):
+        output = subprocess.check_output([sys.executable, "-c", PROBE % (statement, HEAVY)])
+        took, heavy = (output.strip().split(" ") + [""])[:2]
+        timings.append(float(took))
+    timings.sort()
+    return timings[len(timings) / 2], heavy
+
+
+def interpreter_start():
+
+    '''
+    Median wall time of starting an interpreter that does nothing
+    '''
+
+    timings = []
+    for run in range(RUNS):
+        started = time.time()
+        subprocess.check_call([sys.executable, "-c", "pass"])
+        timings.append(time.time() - started)
+    timings.sort()
+    return timings[len(timings) / 2]
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET
+    failed = False
+
+    print "\nInterpreter start up %.0fms, budget per tool %.0fms\n" % (
+        interpreter_start() * 1000, budget * 1000)
+
+    for name, module, description in TOOLS + [("nettools", "nettools", "")]:
+        try:
+            took, heavy = time_import("import " + module)
+        except subprocess.CalledProcessError:
+            print "%-20s  import failed" % module
+            failed = True
+            continue
+        verdict = "ok"
+        if took > budget:
+            verdict = "OVER BUDGET"
+            failed = True
+        if heavy:
+            verdict = "loads " + heavy
+            failed = True
+        print "%-20s %6.1fms  %s" % (module, took * 1000, verdict)
+
+    print
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+'''
+This module collects an operational snapshot from all devices held in a
+customer .info file.  Each device gets a single session in which the
+SNAPSHOT_COMMANDS are run, the output of each is parsed with its template
+(see show_parsers.py) and appended to <customer dir>/snapshots.db.  Every
+record of a run carries the same capture time so a run can be compared with
+the last one.
+
+The tables are indexed on device and capture time and on the values named in
+each template's index lines (MAC, IP, prefix, interface), so questions such
+as where a MAC address was seen over the last week are index lookups:
+
+collect_snapshots.py                        collects a snapshot
+collect_snapshots.py mac 0011.2233.4455 7   where was this MAC in the last 7 days
+collect_snapshots.py ip 10.1.2.3 7          which ARP tables had this IP
+
+Please see grab_configs.py for more info on constructing the .info file
+'''
+
+import datetime
+import getpass
+import sys
+
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from toolkit import clean_ansi_stream
+from session_cache import SessionCache
+from pipeline import read_inventory
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import fetch
+from pipeline import run_pipeline
+from concurrency import AdaptiveLimiter
+from show_parsers import load_templates
+from show_parsers import find_template
+from show_parsers import chunk_lines
+from show_parsers import to_mac
+from record_store import RecordStore
+
+'''
+Functions
+'''
+
+SNAPSHOT_COMMANDS = [
+    "show ip arp",
+    "show mac address-table",
+    "show ip route",
+    "show interfaces",
+]
+
+# What the query forms on the command line look up: table and column
+QUERIES = {
+    'mac': [('show_mac_address_table', 'mac'), ('show_ip_arp', 'mac')],
+    'ip': [('show_ip_arp', 'address')],
+    'prefix': [('show_ip_route', 'prefix')],
+}
+
+def collect_snapshot(device, username, password, cache, templates, store, captured):
+
+    '''
+    Pipeline job, runs every snapshot command in one session and stores the
+    records.  A command the device does not support just gives no records.
+    '''
+
+    session, shell = open_device(device, username, password, cache)
+    counts = []
+    try:
+        for number, (command, template) in enumerate(templates):
+            chunks = fetch(session, shell, device, command, wait=15, prepare=(number == 0))
+            records = template.parse(chunk_lines(clean_ansi_stream(chunks)))
+            counts.append(store.add(template, device['ip'], records, captured))
+    finally:
+        close_device(session, shell)
+
+    return "", "[ %s records ]" % "/".join([str(count) for count in counts]), "Snapshot collected."
+
+def find_records(store, kind, value, days):
+
+    '''
+    This function looks a MAC, IP or prefix up in the snapshot tables,
+    returns (table, row) pairs newest first
+    '''
+
+    if kind == 'mac':
+        value = to_mac(value)
+    since = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat(' ')
+    found = []
+    for table, field in QUERIES[kind]:
+        for row in store.query(table, field, value, since):
+            found.append((table, row))
+    return found
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    if len(sys.argv) > 2 and sys.argv[1] in QUERIES:
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        (cust_dir, devices) = read_inventory(cust)
+        days = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+        store = RecordStore(cust_dir, formats=('sqlite',), db_name="snapshots.db")
+        for table, row in find_records(store, sys.argv[1], sys.argv[2], days):
+            details = ", ".join(["%s %s" % (key, row[key]) for key in sorted(row)
+                                 if key not in ('device', 'captured') and row[key] is not None])
+            print "%s  %-15s  %-24s %s" % (row['captured'][:19], row['device'], table, details)
+        sys.exit(0)
+
+    print "\n============================"
+    print "Collect operational snapshot"
+    print "============================\n"
+
+    while True:
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
+        password = getpass.getpass("Input SSH password: ")
+        in_flight = raw_input_def("Input max concurrent sessions [8]: ", "8")
+
+        print "\n"
+        print cust
+        print username
+        print "**PASSWORD HIDDEN**"
+        print in_flight
+
+        yesno = raw_input("\nAre these details correct [y/n]: ").lower()
+        print
+        if yesno == "y" and in_flight.isdigit() and int(in_flight) > 0:
+            break
+
+    (cust_dir, devices) = read_inventory(cust)
+    session_cache = SessionCache(cust_dir)
+    store = RecordStore(cust_dir, formats=('sqlite',), db_name="snapshots.db")
+
+    all_templates = load_templates()
+    templates = [(command, find_template(all_templates, command)) for command in SNAPSHOT_COMMANDS]
+    captured = datetime.datetime.now().isoformat(' ')
+
+    print "Records per device: %s\n" % " / ".join(SNAPSHOT_COMMANDS)
+
+    def report(device, name, screen, status):
+        print "%-15s > %s" % (device['ip'], screen)
+        status_update(cust_dir, device['ip'], name, status)
+
+    def job(device):
+        return collect_snapshot(device, username, password, session_cache, templates, store, captured)
+
+    run_pipeline(devices, job, report, int(in_flight), limiter=AdaptiveLimiter(int(in_flight)))
+
+    session_cache.save()
+
+    '''
+    All done!
+    '''
+
+    print "\nSnapshot %s stored in %s/snapshots.db\n" % (captured[:19], cust_dir)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+'''
+This module is the compute tier of the pipeline.  The worker threads in
+pipeline.py only do network I/O: they stream the raw output to a scratch
+file and hand the file name to a ComputePool, whose processes do the CPU
+work (ANSI clean up, hostname, normalised digest, template parsing) on all
+cores, out of reach of the GIL the sessions run under.
+
+io workers (threads) --file name--> ComputePool (processes) --small dict-->
+    finisher thread (rename, session cache, search index, report)
+
+Only file names and small results cross between the tiers, never the
+output itself.  At most max_pending tasks are queued for the pool, a worker
+thread that gets ahead of the pool waits in submit(), so the scratch files
+on disk are bounded too.
+
+A job hands its compute work back to run_pipeline as a Deferred, the worker
+thread is then free for the next device while the pool catches up.
+'''
+
+import os
+import threading
+import traceback
+
+from toolkit import clean_ansi_stream
+from toolkit import sniff_hostname
+from normalise import digest_stream
+
+
+CHUNK_SIZE = 65536
+
+
+def _read_chunks(fileh):
+    return iter(lambda: fileh.read(CHUNK_SIZE), '')
+
+
+def sanitise_file(filename, hp=False, shell=False):
+
+    '''
+    Pool task.  Cleans the ANSI codes out of a capture in place (HP), finds
+    the hostname and the normalised digest.  Returns {'hostname': ...,
+    'digest': ...}, hostname is missing if there is none.
+    '''
+
+    found = {}
+    fileh = open(filename, "rb")
+    chunks = _read_chunks(fileh)
+    if hp:
+        chunks = clean_ansi_stream(chunks)
+    chunks = sniff_hostname(digest_stream(chunks, found, shell), found)
+    if hp:
+        clean = filename + ".clean"
+        outh = open(clean, "wb")
+        for chunk in chunks:
+            outh.write(chunk)
+        outh.close()
+        fileh.close()
+        os.rename(clean, filename)
+    else:
+        for chunk in chunks:
+            pass
+        fileh.close()
+    return found
+
+
+# Templates loaded once per pool process
+worker_templates = None
+
+def parse_file(filename, template_name):
+
+    '''
+    Pool task.  Cleans a capture in place and parses it with the named
+    template (see show_parsers.py), returns the records
+    '''
+
+    global worker_templates
+    from show_parsers import load_templates
+    if worker_templates is None:
+        worker_templates = dict((template.name, template) for template in load_templates())
+
+    fileh = open(filename, "rb")
+    clean = filename + ".clean"
+    outh = open(clean, "wb")
+    for chunk in clean_ansi_stream(_read_chunks(fileh)):
+        outh.write(chunk)
+    outh.close()
+    fileh.close()
+    os.rename(clean, filename)
+
+    if not template_name:
+        return []
+    fileh = open(filename, "rb")
+    records = list(worker_templates[template_name].parse(fileh))
+    fileh.close()
+    return records
+
+
+def _run_task(func, args):
+    # The pool only calls back on success, so errors come back as values
+    try:
+        return True, func(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+class ComputeError(Exception):
+
+    '''
+    Raised by Deferred.result() when the pool task failed, carries the
+    task's traceback
+    '''
+
+
+class Deferred(object):
+
+    '''
+    A pool task plus what to do with its result.  result() waits for the
+    task and returns then(value), the (name, screen, status) of the job.  If
+    the task failed, failed() is called to clean up before ComputeError is
+    raised.
+    '''
+
+    def __init__(self, async_result, then, failed=None):
+        self.async_result = async_result
+        self.then = then
+        self.failed = failed
+
+    def result(self):
+        ok, value = self.async_result.get()
+        if not ok:
+            if self.failed:
+                self.failed()
+            raise ComputeError(value.strip().splitlines()[-1])
+        return self.then(value)
+
+
+class ComputePool(object):
+
+    '''
+    The process pool, safe to submit to from the pipeline worker threads
+    '''
+
+    def __init__(self, processes=None, max_pending=None):
+        # Only the tools that post-process pay for loading multiprocessing
+        import multiprocessing
+
+        self.pool = multiprocessing.Pool(processes)
+        processes = processes or multiprocessing.cpu_count()
+        self.slots = threading.BoundedSemaphore(max_pending or processes * 4)
+
+    def submit(self, func, args, then, failed=None):
+
+        '''
+        Queues func(*args) on the pool, blocks while max_pending tasks are
+        already queued.  Returns a Deferred that applies then to the result.
+        '''
+
+        self.slots.acquire()
+        try:
+            async_result = self.pool.apply_async(_run_task, (func, args),
+                                                 callback=lambda value: self.slots.release())
+        except Exception:
+            self.slots.release()
+            raise
+        return Deferred(async_result, then, failed)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+'''
+This module holds the adaptive concurrency limiter used by run_pipeline (see
+pipeline.py).  Instead of one fixed number of sessions for the whole run,
+each site gets its own limit which is tuned from what the devices at that
+site do:
+
+- a limit starts at INITIAL_LIMIT and grows by one for every device that
+  completes (slow start) until the site first shows congestion, after that
+  it grows by 1/limit per device (additive increase)
+- a connection error, or a connect time more than SLOW_FACTOR times the
+  fastest seen at the site, halves the limit (multiplicative decrease), at
+  most once per limit's worth of devices so one burst of timeouts only
+  counts once
+- after AUTH_LIMIT authentication failures in a row at a site, the rest of
+  its devices are skipped rather than risk locking the account out
+
+A site is the :site,<name> option of a device in the .info file, the bastion
+for devices with a :jump option, or else its /24.  The max concurrent
+sessions entered by the user is the ceiling for the whole run, and so for
+any one site.
+
+Devices for a site at its limit are parked and started as the site's
+sessions finish, so a slow WAN site never holds up the rest of the estate.
+The number parked is bounded, the .info file is still read as work frees up.
+'''
+
+import collections
+import threading
+
+
+INITIAL_LIMIT = 2
+
+# Connect times this much slower than the site's best count as congestion,
+# unless under MIN_SLOW seconds
+SLOW_FACTOR = 3
+MIN_SLOW = 1.0
+
+AUTH_LIMIT = 3
+
+# submit() verdicts
+RUN = 'run'
+PARKED = 'parked'
+HELD = 'held'
+
+
+def site_key(device):
+
+    '''
+    The site a device belongs to, its :site option, its bastion or its /24
+    '''
+
+    if device.get('site'):
+        return device['site']
+    if device.get('jump'):
+        # What a bastion can take matters more than where the device is
+        return "via " + device['jump']
+    return ".".join(device['ip'].split('.')[:3]) + ".0/24"
+
+
+class Site(object):
+
+    '''
+    The limit and sessions of one site
+    '''
+
+    def __init__(self, ceiling):
+        self.ceiling = ceiling
+        self.limit = float(min(INITIAL_LIMIT, ceiling))
+        self.active = 0
+        self.parked = collections.deque()
+        self.slow_start = True
+        self.since_decrease = ceiling
+        self.baseline = None
+        self.auth_failures = 0
+        self.held = False
+
+    def has_room(self):
+        return self.active < int(self.limit)
+
+    def increase(self):
+        if self.slow_start:
+            self.limit += 1
+        else:
+            self.limit += 1.0 / self.limit
+        self.limit = min(self.limit, float(self.ceiling))
+
+    def decrease(self):
+        if self.since_decrease < int(self.limit):
+            return
+        self.limit = max(1.0, self.limit / 2)
+        self.slow_start = False
+        self.since_decrease = 0
+
+    def congested(self, connect):
+
+        '''
+        Latency check, also keeps the baseline.  The baseline is the fastest
+        connect seen, drifting slowly up so one lucky connect does not make
+        every later one look slow.
+        '''
+
+        if connect is None:
+            return False
+        if self.baseline is None or connect < self.baseline:
+            self.baseline = connect
+        else:
+            self.baseline += (connect - self.baseline) * 0.05
+        return connect > MIN_SLOW and connect > self.baseline * SLOW_FACTOR
+
+
+class AdaptiveLimiter(object):
+
+    '''
+    Decides when each device may start, safe to share between the pipeline
+    worker threads.  At most max_in_flight devices run at once, at most
+    backlog are parked.
+    '''
+
+    def __init__(self, max_in_flight, backlog=None):
+        self.max_in_flight = max_in_flight
+        self.backlog = backlog or max_in_flight * 4
+        self.cond = threading.Condition()
+        self.sites = {}
+        self.parked_sites = set()
+        self.waiting = 0
+        self.running = 0
+
+    def _site(self, key):
+        if key not in self.sites:
+            self.sites[key] = Site(self.max_in_flight)
+        return self.sites[key]
+
+    def submit(self, device):
+
+        '''
+        Returns RUN if the device can start now, PARKED if it will be handed
+        back by finish() later, HELD if its site is being skipped.  Blocks
+        while max_in_flight devices are running or the backlog is full.
+        '''
+
+        with self.cond:
+            while self.waiting >= self.backlog or self.running >= self.max_in_flight:
+                self.cond.wait()
+            key = site_key(device)
+            site = self._site(key)
+            if site.held:
+                return HELD
+            if site.has_room():
+                site.active += 1
+                self.running += 1
+                return RUN
+            site.parked.append(device)
+            self.parked_sites.add(key)
+            self.waiting += 1
+            return PARKED
+
+    def finish(self, device, status, connect=None):
+
+        '''
+        Records how a device went, status is the activity.log status and
+        connect the seconds open_device took (None if it was not called).
+        Returns a list of (device, verdict) for parked devices that can now
+        be run, or must be skipped because their site is held.
+        '''
+
+        with self.cond:
+            site = self._site(site_key(device))
+            site.active -= 1
+            self.running -= 1
+            site.since_decrease += 1
+
+            if status.startswith("*** Authentication failed"):
+                site.auth_failures += 1
+                if site.auth_failures >= AUTH_LIMIT:
+                    site.held = True
+            elif not status.startswith("***"):
+                site.auth_failures = 0
+
+            if status.startswith("*** Connection error") or site.congested(connect):
+                site.decrease()
+            elif not status.startswith("***"):
+                site.increase()
+
+            released = self._release()
+            self.cond.notify_all()
+            return released
+
+    def _release(self):
+
+        # A session has finished, its site may have room again, or another
+        # site's parked device was only waiting on the run's ceiling
+        released = []
+        for key in list(self.parked_sites):
+            site = self.sites[key]
+            while site.parked and (site.held or (site.has_room() and
+                                                 self.running < self.max_in_flight)):
+                parked = site.parked.popleft()
+                self.waiting -= 1
+                if site.held:
+                    released.append((parked, HELD))
+                else:
+                    site.active += 1
+                    self.running += 1
+                    released.append((parked, RUN))
+            if not site.parked:
+                self.parked_sites.discard(key)
+        return released
+
+    def wait_idle(self):
+
+        '''
+        Blocks until every device submitted has finished
+        '''
+
+        with self.cond:
+            while self.waiting or self.running:
+                self.cond.wait()
+
+    def limits(self):
+
+        '''
+        Returns site -> current limit, for the sites below the ceiling
+        '''
+
+        with self.cond:
+            return dict((key, int(site.limit)) for key, site in self.sites.items()
+                        if int(site.limit) < self.max_in_flight)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+'''
+This module renders per device config from a template.  A template is the
+config lines with {name} where a per device value goes:
+
+interface Vlan{vlan}
+ description {site} users
+ ip address {user_gw} 255.255.255.0
+ ip helper-address {dhcp|10.0.0.5}      {name|default} if there is no value
+snmp-server location {{{site}}}         {{ and }} are literal braces
+
+The values for a device come from, later ones winning:
+
+- ip, site and hostname (the hostname last seen, see session_cache.py)
+- <customer dir>/vars.csv, a row per device keyed on ip or hostname (the
+  first column) and a column per name.  A row keyed * gives the defaults.
+- :var,<name>,<value> options on the device's line in the .info file
+
+A device without a value for a name that has no default is not rendered.
+
+Templates are compiled once.  Rendering only looks at the names the template
+uses, so devices with the same values for those share one render (a template
+that only uses {site} is rendered once per site).  render_all spreads big
+inventories over a process pool.
+'''
+
+import csv
+import re
+
+
+FIELD_RE = re.compile(r"\{\{|\}\}|\{(\w+)(?:\|([^{}]*))?\}")
+
+# Below this many devices the pool costs more than it saves
+PARALLEL_MIN = 5000
+
+
+class RenderError(Exception):
+
+    '''
+    Raised when a device cannot be rendered
+    '''
+
+
+class ConfigTemplate(object):
+
+    '''
+    A compiled config template
+    '''
+
+    def __init__(self, text, name="template"):
+        self.name = name
+        self.text = text
+        self.parts = []
+        self.fields = []
+        self.renders = {}
+
+        position = 0
+        for field_re in FIELD_RE.finditer(text):
+            self.parts.append(text[position:field_re.start()])
+            if field_re.group(1):
+                self.parts.append((field_re.group(1), field_re.group(2)))
+                if field_re.group(1) not in self.fields:
+                    self.fields.append(field_re.group(1))
+            else:
+                self.parts.append(field_re.group(0)[0])
+            position = field_re.end()
+        self.parts.append(text[position:])
+
+    def render(self, variables):
+
+        '''
+        Returns the rendered lines for one device's values
+        '''
+
+        key = tuple(variables.get(field) for field in self.fields)
+        if key in self.renders:
+            return self.renders[key]
+
+        text = []
+        for part in self.parts:
+            if not isinstance(part, tuple):
+                text.append(part)
+                continue
+            value = variables.get(part[0])
+            if value is None or value == "":
+                if part[1] is None:
+                    raise RenderError("%s: no value for %s" % (self.name, part[0]))
+                value = part[1]
+            text.append(value)
+        lines = [line.rstrip() for line in "".join(text).splitlines() if line.strip()]
+        self.renders[key] = lines
+        return lines
+
+
+def load_config_template(filename):
+    fileh = open(filename)
+    text = fileh.read()
+    fileh.close()
+    return ConfigTemplate(text, filename)
+
+
+def load_vars(folder):
+
+    '''
+    Reads <customer dir>/vars.csv, returns (defaults, rows) where rows is
+    keyed on the first column (ip or hostname).  Both are empty if there is
+    no file.
+    '''
+
+    try:
+        fileh = open("".join([folder, "/vars.csv"]), "rb")
+    except IOError:
+        return {}, {}
+    reader = csv.reader(fileh)
+    header = [name.strip() for name in next(reader, [])]
+    rows = {}
+    for row in reader:
+        if not row or not row[0].strip() or row[0].startswith('#'):
+            continue
+        rows[row[0].strip()] = dict((name, value.strip()) for name, value in zip(header[1:], row[1:])
+                                    if value.strip())
+    fileh.close()
+    return rows.pop('*', {}), rows
+
+
+def device_vars(device, sidecar, hostname=None):
+
+    '''
+    Merges the values for a device, sidecar is what load_vars returned
+    '''
+
+    defaults, rows = sidecar
+    variables = {'ip': device['ip'], 'site': device.get('site') or "", 'hostname': hostname or ""}
+    variables.update(defaults)
+    if hostname:
+        variables.update(rows.get(hostname, {}))
+    variables.update(rows.get(device['ip'], {}))
+    variables.update(device.get('vars') or {})
+    return variables
+
+
+# Set in each pool worker by init_worker so the template is compiled once per process
+worker_template = None
+
+def init_worker(text, name):
+    global worker_template
+    worker_template = ConfigTemplate(text, name)
+
+def render_task(task):
+
+    '''
+    Pool task, task is (ip, variables).  Returns (ip, lines, error)
+    '''
+
+    host_ip, variables = task
+    try:
+        return host_ip, worker_template.render(variables), None
+    except RenderError as err:
+        return host_ip, None, str(err)
+
+
+def render_all(template, tasks, processes=None):
+
+    '''
+    Renders a list of (ip, variables), returns a dict of ip -> (lines,
+    error), one of which is None.  Big lists are rendered on a process pool.
+    '''
+
+    results = {}
+    if len(tasks) < PARALLEL_MIN:
+        for host_ip, variables in tasks:
+            try:
+                results[host_ip] = (template.render(variables), None)
+            except RenderError as err:
+                results[host_ip] = (None, str(err))
+        return results
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes, init_worker, (template.text, template.name))
+    try:
+        for host_ip, lines, error in pool.imap_unordered(render_task, tasks, 500):
+            results[host_ip] = (lines, error)
+    finally:
+        pool.close()
+        pool.join()
+    return results
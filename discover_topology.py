@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+'''
+This module discovers the network from the seed devices in a customer .info
+file by crawling CDP and LLDP neighbours breadth first.  Each level of the
+crawl is collected in parallel.  Neighbours are deduplicated on chassis ID
+(the CDP device ID where LLDP is not running) so a device with several
+management addresses is only crawled once, phones and access points are not
+crawled at all.
+
+The neighbours are kept in <customer dir>/neighbours.json (see topology.py),
+devices whose neighbours were collected in the last day are not contacted
+again, so a refresh only touches the stale part of the network.
+
+The result is written as <customer dir>/discovered.info, in the usual .info
+format, devices that could not be reached are # out.
+
+The graph can then be queried without touching the network:
+
+discover_topology.py                        crawl from the seeds
+discover_topology.py path sw1 sw9           the devices between sw1 and sw9
+discover_topology.py blast dist1            devices cut off from the seeds
+                                            if dist1 goes down
+discover_topology.py blast dist1 core1      ... cut off from core1
+
+Please see grab_configs.py for more info on constructing the .info file
+'''
+
+import getpass
+import re
+import sys
+
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from toolkit import clean_ansi_stream
+from session_cache import SessionCache
+from pipeline import read_inventory
+from pipeline import parse_device
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import fetch
+from pipeline import run_pipeline
+from show_parsers import load_templates
+from show_parsers import chunk_lines
+from topology import NeighbourCache
+from topology import is_network_device
+from topology import shortest_path
+from topology import blast_radius
+
+'''
+Functions
+'''
+
+NEIGHBOUR_COMMANDS = [
+    ("show cdp neighbors detail", "show_cdp_neighbors_detail"),
+    ("show lldp neighbors detail", "show_lldp_neighbors_detail"),
+]
+
+HP_RE = re.compile(r"ProCurve|Aruba|Hewlett|HP ", re.I)
+
+def crawl_device(device, username, password, cache, neighbours, templates):
+
+    '''
+    Pipeline job, collects the CDP and LLDP neighbours of a device
+    '''
+
+    records = []
+    session, shell = open_device(device, username, password, cache)
+    try:
+        for number, (command, name) in enumerate(NEIGHBOUR_COMMANDS):
+            chunks = fetch(session, shell, device, command, wait=10, prepare=(number == 0))
+            records.extend(templates[name].parse(chunk_lines(clean_ansi_stream(chunks))))
+    finally:
+        close_device(session, shell)
+
+    neighbours.set_neighbours(device['ip'], records)
+    return "", "[ %d neighbours ]" % len(records), "Neighbours collected."
+
+def crawl(seeds, job, folder, neighbours, in_flight, max_depth):
+
+    '''
+    This function crawls breadth first from the seeds, a level at a time.
+    Returns a list of (device, reached) in the order found.
+    '''
+
+    found = []
+    seen_ips = set(device['ip'] for device in seeds)
+    seen_ids = set()
+    frontier = seeds
+    depth = 0
+
+    while frontier and depth <= max_depth:
+        stale = [device for device in frontier if neighbours.stale(device['ip'])]
+        failed = set()
+
+        def report(device, name, screen, status):
+            print "%-15s > %s" % (device['ip'], screen)
+            status_update(folder, device['ip'], name, status)
+            if status.startswith("***"):
+                failed.add(device['ip'])
+
+        print "\nLevel %d: %d devices, %d to collect\n" % (depth, len(frontier), len(stale))
+        run_pipeline(iter(stale), job, report, in_flight)
+
+        next_frontier = []
+        for device in frontier:
+            found.append((device, device['ip'] not in failed))
+            if device['ip'] in failed:
+                continue
+            for port in neighbours.get(device['ip']).get('ports', {}).values():
+                host_ip = port['neighbour_ip']
+                identity = port['chassis'] or host_ip
+                if not host_ip or not is_network_device(port):
+                    continue
+                if port['neighbour']:
+                    neighbours.update(host_ip, hostname=port['neighbour'])
+                if identity in seen_ids or host_ip in seen_ips:
+                    seen_ids.add(identity)
+                    continue
+                seen_ids.add(identity)
+                seen_ips.add(host_ip)
+                line = host_ip
+                if HP_RE.search(port['platform'] or ''):
+                    line += ":model,hp"
+                found_device = parse_device(line)
+                # Behind the same bastion as the device that saw it
+                for option in ('jump', 'jump_username', 'jump_password'):
+                    found_device[option] = device[option]
+                next_frontier.append(found_device)
+
+        frontier = next_frontier
+        depth += 1
+
+    return found
+
+def device_line(device):
+
+    '''
+    This function turns a device dict back into a line of a .info file
+    '''
+
+    line = device['ip']
+    if device['hp']:
+        line += ":model,hp"
+    if device['telnet']:
+        line += ":conn,telnet"
+    if device['username']:
+        line += ":user," + ",".join([device['username'], device['password']] +
+                                    ([device['enable']] if device['enable'] else []))
+    if device['site']:
+        line += ":site," + device['site']
+    if device['jump']:
+        jump = [device['jump']]
+        if device['jump_username']:
+            jump += [device['jump_username'], device['jump_password']]
+        line += ":jump," + ",".join(jump)
+    for name, value in sorted(device['vars'].items()):
+        line += ":var,%s,%s" % (name, value)
+    return line
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    if len(sys.argv) > 2 and sys.argv[1] in ('path', 'blast'):
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        (cust_dir, devices) = read_inventory(cust)
+        neighbours = NeighbourCache(cust_dir)
+        (graph, addresses) = neighbours.graph()
+
+        if sys.argv[1] == 'path' and len(sys.argv) > 3:
+            path = shortest_path(graph, sys.argv[2], sys.argv[3])
+            if not path:
+                print "\nNo path between %s and %s in the cached graph.\n" % tuple(sys.argv[2:4])
+            else:
+                print "\n" + " -> ".join(path) + "\n"
+        else:
+            roots = sys.argv[3:]
+            if not roots:
+                names = dict((host_ip, name) for name, host_ip in addresses.items())
+                roots = [names.get(device['ip'], device['ip']) for device in devices
+                         if not device['skip']]
+            cut_off = blast_radius(graph, roots, sys.argv[2])
+            print "\n%d devices cut off if %s goes down:\n" % (len(cut_off), sys.argv[2])
+            for name in sorted(cut_off):
+                print "%-30s %s" % (name, addresses.get(name, ""))
+            print
+        sys.exit(0)
+
+    print "\n================="
+    print "Discover topology"
+    print "=================\n"
+
+    while True:
+        cust = raw_input_def("Input the seed info file [%s]: " % def_cust, def_cust)
+        username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
+        password = getpass.getpass("Input SSH password: ")
+        max_depth = raw_input_def("Input max hops from the seeds [10]: ", "10")
+        in_flight = raw_input_def("Input max concurrent sessions [16]: ", "16")
+
+        print "\n"
+        print cust
+        print username
+        print "**PASSWORD HIDDEN**"
+        print max_depth, in_flight
+
+        yesno = raw_input("\nAre these details correct [y/n]: ").lower()
+        print
+        if yesno == "y" and max_depth.isdigit() and in_flight.isdigit() and int(in_flight) > 0:
+            break
+
+    (cust_dir, devices) = read_inventory(cust)
+    seeds = [device for device in devices if not device['skip']]
+
+    session_cache = SessionCache(cust_dir)
+    neighbours = NeighbourCache(cust_dir)
+    templates = dict((template.name, template) for template in load_templates())
+
+    def job(device):
+        return crawl_device(device, username, password, session_cache, neighbours, templates)
+
+    found = crawl(seeds, job, cust_dir, neighbours, int(in_flight), int(max_depth))
+
+    neighbours.save()
+    session_cache.save()
+
+    filename = "".join([cust_dir, "/discovered.info"])
+    fileh = open(filename, "w")
+    fileh.write(cust_dir + "\n")
+    for device, reached in found:
+        fileh.write(("" if reached else "#") + device_line(device) + "\n")
+    fileh.close()
+
+    '''
+    All done!
+    '''
+
+    print "\nDiscovered %d devices (%d reachable).  Inventory written to %s\n" % (
+        len(found), len([x for x in found if x[1]]), filename)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+
+'''
+This module exports the configs a grab changed to the downstream archive
+system.  ConfigExport streams each changed config into a single compressed
+archive (<cust_dir>/exports/<cust>-<date-time>.tar.gz or .zip) as the
+devices finish, on a thread of its own, and uploads the archive in batches
+while it is still being written, so the upload overlaps the fetch rather
+than following it.
+
+The archive is written to disk once and the batches are read back from it,
+so an upload that is cut short can be resumed from the file later (see
+export_configs.py).  Configs are added in the order the devices finish.
+
+Uploads are resumable chunked PUTs to <url>/<archive name>:
+
+PUT  Content-Range: bytes <first>-<last>/*        a batch
+PUT  Content-Range: bytes <first>-<last>/<total>  the last batch
+PUT  Content-Range: bytes */<total>               completes with no data
+PUT  Content-Range: bytes */*                     asks how much arrived
+
+The server answers 308 with "Range: bytes=0-<last>" (no Range if nothing
+arrived) while the archive is incomplete and 200 or 201 once it is
+complete.  A batch that does not start where the server's copy ends is
+answered with the 308 and is sent again from there.  The connection is
+reused between batches, a failed request is retried with back off after
+asking the server how much arrived.
+
+serve_archive() is a stand-in for the archive system, see
+"export_configs.py serve".
+'''
+
+import datetime
+import os
+import re
+import threading
+import time
+import Queue
+
+
+BATCH_BYTES = 1024 * 1024
+
+RETRIES = 5
+BACKOFF = 1.0
+BACKOFF_MAX = 30.0
+
+FORMATS = {"tgz": ".tar.gz", "zip": ".zip"}
+
+RANGE_RE = re.compile(r"bytes=0-(\d+)")
+CONTENT_RANGE_RE = re.compile(r"^bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$")
+
+# Archives that reached the archive system, one name per line
+UPLOADED_LOG = "uploaded.log"
+
+
+class UploadError(Exception):
+
+    '''
+    The archive system refused the upload or could not be reached after
+    the retries
+    '''
+
+
+def load_endpoint():
+
+    '''
+    Returns the upload URL from export.url in the tools directory, blank if
+    there is none
+    '''
+
+    try:
+        fileh = open("export.url")
+    except IOError:
+        return ""
+    url = fileh.read().strip()
+    fileh.close()
+    return url
+
+
+def export_folder(folder):
+    exports = "".join([folder, "/exports"])
+    if not os.path.isdir(exports):
+        os.mkdir(exports)
+    return exports
+
+
+def mark_uploaded(exports, name):
+    fileh = open(os.path.join(exports, UPLOADED_LOG), "a")
+    fileh.write(name + "\n")
+    fileh.close()
+
+
+def uploaded(exports):
+    try:
+        fileh = open(os.path.join(exports, UPLOADED_LOG))
+    except IOError:
+        return set()
+    names = set(line.strip() for line in fileh)
+    fileh.close()
+    return names
+
+
+class Uploader(object):
+
+    '''
+    Resumable uploads to the archive system over one reused connection.
+    Only used from one thread at a time.
+    '''
+
+    def __init__(self, url, timeout=30, retries=RETRIES):
+        # Most runs never upload, the HTTP client is loaded on demand
+        import httplib
+        import urlparse
+
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ValueError("Not an http or https URL: %s" % url)
+        self.url = url
+        self.path = parts.path.rstrip("/")
+        self.factory = httplib.HTTPSConnection if parts.scheme == "https" else httplib.HTTPConnection
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self.retries = retries
+        self.errors = (httplib.HTTPException, IOError)
+        self.conn = None
+        self.connections = 0
+        self.requests = 0
+        self.retried = 0
+        self.bytes = 0
+
+    def _request(self, name, body, content_range):
+
+        '''
+        Sends one PUT on the open connection, returns (status, Range header)
+        '''
+
+        import urllib
+
+        if self.conn is None:
+            self.conn = self.factory(self.netloc, timeout=self.timeout)
+            self.connections += 1
+        self.requests += 1
+        self.conn.request("PUT", "%s/%s" % (self.path, urllib.quote(name)), body,
+                          {"Content-Range": content_range,
+                           "Content-Type": "application/octet-stream"})
+        response = self.conn.getresponse()
+        response.read()
+        if response.getheader("connection", "").lower() == "close":
+            self.close()
+        return response.status, response.getheader("range")
+
+    def put(self, name, body, first, total=None):
+
+        '''
+        Sends a batch starting at first, total on the last batch.  Returns
+        the offset the server has received up to, None once the archive is
+        complete.  A request that fails is retried, asking the server where
+        it got to first, so the offset returned may be behind first +
+        len(body).
+        '''
+
+        if body:
+            content_range = "bytes %d-%d/%s" % (first, first + len(body) - 1,
+                                                "*" if total is None else total)
+        else:
+            content_range = "bytes */%s" % ("*" if total is None else total)
+
+        delay = BACKOFF
+        for attempt in range(self.retries + 1):
+            try:
+                status, received = self._request(name, body, content_range)
+                if status in (200, 201):
+                    self.bytes += len(body)
+                    return None
+                if status == 308:
+                    match = RANGE_RE.match(received or "")
+                    offset = int(match.group(1)) + 1 if match else 0
+                    if offset == first + len(body):
+                        self.bytes += len(body)
+                    return offset
+                if status < 500 and status != 429:
+                    raise UploadError("%s answered %d for %s" % (self.url, status, name))
+                error = "%s answered %d" % (self.url, status)
+            except self.errors as err:
+                self.close()
+                error = "%s: %s" % (self.url, err)
+            if attempt == self.retries:
+                break
+            self.retried += 1
+            time.sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+            # Only part of the batch may have arrived, ask rather than guess
+            if body:
+                try:
+                    return self.offset(name)
+                except UploadError:
+                    pass
+        raise UploadError("Gave up after %d retries, %s" % (self.retries, error))
+
+    def offset(self, name):
+
+        '''
+        Returns how much of the archive the server has, None if it is
+        complete
+        '''
+
+        return self.put(name, "", 0)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def upload_range(uploader, name, fileh, offset, end, total=None, batch_bytes=BATCH_BYTES):
+
+    '''
+    Uploads fileh from offset up to end in batches, the last batch carries
+    the total when the archive is finished.  Returns the offset the server
+    has received up to, None once the archive is complete.
+    '''
+
+    stalled = 0
+    while True:
+        size = min(batch_bytes, end - offset)
+        final = total is not None and offset + size == total
+        if size <= 0 and not final:
+            return offset
+        fileh.seek(offset)
+        body = fileh.read(size)
+        received = uploader.put(name, body, offset, total if final else None)
+        if received is None:
+            return None
+        # The server is behind or ahead of us, carry on from where it is
+        stalled = stalled + 1 if received <= offset else 0
+        if stalled > uploader.retries:
+            raise UploadError("%s is not taking %s at %d" % (uploader.url, name, offset))
+        offset = received
+
+
+class ConfigExport(object):
+
+    '''
+    Streams configs into an archive on a thread of its own, uploading it as
+    it grows when there is an uploader.  add() only queues the file so it
+    can be called from the pipeline's report.
+    '''
+
+    def __init__(self, folder, fmt="tgz", uploader=None, batch_bytes=BATCH_BYTES):
+        self.exports = export_folder(folder)
+        self.name = "%s-%s%s" % (os.path.basename(os.path.abspath(folder)),
+                                 datetime.datetime.now().strftime("%Y%m%d-%H%M%S"), FORMATS[fmt])
+        self.filename = os.path.join(self.exports, self.name)
+        self.fmt = fmt
+        self.uploader = uploader
+        self.batch_bytes = batch_bytes
+        self.queue = Queue.Queue()
+        self.added = 0
+        self.sent = 0
+        self.complete = False
+        self.error = None
+
+        self.outh = open(self.filename, "wb")
+        self.readh = open(self.filename, "rb")
+        if fmt == "zip":
+            import zipfile
+            self.archive = zipfile.ZipFile(self.outh, "w", zipfile.ZIP_DEFLATED, True)
+        else:
+            import tarfile
+            # The stream mode never seeks back, bytes already uploaded stay put
+            self.archive = tarfile.open(fileobj=self.outh, mode="w|gz")
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, filename, arcname=None):
+
+        '''
+        Queues a file for the archive
+        '''
+
+        self.queue.put((filename, arcname or os.path.basename(filename)))
+
+    def _add(self, filename, arcname):
+        if self.fmt == "zip":
+            import zipfile
+            # zipfile needs the whole member to write it without seeking
+            fileh = open(filename, "rb")
+            data = fileh.read()
+            fileh.close()
+            info = zipfile.ZipInfo(arcname, time.localtime(os.path.getmtime(filename))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0644 << 16
+            self.archive.writestr(info, data)
+        else:
+            self.archive.add(filename, arcname)
+        self.added += 1
+
+    def _upload(self, total=None):
+        if not self.uploader or self.error:
+            return
+        self.outh.flush()
+        end = self.outh.tell()
+        if total is None:
+            # Whole batches only while the archive is growing
+            end = self.sent + (end - self.sent) // self.batch_bytes * self.batch_bytes
+            if end == self.sent:
+                return
+        try:
+            received = upload_range(self.uploader, self.name, self.readh, self.sent, end,
+                                    total, self.batch_bytes)
+        except UploadError as err:
+            # Keep archiving, the upload can be resumed from the file
+            self.error = err
+            self.uploader.close()
+            return
+        if received is None:
+            self.sent = end
+            self.complete = True
+            mark_uploaded(self.exports, self.name)
+        else:
+            self.sent = received
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self._add(*item)
+            except (IOError, OSError):
+                # Moved or removed since the device finished, leave it out
+                continue
+            self._upload()
+
+    def close(self):
+
+        '''
+        Finishes the archive and its upload, returns the archive file name
+        '''
+
+        self.queue.put(None)
+        self.thread.join()
+        self.archive.close()
+        self.outh.flush()
+        self._upload(self.outh.tell())
+        self.outh.close()
+        self.readh.close()
+        if self.uploader:
+            self.uploader.close()
+        return self.filename
+
+
+def resume_uploads(folder, uploader, batch_bytes=BATCH_BYTES):
+
+    '''
+    Uploads the rest of every archive in <cust_dir>/exports that has not
+    reached the archive system.  Yields (name, error), error is None once
+    the archive is complete.
+    '''
+
+    exports = export_folder(folder)
+    done = uploaded(exports)
+    for name in sorted(os.listdir(exports)):
+        if name in done or not name.endswith(tuple(FORMATS.values())):
+            continue
+        filename = os.path.join(exports, name)
+        total = os.path.getsize(filename)
+        fileh = open(filename, "rb")
+        try:
+            offset = uploader.offset(name)
+            if offset is not None:
+                upload_range(uploader, name, fileh, offset, total, total, batch_bytes)
+            mark_uploaded(exports, name)
+            yield name, None
+        except UploadError as err:
+            yield name, err
+        finally:
+            fileh.close()
+
+
+def serve_archive(folder, port, address="127.0.0.1", refuse=0.0):
+
+    '''
+    Runs a stand-in for the archive system on a background thread, returns
+    the server so it can be shut down.  Archives are written to folder,
+    <name>.part while incomplete.  refuse is the fraction of batches turned
+    away with a 503, to exercise the retries.
+    '''
+
+    # Only the stand-in needs an HTTP server
+    import BaseHTTPServer
+    import SocketServer
+    import random
+    import urllib
+
+    lock = threading.Lock()
+
+    class ArchiveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        # Keep alive, the client reuses the connection
+        protocol_version = "HTTP/1.1"
+
+        def answer(self, status, received=0):
+            self.send_response(status)
+            if status == 308 and received:
+                self.send_header("Range", "bytes=0-%d" % (received - 1))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            name = os.path.basename(urllib.unquote(self.path))
+            match = CONTENT_RANGE_RE.match(self.headers.get("Content-Range", ""))
+            if not name or not match:
+                self.answer(400)
+                return
+            if body and random.random() < refuse:
+                self.answer(503)
+                return
+            final = os.path.join(folder, name)
+            part = final + ".part"
+            with lock:
+                if os.path.exists(final):
+                    self.answer(200)
+                    return
+                received = os.path.getsize(part) if os.path.exists(part) else 0
+                if match.group(1) is not None:
+                    first, last = int(match.group(1)), int(match.group(2))
+                    if first != received or last - first + 1 != len(body):
+                        self.answer(308, received)
+                        return
+                    fileh = open(part, "ab")
+                    fileh.write(body)
+                    fileh.close()
+                    received += len(body)
+                total = match.group(3)
+                if total != "*" and received == int(total):
+                    if not received:
+                        open(part, "ab").close()
+                    os.rename(part, final)
+                    self.answer(201)
+                    return
+            self.answer(308, received)
+
+        def log_message(self, *args):
+            pass
+
+    class ArchiveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = ArchiveServer((address, port), ArchiveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
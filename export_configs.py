@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+'''
+This module uploads the config exports made by grab_configs.py to the
+archive system, see export.py.  The URL is taken from the command line or
+export.url in the tools directory.
+
+export_configs.py <cust_dir> [url]               finishes the uploads that
+                                                 were cut short
+export_configs.py all <cust_dir> [tgz|zip] [url] exports and uploads every
+                                                 stored config
+export_configs.py serve <dir> [port] [refuse]    runs a stand-in archive
+                                                 system on 127.0.0.1 (port
+                                                 8480), storing the archives
+                                                 in <dir> and turning away
+                                                 the refuse fraction of the
+                                                 batches with a 503
+'''
+
+import glob
+import sys
+import time
+
+from export import ConfigExport
+from export import Uploader
+from export import load_endpoint
+from export import resume_uploads
+from export import serve_archive
+
+
+'''
+Functions
+'''
+
+PORT = 8480
+
+def uploader_for(url):
+    url = url or load_endpoint()
+    if not url:
+        print "\nNo URL given and no export.url in the tools directory\n"
+        raise SystemExit(1)
+    try:
+        return Uploader(url)
+    except ValueError as err:
+        print "\n%s\n" % err
+        raise SystemExit(1)
+
+def export_all(folder, fmt, uploader):
+
+    '''
+    This function exports every <hostname>.txt config in a customer dir,
+    returns the ConfigExport once it is closed
+    '''
+
+    export = ConfigExport(folder, fmt, uploader)
+    for filename in sorted(glob.glob("".join([folder, "/*.txt"]))):
+        export.add(filename)
+    export.close()
+    return export
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    if not args:
+        print __doc__
+        raise SystemExit(1)
+
+    if args[0] == "serve" and len(args) > 1:
+        port = int(args[2]) if len(args) > 2 else PORT
+        serve_archive(args[1], port, refuse=float(args[3]) if len(args) > 3 else 0.0)
+        print "\nArchive stand-in on http://127.0.0.1:%d/ storing in %s, ctrl-c to stop\n" % (port, args[1])
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            raise SystemExit(0)
+
+    started = time.time()
+    if args[0] == "all" and len(args) > 1:
+        folder = args[1].rstrip("/")
+        fmt = args[2] if len(args) > 2 and args[2] in ("tgz", "zip") else "tgz"
+        url = args[-1] if len(args) > 2 and args[-1] not in ("tgz", "zip") else ""
+        uploader = uploader_for(url)
+        export = export_all(folder, fmt, uploader)
+        print "%d configs in %s" % (export.added, export.filename)
+        if export.error:
+            print "Upload failed: %s\nRun export_configs.py %s to finish it" % (export.error, folder)
+    else:
+        folder = args[0].rstrip("/")
+        uploader = uploader_for(args[1] if len(args) > 1 else "")
+        for name, error in resume_uploads(folder, uploader):
+            print "%-40s %s" % (name, error or "uploaded")
+        uploader.close()
+
+    '''
+    All done!
+    '''
+
+    print "\n%d bytes in %d requests over %d connections, %d retried, %.1fs\n" % (
+        uploader.bytes, uploader.requests, uploader.connections, uploader.retried,
+        time.time() - started)
@@ -9,6 +9,8 @@ the config, lookup the hostname then store the config in the customer folder.
 Check timestamps and file contents to ensure the job has run correctly.
 Files are saved in the <customer dir> specified in the info file.
 An activity.log is also updated in the <customer dir>
+The changed configs can be exported to the archive system as they are
+stored, see export.py.
 
 sample cust.info file:
 
@@ -19,137 +21,153 @@ acme-ltd            # customer dir should already exist, must be the first line
 #172.16.255.10      #  This line is skipped becuase it is # out.
 172.16.255.4:conn,telnet:user,test,temp123
 172.16.255.5:user,test,temp123,enablepass
+10.20.0.1:site,leeds      # site is used to pace sessions per site, the /24 otherwise
+10.30.0.1:jump,192.0.2.10    # reached through the bastion 192.0.2.10, same login
+10.30.0.2:jump,192.0.2.10,bastionuser,bastionpass
+10.40.0.1:var,vlan,410:var,user_gw,10.41.0.1    # values for config templates
 
 
 '''
 
-import paramiko
-import socket
 import re
-import datetime
-import time
-import sys
+import os
 import getpass
-import telnetlib
 
+# These lived here before toolkit.py, older scripts still import them from here
+from toolkit import get_defaults
+from toolkit import clean_ansi
+from toolkit import clean_ansi_stream
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import print_flush
+from toolkit import get_hostname
+from toolkit import sniff_hostname
+from session_cache import SessionCache
+from search_index import SearchIndex
+# shell_send lived here before the transport module, the other tools still import it from here
+from transport import shell_send
+from pipeline import read_inventory
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import fetch
+from pipeline import write_stream
+from pipeline import part_filename
+from pipeline import discard
+from pipeline import run_pipeline
+from pipeline import count_inventory
+from pipeline import record_sessions
+from recording import SessionRecorder
+from recording import run_folder
+from metrics import Metrics
+from metrics import serve_metrics
+from concurrency import AdaptiveLimiter
+from compute import ComputePool
+from compute import sanitise_file
+from export import ConfigExport
+from export import Uploader
+from export import load_endpoint
+from pipeline import DeviceError
 
 # Functions
 
 
-def get_defaults():
-
-    '''this function reads in defaults for the user inputs customer dir and user name
-    tools.pref should exist in the same directory as the tools.
-
-    tools.pref is not required.
-
-    same tools.pref:
-
-    acme-ltd.info
-    username
+def prompt_hostname(dev_output):
 
     '''
-
-    try:
-        fileh_def = open("tools.pref")
-    except IOError:
-        return ['', '']
-    prefs = fileh_def.read().split()
-    fileh_def.close()
-
-    try:
-        if prefs[1]:
-            pass
-    except IndexError:
-        prefs.append('')
-
-    return prefs
-
-
-def clean_ansi(clean):
-
-    '''
-    This functions cleans ANSI code from the output
+    This function picks the hostname out of the CLI prompt at the end of the
+    output, e.g. "core-sw1#", "core-sw1(config)#" or "ProCurve Switch 2610# "
     '''
 
-    # Clean up the dirty HP formatting
-    clean = re.sub(r'\x1b\[[0-9]+?;[0-9]+?[A-z]', '', clean)
-    clean = re.sub(r'\x1b\[[0-9]+?[A-z]', '', clean)
-    clean = re.sub(r'\x1b\[\?[0-9]+?[A-z]', '', clean)
-    clean = re.sub(r'\x1b[A-z]', '\n', clean)
-    clean = clean.replace('\r\n', '\n')
+    lines = [line for line in dev_output.replace('\r', '\n').split('\n') if line.strip()]
+    if not lines:
+        return
+    prompt_se = re.search(r"^(.+?)(\([\w\-]+\))?[#>]\s*$", lines[-1].strip())
+    if not prompt_se:
+        return
+    return prompt_se.group(1).strip()
 
-    return clean
 
-def get_hostname(dev_output):
+def tail_hostname(filename):
 
     '''
-    This function searches for the hostname field inside the config which is
-    used as the filename.
+    This function picks the hostname out of the prompt at the end of a shell
+    capture, only the tail of the file is read
     '''
 
-    hostname_se = re.search(r"hostname (.*)", dev_output)
-    if not hostname_se:
-        return
-    else:
-        # HP store the hostname as "hostname" so we strip the "
-        return hostname_se.group(1).strip().strip('"')
-
+    fileh = open(filename, "rb")
+    fileh.seek(0, os.SEEK_END)
+    fileh.seek(max(0, fileh.tell() - 1000))
+    tail = fileh.read()
+    fileh.close()
+    return prompt_hostname(clean_ansi(tail))
 
 
-def status_update(folder, host_ip, name, status):
+def grab_config(device, folder, username, password, cache, index=None, compute=None):
 
     '''
-    This function updates the activity.log
+    Pipeline job for a single device.  The config is streamed into a scratch
+    file unique to the device's IP (two devices may share a hostname, stock
+    ProCurve prompts for one) and moved into place as <hostname>.txt once
+    complete.  The hostname is the one in the config, see store_config for
+    a config that does not carry one.
+
+    The session only fetches, the clean up, hostname and digest are worked
+    out by sanitise_file, on the compute pool if there is one (see
+    compute.py).
     '''
 
-    su_filename = "".join([folder, "/activity.log"])
-    su_fileh = open(su_filename, "a")
-    su_status_msg = " ".join([str(datetime.datetime.now()).ljust(26), host_ip.ljust(15), ""])
-    if name:
-        # Only if we have a hostname, if not then something went wrong.
-        su_status_msg += " ".join([name, ""])
-    su_status_msg += "".join([status, "\n"])
-    su_fileh.write(su_status_msg)
-    su_fileh.close()
-    return
+    session, shell = open_device(device, username, password, cache)
+    scratch = part_filename(folder, device)
+    try:
+        write_stream(fetch(session, shell, device, "show run", wait=6), scratch)
+    except Exception:
+        discard(scratch)
+        raise
+    finally:
+        close_device(session, shell)
 
-def raw_input_def(prompt, default):
+    def then(found):
+        return store_config(device, folder, cache, index, scratch, shell is not None, found)
 
-    '''
-    Adds a default for inputs
-    '''
-
-    usr_input = raw_input(prompt)
-    if not usr_input:
-        # If the user hit enter without inputting details we return the default
-        return default
-    else:
-        return usr_input
+    args = (scratch, device['hp'], shell is not None)
+    if compute:
+        return compute.submit(sanitise_file, args, then, lambda: discard(scratch))
+    return then(sanitise_file(*args))
 
-def shell_send(cmd, wait, buf, ssh_shell, shell_is_telnet):
-    '''
-    Sends a command to the SSH or telnet shell and waits. Adds a newline
-    (simulates pressing enter)
-    '''
 
-    if not shell_is_telnet:
-        ssh_shell.send(cmd + "\n")
-        time.sleep(wait)
-        return ssh_shell.recv(buf)
-    else:
-        ssh_shell.write(cmd + "\r\n")
-        time.sleep(wait)
-        return ssh_shell.read_very_eager()
+def store_config(device, folder, cache, index, scratch, shell, found):
 
-def print_flush(flush_output):
     '''
-    prints without a newline and flushes the buffer so it appears on screen
-    without delay
+    This function moves a sanitised config into place as <hostname>.txt.
+    The digest of the normalised config (see normalise.py) is kept in the
+    session cache, a config whose digest has not changed since the last run
+    is not indexed again.
     '''
-    sys.stdout.write(flush_output)
-    sys.stdout.flush()
-    return
+
+    # The config is the authority.  Only for a config without a hostname
+    # line is the prompt the capture ended on (shell) or the last run's name
+    # used, neither costs the device anything.
+    name = found.get('hostname')
+    if not name and shell:
+        name = tail_hostname(scratch)
+    if not name:
+        name = cache.get(device['ip']).get('hostname')
+    if not name:
+        discard(scratch)
+        raise DeviceError("!!! Could not determine the hostname. !!!",
+                          "*** Could not discover the hostname. ***")
+
+    hostname = name + ".txt"
+    filename = "".join([folder, "/", hostname])
+    unchanged = (cache.get(device['ip']).get('digest') == found['digest'] and
+                 os.path.exists(filename))
+    cache.update(device['ip'], hostname=name, digest=found['digest'])
+    os.rename(scratch, filename)
+    if unchanged:
+        return hostname, "[ Config unchanged, stored as %s ]" % (filename), "Completed, unchanged."
+    if index:
+        index.add_file(folder, name, "config", filename, ip=device['ip'])
+    return hostname, "[ Storing the config as %s ]" % (filename), "Completed."
 
 
 '''
@@ -158,15 +176,10 @@ Main module loop
 
 if __name__ == "__main__":
 
-    ssh = paramiko.SSHClient()
-    # If key is not in known hosts we ignore the warning
-    # NOTE This may not be suitable for all and environments
-    ssh.set_missing_host_key_policy(
-            paramiko.AutoAddPolicy())
-
     # read defaults
 
     (def_cust, def_user) = get_defaults()
+    def_url = load_endpoint()
 
     print
     print "============================="
@@ -181,202 +194,103 @@ if __name__ == "__main__":
         cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
         input_username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
         input_password = getpass.getpass("Input SSH password: ")
+        in_flight = raw_input_def("Input max concurrent sessions [8]: ", "8")
+        metrics_port = raw_input_def("Input port to serve metrics on, blank for none []: ", "")
+        record = raw_input_def("Record the sessions for offline replay (y/n) [n]: ", "n").lower() == "y"
+        def_export = "tgz" if def_url else "n"
+        export_fmt = raw_input_def("Export the changed configs as tgz, zip or n [%s]: " % def_export,
+                                   def_export).lower()
+        upload_url = ""
+        if export_fmt != "n":
+            upload_url = raw_input_def("Upload the export to, blank to keep it local [%s]: " % def_url, def_url)
 
         print "\n"
         print cust
         print input_username
         print "**PASSWORD HIDDEN**"
+        print in_flight
+        print metrics_port
+        print "record %s" % record
+        print "export %s %s" % (export_fmt, upload_url)
 
         yesno = raw_input("\nAre these details correct [y/n]: ").lower()
         print
-        if yesno == "y":
+        if (yesno == "y" and in_flight.isdigit() and int(in_flight) > 0 and
+                (not metrics_port or metrics_port.isdigit()) and
+                export_fmt in ("tgz", "zip", "n") and
+                (not upload_url or upload_url.startswith(("http://", "https://")))):
             break
 
 
     '''
-    Read the customer file to determine the folder and a list of IPs
+    Read the customer file to determine the folder, the devices are read
+    from the file as the workers become free
     '''
 
-    fileh = open(cust)
-    cust_dir = fileh.readline().strip()
-    ip_list = fileh.readlines()
-    fileh.close()
+    (cust_dir, devices) = read_inventory(cust)
+
+    # Started before any thread so the pool processes fork from a quiet parent
+    compute = ComputePool()
+
+    metrics = Metrics(count_inventory(cust))
+    if metrics_port:
+        serve_metrics(metrics, int(metrics_port))
+        print "Metrics on http://127.0.0.1:%s/metrics\n" % metrics_port
+
+    # Raw device output for replay_sessions.py, see recording.py
+    if record:
+        recordings = run_folder(cust_dir)
+        record_sessions(SessionRecorder(recordings, "grab", "show run"))
+        print "Sessions are recorded in %s\n" % recordings
+
+    # Host keys and per device negotiation details from previous runs
+    session_cache = SessionCache(cust_dir)
+    search_index = SearchIndex()
+
+    # Changed configs are archived and uploaded as the devices finish, see export.py
+    export = None
+    if export_fmt != "n":
+        export = ConfigExport(cust_dir, export_fmt, Uploader(upload_url) if upload_url else None)
+
+    def report(device, name, screen, status):
+        print "%-15s > %s" % (device['ip'], screen)
+        status_update(cust_dir, device['ip'], name, status)
+        if export and status == "Completed.":
+            export.add("".join([cust_dir, "/", name]))
+
+    def job(device):
+        return grab_config(device, cust_dir, input_username, input_password, session_cache, search_index, compute)
 
 
     '''
-    Main loop to connect to each IP, grab the config, store the config
+    Connect to each device, grab the config, store the config
     '''
 
-    for ip_addr in ip_list:
-        ip_addr = ip_addr.strip()
-
-        '''
-        Skip if ip_addr has been # out
-        '''
-
-        if '#' in ip_addr:
-            print "Skipping %s" % (ip_addr.split("#")[1])
-            status_update(cust_dir, ip_addr.split("#")[1], "", "*** Skipped. ***")
-            continue
-
-        '''
-        If the IP address contains a : then options have been added
-        :hp means we use an interactive shell to obtain the config
-        otherwise we are using local password in the format user:pass:enable where enable is optional
-        '''
-
-        hp = False
-        dev_specific = False
-        telnet = False
-        if ":" in ip_addr:
-            type_list = ip_addr.split(":")
-            ip_addr = type_list[0]
-            for x in range(1, len(type_list)):
-                var = type_list[x]
-                var_list = var.split(",")
-                var_type = var_list[0]
-                if var_type == "model": hp = True
-                if var_type == "conn": telnet = True
-                if var_type == "user":
-                    dev_specific = True
-                    dev_username = var_list[1]
-                    dev_password = var_list[2]
-                    dev_enable = False
-                try:
-                    dev_enable = var_list[3]
-                except IndexError:
-                    pass
-                    #ok no enable
-
-        '''
-        Open the SSH Connection with some error handling
-        '''
-
-        print_flush("Establishing connection to %-15s > " % (ip_addr))
-
-        username = input_username
-        password = input_password
-        enable = ""
-
-        if dev_specific:
-            username = dev_username
-            password = dev_password
-            enable = dev_enable
-
-        if not telnet:
-            try:
-                ssh.connect(ip_addr, username=username, password=password, timeout=8)
-            except paramiko.ssh_exception.AuthenticationException:
-                print "Authentication failed (SSH)."
-                status_update(cust_dir, ip_addr, "", "*** Authentication failed. ***")
-                continue
-            except socket.error:
-                print "Could not connect (SSH)."
-                status_update(cust_dir, ip_addr, "", "*** Connection error (SSH). ***")
-                continue
-        else:
-            try:
-                shell = telnetlib.Telnet(ip_addr, 23, 4)
-            except socket.error:
-                print "Could not connect (Telnet)."
-                status_update(cust_dir, ip_addr, "", "*** Connection error (Telnet). ***")
-                continue
-
-            shell.read_very_eager()
-            output = shell_send(username, 1, 500, shell, telnet)
-            auth_failed = re.search(r"Login invalid", output)
-            if auth_failed:
-                print "Authentication failed (Telnet)."
-                status_update(cust_dir, ip_addr, "", "*** Authentication failed. ***")
-                continue
-
-            output = shell_send(password, 1, 500, shell, telnet)
-            auth_failed = re.search(r"Login invalid", output)
-            if auth_failed:
-                print "Authentication failed (Telnet)."
-                status_update(cust_dir, ip_addr, "", "*** Authentication failed. ***")
-                continue
-
-        print_flush("[ Connection established ]")
-
-
-        '''
-        Get the config and print to screen
-        '''
-
-        print_flush("[ Retrieving the config ]")
-
-        '''
-        HP does not support exec_command so we will use an interactive session
-        for HP devices for cisco we will use the 'cleaner' exec_command method
-        '''
-
-        if not hp and not enable and not telnet:
-            # Cisco Device
-            stdin, stdout, stderr = ssh.exec_command("sh run")
-            config = stdout.read()
-        else:
-            # HP Device, or enable password, or telnet
-            
-            if not telnet:
-                shell = ssh.invoke_shell(width=200, height=99999)
-
-                # Strip MOTD
-                output = shell.recv(2000)
-
-            # Enable mode
-            if enable:
-                shell_send("enable 15", 1 , 1000, shell, telnet)
-                shell_send(enable, 1, 1000, shell, telnet)
-
-            # Press enter,turn off paging,grab config
-            shell_send("", 1, 1000, shell, telnet)
-
-            if hp:
-                paging = "no page"
-            else:
-                paging = "term len 0"
-
-            shell_send(paging, 1, 500, shell, telnet)
-            config = shell_send("show run", 6, 65535, shell, telnet)
-            shell.close()
-
-            if hp:
-                config = clean_ansi(config)
-
-        # Use regex to find the hostname in the config
-        try:
-            hostname = get_hostname(config) + ".txt"
-        except TypeError:
-            hostname = ".txt"
-
-        if hostname == ".txt":
-            print " !!! Could not determine the hostname. !!!"
-            status_update(cust_dir, ip_addr, "", "*** Could not discover the hostname. ***")
-            continue
-
-
-        '''
-        Store the config
-        '''
-
-        filename = "".join([cust_dir, "/", hostname])
-
-        print "[ Storing the config as %s ]" % (filename)
-
-        fileh = open(filename, "wb")
-        fileh.write(config)
-        fileh.close()
-
-        status_update(cust_dir, ip_addr, hostname, "Completed.")
-
-        '''
-        End of main program Loop.
-        Repeat for each IP address in the customer info file
-        '''
+    limiter = AdaptiveLimiter(int(in_flight))
+    run_pipeline(devices, job, report, int(in_flight), metrics, limiter)
+    compute.close()
+
+    # Sites that could not take the full number of sessions
+    for site, limit in sorted(limiter.limits().items()):
+        print "Site %s was paced at %d sessions" % (site, limit)
+
+    session_cache.save()
+
+    if export:
+        print "\nFinishing the export..."
+        export.close()
 
     '''
     All done!
     '''
 
-    print "\nConfig grab complete.  Please check the file timestamps and file contents then upload to Atlas.\n"
+    if not export:
+        print "\nConfig grab complete.  Please check the file timestamps and file contents then upload to Atlas.\n"
+    elif export.error:
+        print "\nConfig grab complete, %d changed configs in %s.\nThe upload failed: %s\nRun export_configs.py %s to finish it.\n" % (
+            export.added, export.filename, export.error, cust_dir)
+    elif export.complete:
+        print "\nConfig grab complete, %d changed configs in %s uploaded to %s\n" % (
+            export.added, export.filename, upload_url)
+    else:
+        print "\nConfig grab complete, %d changed configs in %s\n" % (export.added, export.filename)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+'''
+This module finds the switch port an endpoint is connected to.  Give it an
+IP address or a MAC address (any of the usual formats):
+
+locate_endpoint.py 10.1.2.3
+locate_endpoint.py 0011.2233.4455
+
+All devices in the customer .info file are queried in parallel.  For an IP
+the ARP tables of the routing devices give the MAC, the last snapshot (see
+collect_snapshots.py) is used as a hint so the ARP and MAC queries normally
+go out in a single sweep.  The MAC table hits are then compared with the
+cached CDP/LLDP neighbours (see topology.py): a hit on a port with a
+neighbour is an uplink, the hit that is not is the edge port.
+
+Neighbours older than a day are collected again during the sweep.
+
+Please see grab_configs.py for more info on constructing the .info file
+'''
+
+import datetime
+import getpass
+import re
+import sys
+
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from toolkit import clean_ansi_stream
+from session_cache import SessionCache
+from pipeline import read_inventory
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import fetch
+from pipeline import run_pipeline
+from show_parsers import load_templates
+from show_parsers import chunk_lines
+from show_parsers import to_mac
+from record_store import RecordStore
+from topology import NeighbourCache
+from topology import short_port
+
+'''
+Functions
+'''
+
+IP_RE = re.compile(r"^\d+\.\d+\.\d+\.\d+$")
+
+# MAC table ports that are never the edge
+NOT_EDGE = ('po', 'cp', 'ro', 'sw', 'dr')
+
+def sweep_device(device, username, password, cache, neighbours, templates, ip, mac):
+
+    '''
+    Pipeline job, queries ARP and/or the MAC table for the endpoint and
+    refreshes the device's neighbours if they are stale.  Returns a dict of
+    the records found.  A device with nothing to query is not contacted.
+    '''
+
+    queries = []
+    if ip:
+        queries.append(('arp', "show ip arp " + ip, templates['show_ip_arp']))
+    if mac:
+        queries.append(('mac', "show mac address-table address " + mac,
+                        templates['show_mac_address_table']))
+    refresh = neighbours.stale(device['ip'])
+    if refresh:
+        queries.append(('cdp', "show cdp neighbors detail", templates['show_cdp_neighbors_detail']))
+        queries.append(('lldp', "show lldp neighbors detail", templates['show_lldp_neighbors_detail']))
+
+    found = {'arp': [], 'mac': [], 'cdp': [], 'lldp': []}
+    if not queries:
+        # Nothing to ask this device in this sweep, a login would only count
+        # towards the lockout
+        return found
+    session, shell = open_device(device, username, password, cache)
+    try:
+        for number, (kind, command, template) in enumerate(queries):
+            chunks = fetch(session, shell, device, command, wait=10, prepare=(number == 0))
+            found[kind] = list(template.parse(chunk_lines(clean_ansi_stream(chunks))))
+    finally:
+        close_device(session, shell)
+
+    if refresh:
+        neighbours.set_neighbours(device['ip'], found['cdp'] + found['lldp'])
+    if found['arp']:
+        neighbours.update(device['ip'], arp=True)
+    return found
+
+def sweep(devices, job, folder, in_flight):
+
+    '''
+    This function runs a sweep across the devices, returns a dict of device
+    IP -> records found.  Only failures are reported on screen.
+    '''
+
+    results = {}
+
+    def report(device, name, screen, status):
+        if status.startswith("***"):
+            print "%-15s > %s" % (device['ip'], screen)
+            status_update(folder, device['ip'], name, status)
+
+    def sweep_job(device):
+        results[device['ip']] = job(device)
+        return "", "", "Completed."
+
+    run_pipeline(iter(devices), sweep_job, report, in_flight)
+    return results
+
+def arp_mac(results, ip):
+
+    '''
+    This function returns the MAC the ARP tables give for the IP
+    '''
+
+    for found in results.values():
+        for record in found['arp']:
+            if record['address'] == ip and record['mac'] and record['mac'] != 'incomplete':
+                return record['mac']
+    return None
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    print "\n================"
+    print "Locate endpoint"
+    print "================\n"
+
+    while True:
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
+        password = getpass.getpass("Input SSH password: ")
+        if len(sys.argv) > 1:
+            target = sys.argv[1]
+        else:
+            target = raw_input("Input the IP or MAC address to find: ").strip()
+        in_flight = raw_input_def("Input max concurrent sessions [64]: ", "64")
+
+        yesno = raw_input_def("\nAre these details correct (y/n) [y]: ", "y").lower()
+        print
+        if yesno == "y" and in_flight.isdigit() and int(in_flight) > 0:
+            break
+
+    in_flight = int(in_flight)
+    (cust_dir, devices) = read_inventory(cust)
+    devices = [device for device in devices if not device['skip']]
+
+    session_cache = SessionCache(cust_dir)
+    neighbours = NeighbourCache(cust_dir)
+    templates = dict((template.name, template) for template in load_templates())
+
+    # Hostname/IP index, from the configs grabbed and the neighbours seen
+    names = {}
+    for device in devices:
+        names[device['ip']] = (session_cache.get(device['ip']).get('hostname') or
+                               neighbours.get(device['ip']).get('hostname') or device['ip'])
+
+    ip = target if IP_RE.match(target) else None
+    mac = None if ip else to_mac(target)
+
+    if ip:
+        # The last snapshot usually knows the MAC, so ARP and the MAC table
+        # can be checked in the same sweep
+        since = (datetime.datetime.now() - datetime.timedelta(days=7)).isoformat(' ')
+        hint = RecordStore(cust_dir, formats=('sqlite',), db_name="snapshots.db").query(
+            'show_ip_arp', 'address', ip, since)
+        if hint:
+            mac = hint[0]['mac']
+
+    # ARP is only asked of the devices that have answered ARP before, if we
+    # know of any
+    routers = set(device['ip'] for device in devices if neighbours.get(device['ip']).get('arp'))
+
+    def job(device):
+        arp_ip = ip if not routers or device['ip'] in routers else None
+        return sweep_device(device, username, password, session_cache, neighbours,
+                            templates, arp_ip, mac)
+
+    results = sweep(devices, job, cust_dir, in_flight)
+
+    if ip:
+        live_mac = arp_mac(results, ip)
+        if not live_mac and routers:
+            # Maybe a device that has started routing, ask everyone
+            routers = set()
+            results = sweep(devices, job, cust_dir, in_flight)
+            live_mac = arp_mac(results, ip)
+        if not live_mac:
+            print "\n%s is not in the ARP table of any device.\n" % ip
+            neighbours.save()
+            session_cache.save()
+            sys.exit(1)
+        print "\n%s is at %s" % (ip, live_mac)
+        if live_mac != mac:
+            # The hint was wrong or missing, the MAC tables need a second sweep
+            mac = live_mac
+            ip = None
+            results = sweep(devices, job, cust_dir, in_flight)
+
+    neighbours.save()
+    session_cache.save()
+
+    hits = []
+    for host_ip, found in results.items():
+        for record in found['mac']:
+            if record['mac'] == mac:
+                hits.append((host_ip, record))
+
+    if not hits:
+        print "\n%s is not in the MAC table of any device.\n" % mac
+        sys.exit(1)
+
+    edges = [(host_ip, record) for host_ip, record in hits
+             if short_port(record['port']) not in neighbours.uplinks(host_ip)
+             and short_port(record['port'])[:2] not in NOT_EDGE]
+
+    print
+    for host_ip, record in sorted(edges or hits):
+        print "%s %-20s %-15s port %-12s vlan %s" % ("EDGE  " if edges else "uplink",
+                                                     names.get(host_ip, host_ip), host_ip,
+                                                     record['port'], record['vlan'])
+    if not edges:
+        print "\nOnly seen on uplinks, the endpoint is probably behind a device not in %s\n" % cust
+    print
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+'''
+This module keeps the live figures for a pipeline run (see pipeline.py):
+devices done, failed, skipped and in flight, bytes received, devices and
+bytes per second, ETA and a latency histogram per phase:
+
+connect     open_device, login through to a usable session/shell
+fetch       a command, from sending it to the last chunk of output
+device      the whole job for a device
+
+Recording is a lock and a few additions per event, the histograms have
+fixed buckets, so it is left on for every run.  The figures are shown as a
+summary line at the bottom of the screen (a line every 30 seconds when the
+output is not a terminal) and can be served over HTTP:
+
+http://127.0.0.1:<port>/metrics    Prometheus text format
+http://127.0.0.1:<port>/json       the same as JSON
+'''
+
+import json
+import sys
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets, seconds
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PHASES = ('connect', 'fetch', 'device')
+
+LINE_WIDTH = 199
+
+
+class Metrics(object):
+
+    '''
+    Counters and histograms for a run, safe to share between the pipeline
+    worker threads.  total is the number of devices expected, if known, and
+    is only used for the ETA.
+    '''
+
+    def __init__(self, total=None):
+        self.lock = threading.Lock()
+        self.total = total
+        self.started = time.time()
+        self.counts = {'done': 0, 'failed': 0, 'skipped': 0, 'in_flight': 0, 'bytes': 0}
+        self.histograms = dict((phase, [0] * (len(BUCKETS) + 1)) for phase in PHASES)
+        self.sums = dict((phase, 0.0) for phase in PHASES)
+
+    def device_started(self):
+        with self.lock:
+            self.counts['in_flight'] += 1
+
+    def device_finished(self, status, seconds):
+
+        '''
+        Records the end of a job, status is the activity.log status
+        '''
+
+        with self.lock:
+            self.counts['in_flight'] -= 1
+            self.counts['failed' if status.startswith("***") else 'done'] += 1
+        self.observe('device', seconds)
+
+    def device_skipped(self):
+        with self.lock:
+            self.counts['skipped'] += 1
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.counts['bytes'] += count
+
+    def observe(self, phase, seconds):
+
+        '''
+        Adds a latency to the histogram of a phase
+        '''
+
+        bucket = 0
+        while bucket < len(BUCKETS) and seconds > BUCKETS[bucket]:
+            bucket += 1
+        with self.lock:
+            self.histograms[phase][bucket] += 1
+            self.sums[phase] += seconds
+
+    def snapshot(self):
+
+        '''
+        Returns the figures as a dict
+        '''
+
+        with self.lock:
+            figures = dict(self.counts)
+            histograms = dict((phase, list(counts)) for phase, counts in self.histograms.items())
+            sums = dict(self.sums)
+        elapsed = max(time.time() - self.started, 0.001)
+        finished = figures['done'] + figures['failed']
+        figures['elapsed'] = elapsed
+        figures['total'] = self.total
+        figures['devices_per_sec'] = finished / elapsed
+        figures['bytes_per_sec'] = figures['bytes'] / elapsed
+        figures['eta'] = None
+        if self.total and finished:
+            remaining = max(self.total - finished - figures['skipped'], 0)
+            figures['eta'] = remaining / figures['devices_per_sec']
+        figures['latency'] = {}
+        for phase in PHASES:
+            figures['latency'][phase] = {'buckets': histograms[phase], 'sum': sums[phase],
+                                         'count': sum(histograms[phase])}
+        return figures
+
+    def exposition(self):
+
+        '''
+        Returns the figures in the Prometheus text format
+        '''
+
+        figures = self.snapshot()
+        lines = []
+        for name in ('done', 'failed', 'skipped', 'bytes'):
+            lines.append("# TYPE nettools_%s_total counter" % name)
+            lines.append("nettools_%s_total %d" % (name, figures[name]))
+        lines.append("# TYPE nettools_in_flight gauge")
+        lines.append("nettools_in_flight %d" % figures['in_flight'])
+        for name in ('devices_per_sec', 'bytes_per_sec', 'eta'):
+            if figures[name] is not None:
+                lines.append("# TYPE nettools_%s gauge" % name)
+                lines.append("nettools_%s %.3f" % (name, figures[name]))
+        lines.append("# TYPE nettools_latency_seconds histogram")
+        for phase in PHASES:
+            latency = figures['latency'][phase]
+            running = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), latency['buckets']):
+                running += count
+                lines.append('nettools_latency_seconds_bucket{phase="%s",le="%s"} %d'
+                             % (phase, bound, running))
+            lines.append('nettools_latency_seconds_sum{phase="%s"} %.3f' % (phase, latency['sum']))
+            lines.append('nettools_latency_seconds_count{phase="%s"} %d' % (phase, latency['count']))
+        return "\n".join(lines) + "\n"
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+    return "%02d:%02d" % (seconds / 60, seconds % 60)
+
+
+def percentile(buckets, fraction):
+
+    '''
+    Upper bound of the bucket holding the given fraction of a histogram
+    '''
+
+    wanted = sum(buckets) * fraction
+    running = 0
+    for bound, count in zip(BUCKETS + (None,), buckets):
+        running += count
+        if count and running >= wanted:
+            return bound
+    return None
+
+
+def bucket_label(bound):
+    # None is the overflow bucket
+    if bound is None:
+        return ">%ss" % BUCKETS[-1]
+    return "<%ss" % bound
+
+
+def summary_line(metrics):
+
+    '''
+    The one line summary shown on the dashboard
+    '''
+
+    figures = metrics.snapshot()
+    total = "/%d" % figures['total'] if figures['total'] else ""
+    latency = []
+    for phase in PHASES:
+        buckets = figures['latency'][phase]['buckets']
+        if sum(buckets):
+            latency.append("%s p50 %s p95 %s" % (phase, bucket_label(percentile(buckets, 0.5)),
+                                                  bucket_label(percentile(buckets, 0.95))))
+    return "[ %d%s done, %d failed, %d in flight | %.1f dev/s %.1f KB/s | ETA %s | %s ]" % (
+        figures['done'] + figures['failed'] + figures['skipped'], total, figures['failed'], figures['in_flight'],
+        figures['devices_per_sec'], figures['bytes_per_sec'] / 1024,
+        format_seconds(figures['eta']), ", ".join(latency))
+
+
+class Dashboard(object):
+
+    '''
+    Keeps the summary line at the bottom of a terminal.  Whoever prints
+    per-device lines holds the lock and calls clear() before and draw()
+    after, the line is redrawn every interval seconds in between.
+    '''
+
+    def __init__(self, metrics, lock, interval=1, stream=sys.stdout):
+        self.metrics = metrics
+        self.lock = lock
+        self.stream = stream
+        self.tty = stream.isatty()
+        self.interval = interval if self.tty else 30
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def clear(self):
+        if self.tty:
+            self.stream.write("\r\033[K")
+
+    def draw(self):
+        if self.tty:
+            # Never wrap, a wrapped line can not be cleared with \r
+            self.stream.write(summary_line(self.metrics)[:LINE_WIDTH])
+            self.stream.flush()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                if self.tty:
+                    self.clear()
+                    self.draw()
+                else:
+                    self.stream.write(summary_line(self.metrics) + "\n")
+                    self.stream.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            self.clear()
+            self.stream.write(summary_line(self.metrics) + "\n")
+            self.stream.flush()
+
+
+def serve_metrics(metrics, port, address="127.0.0.1"):
+
+    '''
+    Serves /metrics and /json on a background thread, returns the server so
+    it can be shut down.  Only listens locally unless address is given.
+    '''
+
+    # Most runs never serve metrics, the HTTP server is loaded on demand
+    import BaseHTTPServer
+
+    class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = metrics.exposition()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/json":
+                body = json.dumps(metrics.snapshot(), sort_keys=True)
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # Keep the screen for the device lines
+            pass
+
+    server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
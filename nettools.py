@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+'''
+This module is a single entry point for the network tools:
+
+nettools.py                       lists the tools
+nettools.py grab                  same as grab_configs.py
+nettools.py search vlan 410       same as search_configs.py vlan 410
+
+Only the tool asked for is imported, and it runs exactly as if it had been
+started directly.  The tools themselves only load paramiko or netmiko
+once they contact a device, see bench_startup.py for the startup
+budget.
+'''
+
+import runpy
+import sys
+
+
+'''
+Functions
+'''
+
+# name, module, description.  Kept here rather than read from the modules so
+# listing the tools imports none of them.
+TOOLS = [
+    ("grab", "grab_configs", "download the config of every device"),
+    ("send", "send_commands", "send a command to every device, store the output"),
+    ("snapshot", "collect_snapshots", "collect ARP, MAC, route and interface tables"),
+    ("locate", "locate_endpoint", "find the switch port of an IP or MAC address"),
+    ("discover", "discover_topology", "crawl CDP/LLDP neighbours from the seed devices"),
+    ("render", "render_configs", "render a config template for every device"),
+    ("push", "push_config", "push a config change in waves with health checks"),
+    ("restore", "restore_configs", "restore the stored configs to the devices"),
+    ("audit", "audit_configs", "check the stored configs against a rules file"),
+    ("search", "search_configs", "search the stored configs and command output"),
+    ("export", "export_configs", "upload the config exports to the archive system"),
+    ("activity", "activity_report", "report failures, flapping devices and history of past runs"),
+    ("replay", "replay_sessions", "replay recorded sessions through the pipeline offline"),
+    ("automate", "automate", "netmiko based automation menu"),
+]
+
+
+def usage():
+    print "\nUsage: nettools.py <tool> [arguments]\n"
+    for name, module, description in TOOLS:
+        print "  %-10s %-22s %s" % (name, module + ".py", description)
+    print
+
+
+def run_tool(name, args):
+
+    '''
+    Runs a tool as __main__ with args as its command line.  Returns False if
+    there is no such tool.
+    '''
+
+    for tool, module, description in TOOLS:
+        if name in (tool, module, module + ".py"):
+            sys.argv = [module + ".py"] + args
+            runpy.run_module(module, run_name="__main__", alter_sys=True)
+            return True
+    return False
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help", "help"):
+        usage()
+        sys.exit(0)
+
+    if not run_tool(sys.argv[1], sys.argv[2:]):
+        print "\nUnknown tool %s" % sys.argv[1]
+        usage()
+        sys.exit(1)
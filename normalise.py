@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+'''
+This module turns device output into a canonical form so two captures of
+the same config compare (and hash) the same:
+
+- lines that change on every capture are dropped, e.g. the IOS
+  "! Last configuration change at" and "ntp clock-period" lines and the HP
+  "Running configuration:" header
+- ANSI left overs, pager prompts and other control characters are removed
+- trailing white space is stripped, \r\n becomes \n, runs of blank lines
+  become one and leading/trailing blank lines go
+- with shell set, the echoed command and the prompt lines around it are
+  dropped as well
+
+It works a line at a time on the chunks from the pipeline, only the last
+partial line is held.  digest_stream passes the raw chunks through unchanged
+and leaves the digest of the canonical form behind, so the file written is
+still exactly what the device sent.
+'''
+
+import hashlib
+import re
+
+
+# Lines that differ between two captures of an unchanged config
+VOLATILE_RE = re.compile("|".join([
+    # Cisco IOS
+    r"^! Last configuration change at ",
+    r"^! NVRAM config last updated at ",
+    r"^! No configuration change since last restart",
+    r"^ntp clock-period ",
+    r"^Building configuration\.\.\.",
+    r"^Current configuration\s*:",
+    r"^Load for five secs",
+    r"^Time source is ",
+    # HP ProCurve
+    r"^Running configuration:",
+    r"^; \S+ Configuration Editor; Created on release",
+]))
+
+# HP and IOS pager prompts, should paging not have been turned off
+PAGER_RE = re.compile(r"-- ?MORE ?--.*|--More--|Press any key to continue")
+
+ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x1b[A-Za-z]")
+
+CONTROL_RE = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+
+# The text of a CLI prompt up to its # or >, "core-sw1", "core-sw1(config)" or
+# "ProCurve Switch 2610".  telnet.py finds the prompts with it as well.
+PROMPT_TEXT = r"[^\r\n#>]*[^\s#>]"
+
+# A prompt on its own or with a command after it, only checked for shell
+# output.  A prompt with spaces in it needs the space before the command, so
+# a line such as "snmp-server location Rack#3" is not taken for one.
+PROMPT_RE = re.compile(r"^(?:[\w.()/-]+(\(config[^)]*\))?[#>] ?(\S.*)?|[^\s#>]%s[#>]( \S.*)?)$"
+                       % PROMPT_TEXT)
+
+# The echo of the command when its prompt was read before the output started
+ECHO_RE = re.compile(r"^sh(ow)? \S")
+
+
+class Normaliser(object):
+
+    '''
+    Feed it the chunks, it returns the canonical text for the complete lines
+    so far.  close() returns whatever is left.
+    '''
+
+    def __init__(self, shell=False):
+        self.shell = shell
+        self.partial = ''
+        self.blank = False
+        self.started = False
+
+    def _line(self, line):
+        line = ANSI_RE.sub('', line)
+        (line, pager) = PAGER_RE.subn('', line)
+        line = CONTROL_RE.sub('', line).rstrip()
+        if VOLATILE_RE.match(line) or (self.shell and PROMPT_RE.match(line)):
+            return None
+        if self.shell and not self.started and ECHO_RE.match(line):
+            return None
+        if pager and not line:
+            # The pager prompt was all there was, not a blank line
+            return None
+        if not line:
+            # Only emitted once the next line shows it is not trailing
+            self.blank = self.started
+            return None
+        if self.blank:
+            line = "\n" + line
+        self.blank = False
+        self.started = True
+        return line + "\n"
+
+    def feed(self, chunk):
+        lines = (self.partial + chunk).split('\n')
+        self.partial = lines.pop()
+        kept = [self._line(line) for line in lines]
+        return "".join([line for line in kept if line])
+
+    def close(self):
+        line = self.partial
+        self.partial = ''
+        if line:
+            return self._line(line) or ''
+        return ''
+
+
+def normalise_stream(chunks, shell=False):
+
+    '''
+    Yields the canonical form of the chunks
+    '''
+
+    normaliser = Normaliser(shell)
+    for chunk in chunks:
+        text = normaliser.feed(chunk)
+        if text:
+            yield text
+    text = normaliser.close()
+    if text:
+        yield text
+
+
+def digest_stream(chunks, found, shell=False):
+
+    '''
+    Passes the chunks through unchanged, once they are all through
+    found['digest'] holds the sha1 of their canonical form
+    '''
+
+    normaliser = Normaliser(shell)
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(normaliser.feed(chunk))
+        yield chunk
+    digest.update(normaliser.close())
+    found['digest'] = digest.hexdigest()
+
+
+def file_digest(filename, shell=False):
+
+    '''
+    Returns the canonical digest of a stored file, read in chunks
+    '''
+
+    found = {}
+    fileh = open(filename, "rb")
+    for chunk in digest_stream(iter(lambda: fileh.read(65536), ''), found, shell):
+        pass
+    fileh.close()
+    return found['digest']
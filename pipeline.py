@@ -0,0 +1,641 @@
+#!/usr/bin/env python
+
+'''
+This module holds the streaming pipeline used by grab_configs.py and
+send_commands.py:
+
+inventory reader -> connector -> fetcher -> sanitizer -> hostname sniffer -> writer
+
+Each stage after the connector is a generator, device output is passed along
+in chunks of at most CHUNK_SIZE bytes and is never held in memory as a whole.
+
+Devices are handed to a fixed number of worker threads through a bounded
+queue.  The inventory reader blocks once max_in_flight devices are waiting, so
+memory use stays the same whether the .info file lists ten devices or fifty
+thousand.
+
+Every run records its progress in a Metrics object (see metrics.py), the
+workers set it as the current one for their thread so the connector and
+fetcher can time themselves without it being passed through every job.
+
+paramiko is only imported once a device is contacted, telnet sessions use
+the client in telnet.py.
+'''
+
+import Queue
+import os
+import socket
+import threading
+import time
+
+from transport import SSHSession
+from transport import JumpHost
+from transport import BastionError
+from transport import shell_send
+from telnet import TelnetSession
+from telnet import TelnetError
+from telnet import TelnetAuthError
+from metrics import Metrics
+from metrics import Dashboard
+from concurrency import RUN
+from concurrency import HELD
+from compute import Deferred
+from recording import device_options
+from activity_log import device_seconds
+
+
+CHUNK_SIZE = 32768
+
+# The Metrics of the run a worker thread belongs to
+_current = threading.local()
+
+# Sessions per bastion, see JumpHost
+JUMP_CHANNELS = 10
+
+# (bastion, username) -> JumpHost, shared by every worker
+_jump_hosts = {}
+_jump_lock = threading.Lock()
+
+# SessionRecorder and SessionPlayer of the run, see recording.py
+_recorder = None
+_player = None
+
+
+class DeviceError(Exception):
+
+    '''
+    Raised when a device cannot be processed.  screen is printed against the
+    device, status is written to the activity.log
+    '''
+
+    def __init__(self, screen, status):
+        Exception.__init__(self, screen)
+        self.screen = screen
+        self.status = status
+
+
+def parse_device(line):
+
+    '''
+    Converts a line of the .info file into a device dict, returns None for
+    blank lines.  See grab_configs.py for the options.
+    '''
+
+    line = line.strip()
+    if not line:
+        return None
+
+    device = {'ip': line, 'skip': False, 'hp': False, 'telnet': False,
+              'username': None, 'password': None, 'enable': '', 'site': None,
+              'jump': None, 'jump_username': None, 'jump_password': None, 'vars': {}}
+
+    if '#' in line:
+        device['ip'] = line.split('#')[1]
+        device['skip'] = True
+        return device
+
+    options = line.split(':')
+    device['ip'] = options[0]
+    for option in options[1:]:
+        values = option.split(',')
+        # :hp is the original form of :model,hp
+        if values[0] in ('model', 'hp'):
+            device['hp'] = True
+        if values[0] == 'conn':
+            device['telnet'] = True
+        if values[0] == 'user':
+            device['username'] = values[1]
+            device['password'] = values[2]
+            if len(values) > 3:
+                device['enable'] = values[3]
+        if values[0] == 'site':
+            device['site'] = values[1]
+        if values[0] == 'var':
+            # Template values, see config_render.py
+            device['vars'][values[1]] = ",".join(values[2:])
+        if values[0] == 'jump':
+            device['jump'] = values[1]
+            if len(values) > 3:
+                device['jump_username'] = values[2]
+                device['jump_password'] = values[3]
+
+    return device
+
+
+def _inventory_devices(fileh):
+    for line in fileh:
+        device = parse_device(line)
+        if device:
+            yield device
+    fileh.close()
+
+
+def read_inventory(filename):
+
+    '''
+    Returns the customer dir and a generator of devices.  The file is read a
+    line at a time as the pipeline asks for more work.
+    '''
+
+    fileh = open(filename)
+    cust_dir = fileh.readline().strip()
+    return cust_dir, _inventory_devices(fileh)
+
+
+def count_inventory(filename):
+
+    '''
+    Returns the number of devices in a .info file, for the ETA.  Reads the
+    file a line at a time, nothing is kept.
+    '''
+
+    fileh = open(filename)
+    fileh.readline()
+    count = sum(1 for line in fileh if line.strip())
+    fileh.close()
+    return count
+
+
+def current_metrics():
+
+    '''
+    The Metrics of the run the calling thread is working for, None outside
+    run_pipeline
+    '''
+
+    return getattr(_current, 'metrics', None)
+
+
+def jump_host(device, username, password, cache):
+
+    '''
+    Returns the JumpHost for a device's :jump option, every device behind
+    the same bastion with the same login shares one
+    '''
+
+    username = device['jump_username'] or username
+    password = device['jump_password'] or password
+    key = (device['jump'], username)
+    with _jump_lock:
+        if key not in _jump_hosts:
+            _jump_hosts[key] = JumpHost(device['jump'], username, password, cache,
+                                        max_channels=JUMP_CHANNELS)
+        return _jump_hosts[key]
+
+
+def close_jump_hosts():
+
+    '''
+    Closes the connections to the bastions, they reopen if used again
+    '''
+
+    with _jump_lock:
+        for jump in _jump_hosts.values():
+            jump.close()
+
+
+def record_sessions(recorder):
+
+    '''
+    Records every device opened from now on with the SessionRecorder, None
+    stops recording
+    '''
+
+    global _recorder
+    _recorder = recorder
+
+
+def replay_sessions(player):
+
+    '''
+    Opens devices from the SessionPlayer's recording rather than the network
+    from now on, None goes back to the network
+    '''
+
+    global _player
+    _player = player
+
+
+def open_device(device, username, password, cache, timeout=8, need_shell=False):
+
+    '''
+    Connector stage.  Returns (session, shell), shell is None when the
+    device can use exec_command (unless need_shell is set), session is None
+    for telnet.
+    '''
+
+    started = time.time()
+    _current.recording = None
+    try:
+        if _player:
+            opened = _replay(device, need_shell)
+        else:
+            opened = _connect(device, username, password, cache, timeout, need_shell)
+    except DeviceError as err:
+        if _recorder:
+            _recorder.failed(device['ip'], time.time() - started, err.screen, err.status,
+                             device_options(device, cache))
+        raise
+    finally:
+        # The adaptive limiter reads it back once the job is done
+        _current.connect = time.time() - started
+        metrics = current_metrics()
+        if metrics:
+            metrics.observe('connect', _current.connect)
+
+    if _recorder:
+        session, shell = opened
+        _current.recording = _recorder.start(device['ip'], _current.connect,
+                                             device_options(device, cache, shell))
+        # Everything read from here on is recorded, see recording.py
+        opened = _current.recording.wrap(session, shell, device['enable'])
+    return opened
+
+
+def _replay(device, need_shell):
+
+    '''
+    Opens the recorded device as the same kind of session and shell the
+    live run had
+    '''
+
+    session = _player.open(device)
+    if session is None:
+        raise DeviceError("No recording.", "*** No recording. ***")
+    if session.failure:
+        raise DeviceError(*session.failure)
+    if session.options.get('telnet'):
+        return None, session.shell()
+    if session.options.get('shell'):
+        return session, session.shell()
+    if need_shell:
+        raise DeviceError("No shell in the recording.", "*** No recording. ***")
+    return session, None
+
+
+def _connect(device, username, password, cache, timeout, need_shell):
+    ip_addr = device['ip']
+
+    jump = None
+    if device['jump']:
+        # The bastion login is the run's unless the :jump option carries one,
+        # never the device's own :user login
+        jump = jump_host(device, username, password, cache)
+
+    if device['username']:
+        username = device['username']
+        password = device['password']
+
+    if device['telnet']:
+        try:
+            shell = TelnetSession(ip_addr, timeout=timeout, jump=jump)
+        except BastionError as err:
+            raise DeviceError("%s." % err, "*** Bastion error. ***")
+        except (socket.error, TelnetError):
+            raise DeviceError("Could not connect (Telnet).", "*** Connection error (Telnet). ***")
+        try:
+            shell.login(username, password)
+        except TelnetAuthError:
+            shell.close()
+            raise DeviceError("Authentication failed (Telnet).", "*** Authentication failed. ***")
+        except (socket.error, TelnetError):
+            shell.close()
+            raise DeviceError("No login prompt (Telnet).", "*** Connection error (Telnet). ***")
+        return None, shell
+
+    import paramiko
+    try:
+        session = SSHSession(ip_addr, username, password, cache, timeout=timeout, jump=jump)
+    except BastionError as err:
+        # Reported apart from the device's own failures, see concurrency.py
+        raise DeviceError("%s." % err, "*** Bastion error. ***")
+    except paramiko.BadHostKeyException:
+        raise DeviceError("Host key mismatch (SSH).", "*** Host key mismatch. ***")
+    except paramiko.ssh_exception.AuthenticationException:
+        raise DeviceError("Authentication failed (SSH).", "*** Authentication failed. ***")
+    except (socket.error, paramiko.SSHException):
+        raise DeviceError("Could not connect (SSH).", "*** Connection error (SSH). ***")
+
+    if not device['hp'] and not device['enable'] and not need_shell:
+        return session, None
+
+    # HP does not support exec_command, enable mode needs a shell as well
+    shell = session.invoke_shell(width=200, height=99999)
+    # Strip MOTD
+    shell.recv(2000)
+    return session, shell
+
+
+def close_device(session, shell):
+
+    '''
+    Closes whatever open_device returned
+    '''
+
+    recording = getattr(_current, 'recording', None)
+    if recording:
+        recording.close()
+        _current.recording = None
+    if shell:
+        shell.close()
+    if session:
+        session.close()
+
+
+def _exec_chunks(session, command):
+    stdout = session.exec_command(command)
+    while True:
+        chunk = stdout.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def prepare_shell(shell, device):
+
+    '''
+    Enters enable mode if the device has an enable password and turns off
+    paging
+    '''
+
+    telnet = device['telnet']
+
+    # Enable mode, telnet follows the prompts
+    if device['enable'] and telnet:
+        try:
+            shell.enable(device['enable'])
+        except TelnetError:
+            raise DeviceError("Enable password rejected (Telnet).", "*** Enable failed. ***")
+    elif device['enable']:
+        shell_send("enable 15", 1, 1000, shell, telnet)
+        shell_send(device['enable'], 1, 1000, shell, telnet)
+
+    # Press enter, turn off paging
+    shell_send("", 1, 1000, shell, telnet)
+    if device['hp']:
+        shell_send("no page", 1, 500, shell, telnet)
+    else:
+        shell_send("term len 0", 1, 500, shell, telnet)
+
+
+def send_line(shell, command, telnet):
+
+    '''
+    Sends a line to the shell without waiting for an answer
+    '''
+
+    if telnet:
+        shell.write(command + "\r\n")
+    else:
+        shell.send(command + "\n")
+
+
+def read_shell(shell, telnet, wait, idle):
+
+    '''
+    Yields whatever arrives on the shell until the device goes quiet.  We
+    give it wait seconds to start answering and idle seconds of silence to
+    finish.
+    '''
+
+    started = False
+    last = time.time()
+    while True:
+        if telnet:
+            chunk = shell.read_very_eager()
+        elif shell.recv_ready():
+            chunk = shell.recv(CHUNK_SIZE)
+        else:
+            chunk = ''
+
+        if chunk:
+            started = True
+            last = time.time()
+            yield chunk
+            continue
+
+        if shell_closed(shell, telnet):
+            return
+        quiet = time.time() - last
+        if (started and quiet >= idle) or quiet >= wait:
+            return
+        if telnet:
+            # Back as soon as the device sends more
+            shell.wait(0.1)
+        else:
+            time.sleep(0.1)
+
+
+def _shell_chunks(shell, device, command, wait, idle, prepare):
+    if prepare:
+        prepare_shell(shell, device)
+    send_line(shell, command, device['telnet'])
+    for chunk in read_shell(shell, device['telnet'], wait, idle):
+        yield chunk
+
+
+def shell_closed(shell, telnet):
+
+    '''
+    True if the far end has closed the shell
+    '''
+
+    if telnet:
+        return shell.eof
+    return shell.closed or shell.exit_status_ready()
+
+
+def fetch(session, shell, device, command, wait=6, idle=2, prepare=True):
+
+    '''
+    Fetcher stage.  Runs the command and yields the raw output in chunks.
+    Clear prepare when running further commands on a shell that has already
+    been through prepare_shell.
+    '''
+
+    if shell is None:
+        chunks = _exec_chunks(session, command)
+    else:
+        chunks = _shell_chunks(shell, device, command, wait, idle, prepare)
+    metrics = current_metrics()
+    if metrics:
+        return _metered(chunks, metrics)
+    return chunks
+
+
+def _metered(chunks, metrics):
+    started = time.time()
+    try:
+        for chunk in chunks:
+            metrics.add_bytes(len(chunk))
+            yield chunk
+    finally:
+        metrics.observe('fetch', time.time() - started)
+
+
+def write_stream(chunks, filename):
+
+    '''
+    Writer stage.  Writes the chunks to filename, returns the byte count.
+    '''
+
+    written = 0
+    fileh = open(filename, "wb")
+    try:
+        for chunk in chunks:
+            fileh.write(chunk)
+            written += len(chunk)
+    finally:
+        fileh.close()
+    return written
+
+
+def part_filename(folder, device):
+
+    '''
+    Scratch file a device's output is streamed into before it is renamed or
+    copied to its final place
+    '''
+
+    return "".join([folder, "/.", device['ip'], ".part"])
+
+
+def discard(filename):
+
+    '''
+    Removes a scratch file, ignores files that were never created
+    '''
+
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def run_pipeline(devices, job, report, max_in_flight=8, metrics=None, limiter=None):
+
+    '''
+    Runs job(device) for every device on max_in_flight worker threads.
+
+    job returns (name, screen, status) or raises DeviceError.  report is
+    called as report(device, name, screen, status) for every device, one at
+    a time, so it is safe to print and update the activity.log from it.
+
+    Progress is recorded in metrics (a new Metrics if not given) and shown
+    on the dashboard while the run lasts.  Returns the Metrics.
+
+    With an AdaptiveLimiter (see concurrency.py) devices only start when
+    their site has room, max_in_flight should match the limiter's.
+
+    A job can return a Deferred (see compute.py) once its session is closed,
+    the worker goes on to the next device and the finisher thread reports
+    the device when the compute tier is done with it.  At most
+    max_in_flight devices wait for the finisher.
+    '''
+
+    if metrics is None:
+        metrics = Metrics()
+    if limiter:
+        # The limiter bounds what is queued
+        work = Queue.Queue()
+    else:
+        work = Queue.Queue(max_in_flight)
+    finishing = Queue.Queue(max_in_flight)
+    report_lock = threading.Lock()
+    dashboard = Dashboard(metrics, report_lock).start()
+
+    def show(device, name, screen, status, seconds=None):
+        with report_lock:
+            # For the activity store, see activity_log.py
+            device_seconds(seconds)
+            dashboard.clear()
+            report(device, name, screen, status)
+            dashboard.draw()
+
+    def hold(device):
+        metrics.device_skipped()
+        show(device, "", "Skipping, repeated authentication failures at its site",
+             "*** Skipped, authentication failures at the site. ***")
+
+    def worker():
+        _current.metrics = metrics
+        while True:
+            device = work.get()
+            if device is None:
+                return
+            metrics.device_started()
+            started = time.time()
+            _current.connect = None
+            try:
+                result = job(device)
+            except DeviceError as err:
+                result = ("", err.screen, err.status)
+            except Exception as err:
+                result = ("", "Unexpected error: %s" % err, "*** Unexpected error. ***")
+            if isinstance(result, Deferred):
+                # The session is done, the rest is up to the compute tier
+                status = "Fetched."
+                finishing.put((device, result, started))
+            else:
+                status = result[2]
+                metrics.device_finished(status, time.time() - started)
+                show(device, *result, seconds=time.time() - started)
+            if limiter:
+                for parked, verdict in limiter.finish(device, status, _current.connect):
+                    if verdict == RUN:
+                        work.put(parked)
+                    else:
+                        hold(parked)
+
+    def finisher():
+        while True:
+            item = finishing.get()
+            if item is None:
+                return
+            device, deferred, started = item
+            try:
+                result = deferred.result()
+            except DeviceError as err:
+                result = ("", err.screen, err.status)
+            except Exception as err:
+                result = ("", "Unexpected error: %s" % err, "*** Unexpected error. ***")
+            metrics.device_finished(result[2], time.time() - started)
+            show(device, *result, seconds=time.time() - started)
+
+    finishing_thread = threading.Thread(target=finisher)
+    finishing_thread.daemon = True
+    finishing_thread.start()
+
+    workers = []
+    for x in range(max_in_flight):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+
+    for device in devices:
+        if device['skip']:
+            metrics.device_skipped()
+            show(device, "", "Skipping", "*** Skipped. ***")
+            continue
+        if limiter is None:
+            # Blocks while max_in_flight devices are already waiting
+            work.put(device)
+            continue
+        verdict = limiter.submit(device)
+        if verdict == RUN:
+            work.put(device)
+        elif verdict == HELD:
+            hold(device)
+
+    if limiter:
+        limiter.wait_idle()
+    for thread in workers:
+        work.put(None)
+    for thread in workers:
+        thread.join()
+    finishing.put(None)
+    finishing_thread.join()
+    close_jump_hosts()
+    dashboard.stop()
+    return metrics
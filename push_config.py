@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+'''
+This module pushes a configuration change to all devices held in a customer
+.info file in waves:
+
+canary (the first device) -> 5% -> 25% -> the rest
+
+Devices within a wave are pushed in parallel.  After each wave the health
+check commands are run against the wave's devices.  If the share of devices
+in a wave that failed the push or the health check is above the threshold
+(any failure for the canary) the push halts and the wave is rolled back.
+
+change file   - the config lines to push, entered in configure terminal
+rollback file - the config lines that undo the change.  A device specific
+                rollback can be placed in <customer dir>/rollback/<ip>.txt
+health file   - one show command per line, optionally followed by | and a
+                regex that must appear in the output, e.g.
+
+                show ip int brief
+                show ip bgp summary | Established
+
+The change and rollback files are config templates, {name} is replaced with
+the device's value (see config_render.py).  Every device is rendered before
+the canary, devices that cannot be rendered are left out of the push.
+
+Every session's output is appended to <customer dir>/push.log
+Please see grab_configs.py for more info on constructing the .info file
+'''
+
+import getpass
+import math
+import re
+import threading
+
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from toolkit import clean_ansi
+from session_cache import SessionCache
+from pipeline import read_inventory
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import prepare_shell
+from pipeline import send_line
+from pipeline import read_shell
+from pipeline import fetch
+from pipeline import run_pipeline
+from pipeline import DeviceError
+from config_render import ConfigTemplate
+from config_render import load_vars
+from config_render import device_vars
+from config_render import render_all
+
+'''
+Functions
+'''
+
+# Share of the devices that have been pushed by the end of each wave after the canary
+WAVE_FRACTIONS = (0.05, 0.25, 1.0)
+
+# Lines sent before the output is drained, so the device's input buffer
+# does not overflow and a rejection late in a long change is still read
+PASTE_BLOCK = 50
+
+# IOS and ProCurve mark rejected lines with these
+ERROR_RE = re.compile(r"^\s*% |Invalid input|Incomplete command|Ambiguous command", re.M)
+
+log_lock = threading.Lock()
+
+def read_lines(filename):
+
+    '''
+    This function returns the non blank lines of a file, an empty list if the
+    file is not there
+    '''
+
+    try:
+        fileh = open(filename)
+    except IOError:
+        return []
+    lines = [line.rstrip() for line in fileh if line.strip()]
+    fileh.close()
+    return lines
+
+def plan_waves(devices):
+
+    '''
+    This function splits the devices into the canary and the following waves
+    '''
+
+    if not devices:
+        return []
+    waves = [devices[:1]]
+    done = 1
+    for fraction in WAVE_FRACTIONS:
+        upto = max(done, int(math.ceil(len(devices) * fraction)))
+        if upto > done:
+            waves.append(devices[done:upto])
+            done = upto
+    return waves
+
+def update_push_log(folder, host_ip, action, output):
+
+    '''
+    This function appends a session's output to the push.log
+    '''
+
+    with log_lock:
+        fileh = open("".join([folder, "/push.log"]), "a")
+        fileh.write("\n%s %s\n" % (host_ip, action))
+        fileh.write(output)
+        fileh.close()
+
+def push_device(device, folder, username, password, cache, commands, action, save):
+
+    '''
+    Pipeline job, enters config mode and sends the commands PASTE_BLOCK at
+    a time, reading the output after each block.  Any line the device
+    rejects fails the device.
+    '''
+
+    session, shell = open_device(device, username, password, cache, need_shell=True)
+    telnet = device['telnet']
+    output = []
+    try:
+        prepare_shell(shell, device)
+        send_line(shell, "configure terminal", telnet)
+        for number, command in enumerate(commands):
+            send_line(shell, command, telnet)
+            if number % PASTE_BLOCK == PASTE_BLOCK - 1:
+                output.append("".join(read_shell(shell, telnet, 5, 0.3)))
+        send_line(shell, "end", telnet)
+        if save:
+            send_line(shell, "write memory", telnet)
+        output.append("".join(read_shell(shell, telnet, 15, 3)))
+        output = clean_ansi("".join(output))
+    finally:
+        close_device(session, shell)
+
+    update_push_log(folder, device['ip'], action, output)
+
+    errors = ERROR_RE.search(output)
+    if errors:
+        line = output[errors.start():].splitlines()[0].strip()
+        raise DeviceError("!!! %s rejected: %s !!!" % (action, line),
+                          "*** %s rejected: %s ***" % (action, line))
+    return "", "[ %s applied ]" % action, "%s applied." % action
+
+def health_check(device, folder, username, password, cache, checks):
+
+    '''
+    Pipeline job, runs the health check commands.  The device fails if a
+    command is rejected or its output is missing the expected text.
+    '''
+
+    session, shell = open_device(device, username, password, cache)
+    try:
+        for number, (command, expect) in enumerate(checks):
+            # The shell is only prepared (enable, paging) before the first command
+            output = clean_ansi("".join(fetch(session, shell, device, command, wait=15,
+                                              prepare=(number == 0))))
+            update_push_log(folder, device['ip'], "health: " + command, output)
+
+            if ERROR_RE.search(output) or (expect and not re.search(expect, output)):
+                raise DeviceError("!!! Health check failed: %s !!!" % command,
+                                  "*** Health check failed: %s ***" % command)
+    finally:
+        close_device(session, shell)
+    return "", "[ Healthy ]", "Health check passed."
+
+def run_wave(devices, job, folder, in_flight):
+
+    '''
+    This function runs a job across a wave in parallel, returns the set of
+    IPs that failed
+    '''
+
+    failed = set()
+
+    def report(device, name, screen, status):
+        print "%-15s > %s" % (device['ip'], screen)
+        status_update(folder, device['ip'], name, status)
+        if status.startswith("***"):
+            failed.add(device['ip'])
+
+    run_pipeline(iter(devices), job, report, in_flight)
+    return failed
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    print "\n====================================="
+    print "Push a change to all devices in waves"
+    print "=====================================\n"
+
+    while True:
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
+        password = getpass.getpass("Input SSH password: ")
+        change_file = raw_input("Input the change file: ")
+        rollback_file = raw_input("Input the rollback file: ")
+        health_file = raw_input_def("Input the health check file (optional): ", "")
+        threshold = raw_input_def("Halt when the failure rate of a wave is above % [10]: ", "10")
+        in_flight = raw_input_def("Input max concurrent sessions [8]: ", "8")
+        save = raw_input_def("Save the config after the change (y/n) [y]: ", "y").lower() == "y"
+
+        print "\n"
+        print cust
+        print username
+        print "**PASSWORD HIDDEN**"
+        print change_file, rollback_file, health_file
+        print "threshold %s%%, %s sessions, save %s" % (threshold, in_flight, save)
+
+        yesno = raw_input("\nAre these details correct [y/n]: ").lower()
+        print
+        if yesno == "y" and in_flight.isdigit() and int(in_flight) > 0 and threshold.isdigit():
+            break
+
+    in_flight = int(in_flight)
+    threshold = float(threshold) / 100
+
+    change = ConfigTemplate("\n".join(read_lines(change_file)), change_file)
+    rollback = ConfigTemplate("\n".join(read_lines(rollback_file)), rollback_file)
+    checks = []
+    for line in read_lines(health_file):
+        fields = re.split(r'\s+\|\s+', line, 1)
+        checks.append((fields[0], fields[1] if len(fields) > 1 else None))
+
+    if not change.text:
+        print "The change file is empty, nothing to do.\n"
+        raise SystemExit(1)
+
+    (cust_dir, devices) = read_inventory(cust)
+    session_cache = SessionCache(cust_dir)
+
+    candidates = []
+    for device in devices:
+        if device['skip']:
+            print "%-15s > Skipping" % device['ip']
+            status_update(cust_dir, device['ip'], "", "*** Skipped. ***")
+        else:
+            candidates.append(device)
+
+    # Render every device up front so a missing value stops a device before
+    # the push starts rather than part way through
+    sidecar = load_vars(cust_dir)
+    tasks = [(device['ip'], device_vars(device, sidecar, session_cache.get(device['ip']).get('hostname')))
+             for device in candidates]
+    changes = render_all(change, tasks)
+    rollbacks = render_all(rollback, tasks)
+
+    targets = []
+    for device in candidates:
+        error = changes[device['ip']][1] or rollbacks[device['ip']][1]
+        if error:
+            print "%-15s > Not pushed, %s" % (device['ip'], error)
+            status_update(cust_dir, device['ip'], "", "*** Render failed: %s ***" % error)
+        else:
+            targets.append(device)
+
+    def change_job(device):
+        return push_device(device, cust_dir, username, password, session_cache,
+                           changes[device['ip']][0], "Change", save)
+
+    def health_job(device):
+        return health_check(device, cust_dir, username, password, session_cache, checks)
+
+    def rollback_job(device):
+        commands = (read_lines("".join([cust_dir, "/rollback/", device['ip'], ".txt"])) or
+                    rollbacks[device['ip']][0])
+        return push_device(device, cust_dir, username, password, session_cache,
+                           commands, "Rollback", save)
+
+    waves = plan_waves(targets)
+    pushed = []
+    halted = False
+
+    for number, wave in enumerate(waves):
+        name = "Canary" if number == 0 else "Wave %d" % number
+        print "\n%s: %d devices\n" % (name, len(wave))
+
+        failed = run_wave(wave, change_job, cust_dir, in_flight)
+        pushed.extend(wave)
+
+        healthy = [device for device in wave if device['ip'] not in failed]
+        if checks and healthy:
+            print "\n%s: health checks\n" % name
+            failed |= run_wave(healthy, health_job, cust_dir, in_flight)
+
+        rate = float(len(failed)) / len(wave)
+        print "\n%s: %d of %d failed" % (name, len(failed), len(wave))
+
+        if failed and (number == 0 or rate > threshold):
+            halted = True
+            print "\n!!! Failure rate above threshold, halting and rolling back %s !!!\n" % name
+            run_wave(wave, rollback_job, cust_dir, in_flight)
+
+            earlier = pushed[:-len(wave)]
+            if earlier:
+                yesno = raw_input_def("\nAlso roll back the %d devices in earlier waves (y/n) [n]: "
+                                      % len(earlier), "n").lower()
+                if yesno == "y":
+                    run_wave(earlier, rollback_job, cust_dir, in_flight)
+            break
+
+    session_cache.save()
+
+    '''
+    All done!
+    '''
+
+    if halted:
+        print "\nPush halted.  See %s/push.log and %s/activity.log\n" % (cust_dir, cust_dir)
+    else:
+        print "\nPush complete.\n"
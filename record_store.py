@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+'''
+This module stores the records produced by show_parsers.py next to the raw
+output in the customer dir:
+
+<customer dir>/<template>.csv     one row per record
+<customer dir>/<template>.jsonl   one JSON object per line
+<customer dir>/records.db         SQLite, a table per template indexed on
+                                  device and capture time, and on the
+                                  values named by the template's index lines
+
+Every record carries the device IP and the time it was captured.  Queries
+over the estate are then table scans or index lookups rather than another
+pass of regexes over command.log.
+'''
+
+import csv
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+
+FORMATS = ('csv', 'jsonl', 'sqlite')
+
+SQL_TYPES = {'int': 'INTEGER', 'float': 'REAL'}
+
+
+class RecordStore(object):
+
+    '''
+    Appends parsed records for a customer dir, safe to share between the
+    pipeline worker threads
+    '''
+
+    def __init__(self, folder, formats=FORMATS, db_name="records.db"):
+        self.folder = folder
+        self.formats = formats
+        self.lock = threading.Lock()
+        self.tables = set()
+        self.conn = None
+        if 'sqlite' in formats:
+            self.conn = sqlite3.connect(os.path.join(folder, db_name),
+                                        timeout=30, check_same_thread=False)
+
+    def _table(self, template):
+        if template.name in self.tables:
+            return
+        columns = ", ".join(["device TEXT", "captured TEXT"] +
+                            ["%s %s" % (field, SQL_TYPES.get(template.types[field], 'TEXT'))
+                             for field in template.values])
+        self.conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (template.name, columns))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS %s_device ON %s (device, captured)"
+                          % (template.name, template.name))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS %s_captured ON %s (captured)"
+                          % (template.name, template.name))
+        for field in template.indexes:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s, captured)"
+                              % (template.name, field, template.name, field))
+        self.tables.add(template.name)
+
+    def add(self, template, device, records, captured=None):
+
+        '''
+        Stores the records from one device's output, returns the number
+        stored.  records can be the generator from Template.parse.
+        '''
+
+        if captured is None:
+            captured = datetime.datetime.now().isoformat(' ')
+        columns = ['device', 'captured'] + template.values
+        rows = [dict(record, device=device, captured=captured) for record in records]
+        if not rows:
+            return 0
+
+        with self.lock:
+            if 'csv' in self.formats:
+                filename = os.path.join(self.folder, template.name + ".csv")
+                new_file = not os.path.exists(filename)
+                fileh = open(filename, "ab")
+                writer = csv.DictWriter(fileh, columns)
+                if new_file:
+                    writer.writerow(dict((column, column) for column in columns))
+                writer.writerows(rows)
+                fileh.close()
+
+            if 'jsonl' in self.formats:
+                fileh = open(os.path.join(self.folder, template.name + ".jsonl"), "a")
+                for row in rows:
+                    fileh.write(json.dumps(row, sort_keys=True) + "\n")
+                fileh.close()
+
+            if self.conn:
+                self._table(template)
+                self.conn.executemany(
+                    "INSERT INTO %s (%s) VALUES (%s)" % (template.name, ", ".join(columns),
+                                                        ", ".join("?" * len(columns))),
+                    [[row.get(column) for column in columns] for row in rows])
+                self.conn.commit()
+
+        return len(rows)
+
+    def query(self, table, field, value, since=None):
+
+        '''
+        Returns the rows of a table where field equals value, captured since
+        the given time (an ISO format string) if set, newest first.  Each row
+        is a dict.
+        '''
+
+        sql = "SELECT * FROM %s WHERE %s = ?" % (table, field)
+        args = [value]
+        if since:
+            sql += " AND captured >= ?"
+            args.append(since)
+        sql += " ORDER BY captured DESC"
+        with self.lock:
+            try:
+                cur = self.conn.execute(sql, args)
+            except sqlite3.OperationalError:
+                # Nothing has been stored in that table yet
+                return []
+            columns = [column[0] for column in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
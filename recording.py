@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+
+'''
+This module records device sessions during a real run and plays them back
+later without the devices, so the post-fetch pipeline (clean up, hostname,
+digest, logging, file writes) can be profiled and benchmarked offline with
+the same input every time.
+
+A recording is a directory holding run.json (the tool and command) and one
+<ip>.rec.gz per device, a gzip stream of events:
+
+kind (1 byte)  offset (double)  length (uint32)  payload
+
+O  the device was opened, offset is the seconds the connect took and the
+   payload JSON options: hp, telnet, enable, whether a shell was opened and
+   the hostname the session cache held
+C  a command was run with exec_command, the payload is the command
+S  a line was sent to the shell, the payload is the line (the enable
+   secret is left out)
+R  the device refused the enable secret (telnet)
+D  output arrived, offset is the seconds since the command or line was sent
+   and the payload the raw bytes exactly as the device sent them
+X  the device failed to open, the payload is JSON [screen, status, options]
+
+open_device (see pipeline.py) wraps the session and shell of a recorded
+device so everything read from them is recorded, the prompt probes and
+prepare_shell as well as the fetches.
+
+SessionPlayer stands in for the devices: open_device returns the same kind
+of session and shell the device had, answering from the recording at full
+speed or, with pace set, at the pace the device answered.  The shell hands
+out the output in the order it was read and reports the shell closed where
+the live read went idle, so the same code path runs without waiting.  A
+device that failed while recording fails the same way.
+
+See replay_sessions.py to run a recording back through the pipeline.
+'''
+
+import gzip
+import json
+import os
+import struct
+import time
+
+
+EVENT = struct.Struct("!cdI")
+
+OPENED = "O"
+COMMAND = "C"
+SENT = "S"
+REFUSED = "R"
+DATA = "D"
+FAILED = "X"
+
+
+def recording_filename(folder, host_ip):
+    return "".join([folder, "/", host_ip, ".rec.gz"])
+
+
+def run_folder(cust_dir):
+
+    '''
+    Returns a new recording directory for a run, under <cust_dir>/recordings
+    '''
+
+    return "".join([cust_dir, "/recordings/", time.strftime("%Y%m%d-%H%M%S")])
+
+
+def read_events(filename):
+
+    '''
+    Yields (kind, offset, payload) for each event in a recording file
+    '''
+
+    fileh = gzip.open(filename, "rb")
+    try:
+        while True:
+            header = fileh.read(EVENT.size)
+            if len(header) < EVENT.size:
+                return
+            kind, offset, length = EVENT.unpack(header)
+            yield kind, offset, fileh.read(length)
+    finally:
+        fileh.close()
+
+
+def device_options(device, cache, shell=None):
+
+    '''
+    Returns what replay needs to rebuild a device and take the same path
+    through the tools as the live run
+    '''
+
+    entry = cache.get(device['ip']) if cache else {}
+    return {'hp': bool(device['hp']), 'telnet': bool(device['telnet']),
+            'enable': bool(device['enable']), 'shell': shell is not None,
+            'hostname': entry.get('hostname')}
+
+
+def read_options(filename):
+
+    '''
+    Returns the options a device was recorded with, {} for recordings made
+    before they were kept
+    '''
+
+    for kind, offset, payload in read_events(filename):
+        if kind == OPENED and payload:
+            return json.loads(payload)
+        if kind == FAILED:
+            failure = json.loads(payload)
+            return failure[2] if len(failure) > 2 else {}
+        return {}
+    return {}
+
+
+def read_run(folder):
+
+    '''
+    Returns the run.json of a recording, {'tool': ..., 'command': ...}
+    '''
+
+    fileh = open("".join([folder, "/run.json"]))
+    run = json.load(fileh)
+    fileh.close()
+    return run
+
+
+class DeviceRecording(object):
+
+    '''
+    The events of one device, written as they happen
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fileh = gzip.open(filename + ".part", "wb")
+
+    def event(self, kind, offset, payload=""):
+        self.fileh.write(EVENT.pack(kind, offset, len(payload)))
+        self.fileh.write(payload)
+
+    def wrap(self, session, shell, secret):
+
+        '''
+        Returns the session and shell wrapped so everything read from them
+        is recorded
+        '''
+
+        if session is not None:
+            session = RecordingSession(session, self)
+        if shell is not None:
+            shell = RecordingShell(shell, self, secret)
+        return session, shell
+
+    def close(self):
+        self.fileh.close()
+        os.rename(self.filename + ".part", self.filename)
+
+
+class RecordingOutput(object):
+
+    '''
+    The output of a recorded exec_command
+    '''
+
+    def __init__(self, stdout, recording):
+        self.stdout = stdout
+        self.recording = recording
+        self.started = time.time()
+
+    def read(self, size=-1):
+        chunk = self.stdout.read(size)
+        if chunk:
+            self.recording.event(DATA, time.time() - self.started, chunk)
+        return chunk
+
+
+class RecordingSession(object):
+
+    '''
+    An SSH session whose exec_command output is recorded
+    '''
+
+    def __init__(self, session, recording):
+        self.session = session
+        self.recording = recording
+
+    def exec_command(self, command):
+        self.recording.event(COMMAND, 0, command)
+        return RecordingOutput(self.session.exec_command(command), self.recording)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class RecordingShell(object):
+
+    '''
+    An SSH or telnet shell whose lines and output are recorded
+    '''
+
+    def __init__(self, shell, recording, secret):
+        self.shell = shell
+        self.recording = recording
+        self.secret = secret
+        self.sent = time.time()
+
+    def _sent(self, line):
+        if self.secret and line.strip() == self.secret:
+            line = ""
+        self.sent = time.time()
+        self.recording.event(SENT, 0, line)
+
+    def _data(self, chunk):
+        if chunk:
+            self.recording.event(DATA, time.time() - self.sent, chunk)
+        return chunk
+
+    def send(self, data):
+        self._sent(data)
+        return self.shell.send(data)
+
+    def write(self, data):
+        self._sent(data)
+        return self.shell.write(data)
+
+    def recv(self, size):
+        return self._data(self.shell.recv(size))
+
+    def read_very_eager(self):
+        return self._data(self.shell.read_very_eager())
+
+    def command(self, line, timeout):
+        self._sent(line + "\r\n")
+        return self._data(self.shell.command(line, timeout))
+
+    def enable(self, secret):
+        # The secret is sent inside the telnet session, out of sight
+        self._sent("enable 15\r\n")
+        try:
+            return self.shell.enable(secret)
+        except Exception:
+            self.recording.event(REFUSED, 0)
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self.shell, name)
+
+
+class SessionRecorder(object):
+
+    '''
+    Records every device of a run into folder, safe to share between the
+    pipeline worker threads
+    '''
+
+    def __init__(self, folder, tool, command=None):
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fileh = open("".join([folder, "/run.json"]), "w")
+        json.dump({'tool': tool, 'command': command}, fileh)
+        fileh.close()
+
+    def start(self, host_ip, connect, options):
+
+        '''
+        Returns the DeviceRecording for a device that has just been opened,
+        options are its device_options
+        '''
+
+        recording = DeviceRecording(recording_filename(self.folder, host_ip))
+        recording.event(OPENED, connect, json.dumps(options))
+        return recording
+
+    def failed(self, host_ip, connect, screen, status, options):
+
+        '''
+        Records a device that could not be opened
+        '''
+
+        recording = DeviceRecording(recording_filename(self.folder, host_ip))
+        recording.event(FAILED, connect, json.dumps([screen, status, options]))
+        recording.close()
+
+
+class ReplayOutput(object):
+
+    '''
+    The file like output of a replayed command
+    '''
+
+    def __init__(self, chunks, pace):
+        self.chunks = list(chunks)
+        self.chunks.reverse()
+        self.pace = pace
+        self.started = time.time()
+
+    def read(self, size=-1):
+        if not self.chunks:
+            return ''
+        offset, chunk = self.chunks.pop()
+        if self.pace:
+            delay = self.started + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        return chunk
+
+
+class ReplayShell(object):
+
+    '''
+    A recorded SSH or telnet shell.  Each line sent moves on to the output
+    that followed it, the shell reads as closed once that output is used up
+    (or, paced, while it is not due yet it reads as quiet).
+    '''
+
+    def __init__(self, events, pace):
+        self.events = events
+        self.next = 0
+        self.pace = pace
+        self.sent = time.time()
+
+    def _pending(self):
+        return self.next < len(self.events) and self.events[self.next][0] == DATA
+
+    def _due(self):
+        return not self.pace or time.time() - self.sent >= self.events[self.next][1]
+
+    def _take(self):
+        if not self._pending() or not self._due():
+            return ''
+        self.next += 1
+        return self.events[self.next - 1][2]
+
+    def _send(self):
+        # Output the live run never read was not recorded, skip to the line
+        while self._pending():
+            self.next += 1
+        if self.next < len(self.events) and self.events[self.next][0] == SENT:
+            self.next += 1
+        self.sent = time.time()
+
+    def send(self, data):
+        self._send()
+
+    write = send
+
+    def recv(self, size):
+        return self._take()
+
+    def read_very_eager(self):
+        return self._take()
+
+    def recv_ready(self):
+        return self._pending() and self._due()
+
+    def wait(self, timeout):
+        if self.pace and self._pending():
+            time.sleep(max(0, min(timeout, self.sent + self.events[self.next][1] - time.time())))
+
+    def settle(self, wait):
+
+        '''
+        Stands in for the pause after a line is sent, see shell_send
+        '''
+
+        if self.pace:
+            time.sleep(wait)
+
+    def command(self, line, timeout):
+        self._send()
+        output = []
+        while self._pending():
+            self.wait(timeout)
+            output.append(self._take())
+        return "".join(output)
+
+    def enable(self, secret):
+        self._send()
+        if self.next < len(self.events) and self.events[self.next][0] == REFUSED:
+            self.next += 1
+            from telnet import TelnetAuthError
+            raise TelnetAuthError("Enable rejected")
+
+    @property
+    def closed(self):
+        return not self._pending()
+
+    eof = closed
+
+    def exit_status_ready(self):
+        return self.closed
+
+    def close(self):
+        pass
+
+
+class ReplaySession(object):
+
+    '''
+    A recorded device.  failure is (screen, status) if the device failed to
+    open while recording, None otherwise.  options are the device_options
+    it was recorded with.
+    '''
+
+    def __init__(self, filename, pace=False):
+        self.pace = pace
+        self.connect = 0
+        self.failure = None
+        self.options = {}
+        self.commands = {}
+        self.shell_events = []
+        command = None
+        for kind, offset, payload in read_events(filename):
+            if kind == OPENED:
+                self.connect = offset
+                self.options = json.loads(payload) if payload else {}
+            elif kind == FAILED:
+                self.connect = offset
+                failure = json.loads(payload)
+                self.failure = tuple(failure[:2])
+                self.options = failure[2] if len(failure) > 2 else {}
+            elif kind == COMMAND:
+                command = payload
+                self.commands[command] = []
+            elif kind in (SENT, REFUSED):
+                command = None
+                self.shell_events.append((kind, offset, payload))
+            elif kind == DATA and command is not None:
+                self.commands[command].append((offset, payload))
+            elif kind == DATA:
+                self.shell_events.append((kind, offset, payload))
+
+    def shell(self):
+
+        '''
+        Returns the recorded shell
+        '''
+
+        return ReplayShell(self.shell_events, self.pace)
+
+    def exec_command(self, command):
+
+        '''
+        Answers with the recorded output, none if the command was not
+        recorded
+        '''
+
+        return ReplayOutput(self.commands.get(command, []), self.pace)
+
+    def close(self):
+        pass
+
+
+class SessionPlayer(object):
+
+    '''
+    Opens recorded devices in place of the real ones.  A device is looked up
+    by its 'recording' key if it has one, its IP otherwise, so one recording
+    can stand in for many devices.
+    '''
+
+    def __init__(self, folder, pace=False):
+        self.folder = folder
+        self.pace = pace
+
+    def open(self, device):
+
+        '''
+        Returns the ReplaySession for a device, None if it was not recorded
+        '''
+
+        filename = recording_filename(self.folder, device.get('recording') or device['ip'])
+        if not os.path.exists(filename):
+            return None
+        session = ReplaySession(filename, self.pace)
+        if self.pace:
+            time.sleep(session.connect)
+        return session
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+'''
+This module renders a config template for every device in a customer .info
+file, see config_render.py for the template format and where the values
+come from.  Nothing is sent to the devices, the result is written to
+
+<customer dir>/rendered/<ip>.txt
+
+for review.  A file is only rewritten if its contents have changed, so the
+timestamps show which devices a template or data change touched.  The same
+templates can be used directly as the change and rollback files of
+push_config.py.
+
+render_configs.py                   prompts for the files
+render_configs.py cust.info vlan.tpl
+
+Please see grab_configs.py for more info on constructing the .info file
+'''
+
+import os
+import sys
+import time
+
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from session_cache import SessionCache
+from pipeline import read_inventory
+from config_render import load_config_template
+from config_render import load_vars
+from config_render import device_vars
+from config_render import render_all
+
+
+'''
+Functions
+'''
+
+def write_if_changed(filename, lines):
+
+    '''
+    This function writes the lines to filename unless it already holds
+    them, returns True if the file was written
+    '''
+
+    text = "\n".join(lines) + "\n"
+    try:
+        fileh = open(filename)
+        same = fileh.read() == text
+        fileh.close()
+        if same:
+            return False
+    except IOError:
+        pass
+    fileh = open(filename, "w")
+    fileh.write(text)
+    fileh.close()
+    return True
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    if len(sys.argv) > 2:
+        cust = sys.argv[1]
+        template_file = sys.argv[2]
+    else:
+        print "\n======================="
+        print "Render config templates"
+        print "=======================\n"
+
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        template_file = raw_input("Input the config template file: ")
+
+    started = time.time()
+
+    template = load_config_template(template_file)
+    (cust_dir, devices) = read_inventory(cust)
+    session_cache = SessionCache(cust_dir)
+    sidecar = load_vars(cust_dir)
+
+    tasks = []
+    for device in devices:
+        if not device['skip']:
+            hostname = session_cache.get(device['ip']).get('hostname')
+            tasks.append((device['ip'], device_vars(device, sidecar, hostname)))
+
+    results = render_all(template, tasks)
+
+    folder = "".join([cust_dir, "/rendered"])
+    if not os.path.isdir(folder):
+        os.mkdir(folder)
+
+    written = 0
+    failed = 0
+    for host_ip, variables in tasks:
+        lines, error = results[host_ip]
+        if error:
+            print "%-15s > %s" % (host_ip, error)
+            failed += 1
+        elif write_if_changed("".join([folder, "/", host_ip, ".txt"]), lines):
+            written += 1
+
+    '''
+    All done!
+    '''
+
+    print "\nRendered %d devices in %.1fs, %d files changed, %d could not be rendered.\n" % (
+        len(tasks) - failed, time.time() - started, written, failed)
+    print "Uses: %s\n" % ", ".join(template.fields)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+'''
+This module runs a recording made by grab_configs.py or send_commands.py
+(answer y to "Record the sessions") back through the same pipeline without
+contacting any device, see recording.py.  Everything after the fetch runs
+for real: the compute pool, hostname, digest, template parsing, logs and
+file writes, into a scratch customer dir that is removed afterwards.
+
+replay_sessions.py <recording dir>               as fast as it will go
+replay_sessions.py <recording dir> 100           each device stands in for 100
+replay_sessions.py <recording dir> 1 pace        at the pace the devices answered
+
+The same recording gives the same input every time, so runs can be compared
+before and after a change to the post-fetch code.
+'''
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pipeline import parse_device
+from pipeline import replay_sessions
+from pipeline import run_pipeline
+from session_cache import SessionCache
+from recording import SessionPlayer
+from recording import read_run
+from recording import read_options
+from compute import ComputePool
+from metrics import Metrics
+
+
+'''
+Functions
+'''
+
+IN_FLIGHT = 32
+
+def replay_devices(folder, copies, cache):
+
+    '''
+    Yields a device for each recording, copies times over.  The copies get
+    addresses of their own but play the same recording.  Each device gets
+    the options it was recorded with and the session cache the hostname
+    the live run had, so the tools take the same path through the device.
+    '''
+
+    options = {}
+    for copy in range(copies):
+        for filename in sorted(glob.glob(os.path.join(folder, "*.rec.gz"))):
+            host_ip = os.path.basename(filename)[:-len(".rec.gz")]
+            if host_ip not in options:
+                options[host_ip] = read_options(filename)
+            device = parse_device(host_ip if copy == 0 else "%s-%d" % (host_ip, copy))
+            device['recording'] = host_ip
+            device['hp'] = options[host_ip].get('hp', False)
+            device['telnet'] = options[host_ip].get('telnet', False)
+            # Never recorded, any secret takes prepare_shell down the same path
+            device['enable'] = "replay" if options[host_ip].get('enable') else ''
+            if options[host_ip].get('hostname'):
+                cache.update(device['ip'], hostname=options[host_ip]['hostname'])
+            yield device
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print "\nUsage: replay_sessions.py <recording dir> [copies] [pace]\n"
+        raise SystemExit(1)
+
+    folder = sys.argv[1]
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    pace = len(sys.argv) > 3 and sys.argv[3] == "pace"
+    run = read_run(folder)
+
+    # Pool processes fork before any thread starts
+    compute = ComputePool()
+    scratch_dir = tempfile.mkdtemp(prefix="replay-")
+    session_cache = SessionCache(scratch_dir)
+    replay_sessions(SessionPlayer(folder, pace))
+
+    if run['tool'] == "grab":
+        from grab_configs import grab_config
+
+        def job(device):
+            return grab_config(device, scratch_dir, "", "", session_cache, None, compute)
+    else:
+        from send_commands import send_command
+        from show_parsers import load_templates
+        from show_parsers import find_template
+        from record_store import RecordStore
+
+        template = find_template(load_templates(), run['command'])
+        record_store = RecordStore(scratch_dir) if template else None
+
+        def job(device):
+            return send_command(device, scratch_dir, "", "", session_cache, run['command'],
+                                None, template, record_store, compute)
+
+    statuses = {}
+
+    def report(device, name, screen, status):
+        statuses[status] = statuses.get(status, 0) + 1
+
+    devices = len(glob.glob(os.path.join(folder, "*.rec.gz"))) * copies
+    print "\nReplaying %d devices (%s) from %s%s\n" % (devices, run['tool'], folder,
+                                                       ", paced" if pace else "")
+    started = time.time()
+    run_pipeline(replay_devices(folder, copies, session_cache), job, report, IN_FLIGHT, Metrics(devices))
+    compute.close()
+    took = time.time() - started
+    shutil.rmtree(scratch_dir)
+
+    '''
+    All done!
+    '''
+
+    for status, count in sorted(statuses.items()):
+        print "%6d  %s" % (count, status)
+    print "\nReplayed %d devices in %.2fs, %.0f devices/s\n" % (devices, took, devices / max(took, 0.001))
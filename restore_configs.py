@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+'''
+This module restores the stored configs of all devices held in a customer
+.info file, e.g. after a site outage.  Devices are restored in parallel,
+each from <source dir>/<hostname>.txt where the hostname is the one
+grab_configs.py last saw (the source dir is the customer dir unless a copy
+of an earlier grab is given).
+
+For each device the stored config is normalised (see normalise.py) into a
+restore file and then:
+
+scp    copied to flash:restore.cfg over SCP and applied with
+       "configure replace flash:restore.cfg force", or if the device will
+       not replace "copy flash:restore.cfg running-config"
+paste  entered line by line in configure terminal, used for HP and telnet
+       devices and whenever SCP is refused
+
+then the running config is fetched again and its normalised digest
+compared with the stored config's.  Only a device whose digests match is
+written to memory, one whose digests differ is logged as "Restored, verify
+failed" and keeps its startup config.
+
+Every session's output is appended to <customer dir>/restore.log
+Please see grab_configs.py for more info on constructing the .info file
+'''
+
+import getpass
+import os
+import re
+import threading
+
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from toolkit import clean_ansi
+from toolkit import clean_ansi_stream
+from session_cache import SessionCache
+from transport import scp_put
+from pipeline import read_inventory
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import prepare_shell
+from pipeline import send_line
+from pipeline import read_shell
+from pipeline import fetch
+from pipeline import run_pipeline
+from pipeline import discard
+from pipeline import DeviceError
+from concurrency import AdaptiveLimiter
+from normalise import normalise_stream
+from normalise import digest_stream
+from push_config import ERROR_RE
+from push_config import PASTE_BLOCK
+
+'''
+Functions
+'''
+
+FLASH_FILE = "flash:restore.cfg"
+
+# configure replace is not there (older IOS) or the rollback did not go
+# through.  Its informational % lines are not errors.
+REPLACE_ERROR_RE = re.compile(r"Invalid input|Incomplete command|Ambiguous command|Unknown command|"
+                              r"Rollback aborted|[Ff]ailed to apply|%Error")
+
+log_lock = threading.Lock()
+
+def update_restore_log(folder, host_ip, action, output):
+
+    '''
+    This function appends a session's output to the restore.log
+    '''
+
+    with log_lock:
+        fileh = open("".join([folder, "/restore.log"]), "a")
+        fileh.write("\n%s %s\n" % (host_ip, action))
+        fileh.write(output)
+        fileh.close()
+
+def write_restore_file(stored, restore, shell):
+
+    '''
+    This function writes the normalised stored config to the restore file,
+    without the prompts and the lines that change on every capture.
+    Returns the digest the running config should have once restored.
+    '''
+
+    found = {}
+    fileh = open(stored, "rb")
+    outh = open(restore, "wb")
+    chunks = normalise_stream(clean_ansi_stream(iter(lambda: fileh.read(65536), '')), shell)
+    for chunk in digest_stream(chunks, found, True):
+        outh.write(chunk)
+    outh.close()
+    fileh.close()
+    return found['digest']
+
+def check_output(output, action):
+    errors = ERROR_RE.search(output)
+    if errors:
+        line = output[errors.start():].splitlines()[0].strip()
+        raise DeviceError("!!! %s rejected: %s !!!" % (action, line),
+                          "*** %s rejected: %s ***" % (action, line))
+
+def apply_flash(shell, device):
+
+    '''
+    This function applies the restore file copied to flash, returns the
+    session output
+    '''
+
+    telnet = device['telnet']
+    send_line(shell, "configure replace %s force" % FLASH_FILE, telnet)
+    output = clean_ansi("".join(read_shell(shell, telnet, 60, 5)))
+    if REPLACE_ERROR_RE.search(output):
+        # Older IOS has no configure replace, merge instead
+        send_line(shell, "copy %s running-config" % FLASH_FILE, telnet)
+        send_line(shell, "", telnet)
+        output += clean_ansi("".join(read_shell(shell, telnet, 60, 5)))
+        check_output(output.split("copy %s" % FLASH_FILE)[-1], "Copy")
+    return output
+
+def restore_paste(shell, device, restore):
+
+    '''
+    This function enters the restore file in configure terminal, returns
+    the session output
+    '''
+
+    telnet = device['telnet']
+    output = []
+    send_line(shell, "configure terminal", telnet)
+    fileh = open(restore)
+    for number, line in enumerate(fileh):
+        line = line.rstrip()
+        if line == "end":
+            continue
+        send_line(shell, line, telnet)
+        if number % PASTE_BLOCK == PASTE_BLOCK - 1:
+            output.append("".join(read_shell(shell, telnet, 5, 0.3)))
+    fileh.close()
+    send_line(shell, "end", telnet)
+    output.append("".join(read_shell(shell, telnet, 15, 2)))
+    output = clean_ansi("".join(output))
+    check_output(output, "Paste")
+    return output
+
+def restore_device(device, folder, source, username, password, cache, method):
+
+    '''
+    Pipeline job, restores a device's stored config, verifies it by
+    comparing digests and only then writes it to memory
+    '''
+
+    name = cache.get(device['ip']).get('hostname')
+    stored = "".join([source, "/", str(name), ".txt"])
+    if not name or not os.path.exists(stored):
+        raise DeviceError("!!! No stored config !!!", "*** No stored config. ***")
+
+    # The stored config holds prompts if it was fetched through a shell
+    stored_shell = device['hp'] or device['telnet'] or bool(device['enable'])
+    restore = "".join([folder, "/", device['ip'], ".restore"])
+
+    session, shell = open_device(device, username, password, cache, need_shell=True)
+    try:
+        expected = write_restore_file(stored, restore, stored_shell)
+        prepare_shell(shell, device)
+        used = "paste"
+        if method == "scp" and session and not device['hp']:
+            try:
+                scp_put(session, restore, FLASH_FILE)
+                used = "scp"
+            except Exception as err:
+                # SCP disabled on the device, no room on flash and the like,
+                # the paste still works
+                update_restore_log(folder, device['ip'], "SCP refused", "%s\n" % err)
+        if used == "scp":
+            output = apply_flash(shell, device)
+        else:
+            output = restore_paste(shell, device, restore)
+        update_restore_log(folder, device['ip'], "Restore (%s)" % used, output)
+
+        found = {}
+        for chunk in digest_stream(fetch(session, shell, device, "show run", wait=15, prepare=False),
+                                   found, True):
+            pass
+        if found['digest'] != expected:
+            raise DeviceError("!!! Restored (%s), verify failed, not saved !!!" % used,
+                              "*** Restored (%s), verify failed. ***" % used)
+
+        send_line(shell, "write memory", device['telnet'])
+        update_restore_log(folder, device['ip'], "Save",
+                           clean_ansi("".join(read_shell(shell, device['telnet'], 15, 2))))
+    finally:
+        close_device(session, shell)
+        discard(restore)
+
+    return name + ".txt", "[ Restored (%s) and verified ]" % used, "Restored (%s) and verified." % used
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    # read defaults
+
+    (def_cust, def_user) = get_defaults()
+
+    print "\n========================================"
+    print "Restore the stored configs to the devices"
+    print "========================================\n"
+
+    while True:
+        cust = raw_input_def("Input the customer info file [%s]: " % def_cust, def_cust)
+        username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
+        password = getpass.getpass("Input SSH password: ")
+        source = raw_input_def("Input the folder holding the configs, blank for the customer dir []: ", "")
+        only = raw_input_def("Only restore the devices at this site, or this IP or hostname, blank for all []: ", "")
+        method = raw_input_def("Restore by scp (falls back to paste) or paste [scp]: ", "scp").lower()
+        in_flight = raw_input_def("Input max concurrent sessions [16]: ", "16")
+
+        print "\n"
+        print cust
+        print username
+        print "**PASSWORD HIDDEN**"
+        print source or "customer dir"
+        print only or "all devices"
+        print method, in_flight
+
+        yesno = raw_input("\nAre these details correct [y/n]: ").lower()
+        print
+        if (yesno == "y" and method in ("scp", "paste") and
+                in_flight.isdigit() and int(in_flight) > 0):
+            break
+
+    (cust_dir, devices) = read_inventory(cust)
+    source = source or cust_dir
+    session_cache = SessionCache(cust_dir)
+
+    targets = [device for device in devices if not device['skip'] and
+               (not only or only in (device['site'], device['ip'],
+                                     session_cache.get(device['ip']).get('hostname')))]
+
+    # The running config of every target is replaced, make sure
+    print "The running config of %d devices will be replaced from %s" % (len(targets), source)
+    if raw_input("Type RESTORE to continue: ") != "RESTORE":
+        raise SystemExit(1)
+    print
+
+    def report(device, name, screen, status):
+        print "%-15s > %s" % (device['ip'], screen)
+        status_update(cust_dir, device['ip'], name, status)
+
+    def job(device):
+        return restore_device(device, cust_dir, source, username, password, session_cache, method)
+
+    limiter = AdaptiveLimiter(int(in_flight))
+    metrics = run_pipeline(iter(targets), job, report, int(in_flight), None, limiter)
+    session_cache.save()
+
+    '''
+    All done!
+    '''
+
+    figures = metrics.snapshot()
+    print "\nRestore complete, %d restored, %d failed.  See %s/restore.log and %s/activity.log\n" % (
+        figures['done'], figures['failed'], cust_dir, cust_dir)
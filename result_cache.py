@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+'''
+This module holds the show command result cache used by send_commands.py.
+The same show command is often run across the estate several times within
+a few minutes, with the cache switched on a device whose output is still
+fresh is answered from disk and only stale or missing entries are fetched.
+
+Entries are keyed on device IP, command and credential scope (the username,
+and whether enable mode was used) so output seen with one login is never
+handed to another.  Only show commands are cached, each for the TTL of the
+longest matching command prefix in TTLS.  Each word of the command is
+matched as an IOS abbreviation of the prefix's word, so "sh ver" is "show
+version" and "sh proc cpu" is "show processes".  A command that matches no
+prefix, or is ambiguous with different TTLs, is not cached, nor is output
+the device rejected.  A <customer dir>/cache.ttl file overrides or extends
+the table, one "<seconds> <command prefix>" per line:
+
+300   show ip int
+0     show clock            # never cached
+
+The cache is kept in the <customer dir>:
+
+results/        the cleaned output of each entry, <sha1 of the key>.txt
+results.cache   JSON, per entry the device, command, scope, when it was
+                stored, when it was last used and its size
+
+Once the entries are over max_entries or max_bytes the least recently used
+are evicted.  Like the session cache the index is only written by save().
+'''
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+
+# Seconds each show command stays fresh, longest prefix wins.  Commands
+# that match none of these are not cached.
+TTLS = [
+    ("show version", 3600),
+    ("show inventory", 86400),
+    ("show module", 86400),
+    ("show ip int", 300),
+    ("show interfaces", 120),
+    ("show ip route", 300),
+    ("show ip arp", 300),
+    ("show ip bgp summary", 120),
+    ("show mac address-table", 120),
+    ("show vlan", 300),
+    ("show cdp neighbors", 3600),
+    ("show lldp neighbors", 3600),
+    ("show running-config", 300),
+    ("show startup-config", 300),
+    ("show logging", 0),
+    ("show clock", 0),
+    ("show processes", 0),
+]
+
+SHOW_RE = re.compile(r"^sh(o|ow)?\s+", re.I)
+
+# Output the device refused, never cached
+REJECTED_RE = re.compile(r"% ?(Invalid input|Incomplete command|Ambiguous command|Unknown command)")
+
+MAX_ENTRIES = 20000
+MAX_BYTES = 256 * 1024 * 1024
+
+
+def normalise_command(command):
+
+    '''
+    Lower case, single spaced, "sh" spelt out so "sh ver" and "show  ver"
+    share an entry.  Returns None for anything that is not a show command.
+    '''
+
+    command = " ".join(command.lower().split())
+    if not SHOW_RE.match(command):
+        return None
+    return SHOW_RE.sub("show ", command)
+
+
+def abbreviates(words, prefix_words):
+
+    '''
+    True if the command words start with the prefix words, each command word
+    may be cut short as IOS allows ("int" for "interfaces") and each prefix
+    word may be too ("int" in "show ip int" matches "interface")
+    '''
+
+    if len(words) < len(prefix_words):
+        return False
+    for word, prefix_word in zip(words, prefix_words):
+        if not (prefix_word.startswith(word) or word.startswith(prefix_word)):
+            return False
+    return True
+
+
+def credential_scope(device, username):
+
+    '''
+    Returns the credential scope of a device's output, the login used and
+    whether it was seen in enable mode
+    '''
+
+    scope = device['username'] or username
+    if device['enable']:
+        scope += ":enable"
+    return scope
+
+
+def load_ttls(folder):
+
+    '''
+    Returns the TTL table with the <customer dir>/cache.ttl overrides applied
+    '''
+
+    ttls = dict(TTLS)
+    try:
+        fileh = open("".join([folder, "/cache.ttl"]))
+    except IOError:
+        return ttls
+    for line in fileh:
+        fields = line.split("#")[0].split(None, 1)
+        if len(fields) == 2 and fields[0].isdigit():
+            ttls[normalise_command(fields[1]) or fields[1].strip()] = int(fields[0])
+    fileh.close()
+    return ttls
+
+
+class ResultCache(object):
+
+    '''
+    Cached show command output for a customer dir, safe to share between the
+    pipeline worker threads
+    '''
+
+    def __init__(self, folder, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.folder = "".join([folder, "/results"])
+        self.index_filename = "".join([folder, "/results.cache"])
+        self.ttls = load_ttls(folder)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.bytes = 0
+        self.dirty = False
+
+        if not os.path.isdir(self.folder):
+            os.mkdir(self.folder)
+        try:
+            fileh = open(self.index_filename)
+        except IOError:
+            return
+        try:
+            self.entries = json.load(fileh)
+        except ValueError:
+            # Corrupt index, start again rather than stop the run
+            self.entries = {}
+        fileh.close()
+        self.bytes = sum(entry['size'] for entry in self.entries.values())
+
+    def ttl(self, command):
+
+        '''
+        Returns the seconds the output of a command stays fresh, 0 if it is
+        not cached at all
+        '''
+
+        command = normalise_command(command)
+        if not command:
+            return 0
+        words = command.split()
+        best = 0
+        ttls = set()
+        for prefix, ttl in self.ttls.items():
+            prefix_words = prefix.split()
+            if len(prefix_words) < best or not abbreviates(words, prefix_words):
+                continue
+            if len(prefix_words) > best:
+                best = len(prefix_words)
+                ttls = set()
+            ttls.add(ttl)
+        # Ambiguous between entries with different times, play safe
+        return ttls.pop() if len(ttls) == 1 else 0
+
+    def _key(self, host_ip, command, scope):
+        key = "\n".join([host_ip, normalise_command(command), scope])
+        return hashlib.sha1(key).hexdigest()
+
+    def _filename(self, key):
+        return "".join([self.folder, "/", key, ".txt"])
+
+    def lookup(self, host_ip, command, scope):
+
+        '''
+        Returns (filename, age in seconds) of fresh output for the device,
+        (None, None) if there is none
+        '''
+
+        ttl = self.ttl(command)
+        if not ttl:
+            return None, None
+        key = self._key(host_ip, command, scope)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry or now - entry['stored'] >= ttl:
+                return None, None
+            filename = self._filename(key)
+            if not os.path.exists(filename):
+                self.bytes -= self.entries.pop(key)['size']
+                self.dirty = True
+                return None, None
+            entry['used'] = now
+            self.dirty = True
+            return filename, now - entry['stored']
+
+    def put(self, host_ip, command, scope, source):
+
+        '''
+        Stores a copy of the output file source for the device, if the
+        command is one that is cached
+        '''
+
+        if not self.ttl(command):
+            return
+        fileh = open(source, "rb")
+        head = fileh.read(65536)
+        fileh.close()
+        if REJECTED_RE.search(head):
+            return
+        key = self._key(host_ip, command, scope)
+        filename = self._filename(key)
+        scratch = filename + ".part"
+        shutil.copyfile(source, scratch)
+        os.rename(scratch, filename)
+
+        now = time.time()
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries[key]['size']
+            self.entries[key] = {'ip': host_ip, 'command': normalise_command(command),
+                                 'scope': scope, 'stored': now, 'used': now,
+                                 'size': os.path.getsize(filename)}
+            self.bytes += self.entries[key]['size']
+            self.dirty = True
+            self._evict()
+
+    def _evict(self):
+
+        '''
+        Drops the least recently used entries until the cache is within its
+        bounds, the caller holds the lock
+        '''
+
+        if len(self.entries) <= self.max_entries and self.bytes <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['used']):
+            if len(self.entries) <= self.max_entries and self.bytes <= self.max_bytes:
+                break
+            self.bytes -= self.entries.pop(key)['size']
+            try:
+                os.remove(self._filename(key))
+            except OSError:
+                pass
+
+    def save(self):
+
+        '''
+        Writes results.cache if anything changed during the run
+        '''
+
+        with self.lock:
+            if not self.dirty:
+                return
+            fileh = open(self.index_filename, "w")
+            json.dump(self.entries, fileh, indent=1, sort_keys=True)
+            fileh.close()
+            self.dirty = False
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+This module searches the stored configs and command output of every customer
+using the index built by grab_configs.py and send_commands.py, see
+search_index.py.
+
+The search text is matched as a phrase against single lines, case is ignored
+and so is punctuation between words, e.g.
+
+snmp-server community public
+vlan 410
+
+Usage:
+
+search_configs.py                           prompts for the search text
+search_configs.py vlan 410                  searches all customers
+search_configs.py -c acme-ltd vlan 410      searches one customer dir
+search_configs.py --reindex acme-ltd        adds the configs already in a
+                                            customer dir to the index
+'''
+
+import sys
+import glob
+import os
+
+from toolkit import raw_input_def
+from search_index import SearchIndex
+from session_cache import SessionCache
+
+
+'''
+Functions
+'''
+
+def reindex_folder(index, folder):
+
+    '''
+    This function indexes every <hostname>.txt config in a customer dir,
+    unchanged files are skipped.  The session cache gives the IP the config
+    is keyed on, a hostname it does not know (or knows more than once) is
+    indexed without one.
+    '''
+
+    addresses = {}
+    for host_ip, entry in SessionCache(folder).params.items():
+        name = entry.get('hostname')
+        if name:
+            addresses[name] = None if name in addresses else host_ip
+
+    changed = 0
+    for filename in sorted(glob.glob("".join([folder, "/*.txt"]))):
+        device = os.path.basename(filename)[:-4]
+        if index.add_file(folder, device, "config", filename, ip=addresses.get(device)):
+            changed += 1
+    return changed
+
+
+'''
+Main module loop
+'''
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    index = SearchIndex()
+
+    if args[:1] == ["--reindex"]:
+        for folder in args[1:]:
+            print "%s: %d configs indexed" % (folder, reindex_folder(index, folder))
+        sys.exit(0)
+
+    customer = None
+    if args[:1] == ["-c"] and len(args) > 1:
+        customer = args[1]
+        args = args[2:]
+
+    if args:
+        search_text = " ".join(args)
+    else:
+        search_text = raw_input_def("Input search text: ", "")
+    if not search_text:
+        sys.exit(0)
+
+    matches = index.search(search_text, customer=customer, context=2)
+
+    for match in matches:
+        print "\n%s/%s [%s] line %d" % (match['customer'], match['device'],
+                                         match['source'], match['lineno'])
+        for lineno, line in match['context'] or [(match['lineno'], match['line'])]:
+            marker = ">" if lineno == match['lineno'] else " "
+            print "%s %6d  %s" % (marker, lineno, line)
+
+    print "\n%d matches." % len(matches)
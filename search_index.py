@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+'''
+This module holds the estate wide search index.  Every config stored by
+grab_configs.py and every command output captured by send_commands.py is
+added to an SQLite full text index (search.db in the tools directory) as it
+is written, so a search across all customers is a single indexed query
+rather than a grep through every <cust_dir>.
+
+Each stored file is a document, keyed on customer dir, device IP and source
+("config" or "command: <command>"), with the device's hostname as a field,
+so a renamed device's config replaces its old document rather than leaving
+it to match searches.  A document indexed without an IP (a reindex of
+configs the session cache knows nothing about) updates the document of that
+hostname, or is keyed on the hostname until it is indexed with an IP.  Each
+non blank line of the document is a row in the full text table.  The row id
+is doc id * LINE_SPAN + line number so the lines of a document can be
+replaced, and the lines around a match fetched for context, with rowid range
+lookups.
+
+A document whose content digest has not changed since it was last indexed
+is skipped.
+'''
+
+import hashlib
+import sqlite3
+import threading
+
+
+LINE_SPAN = 1000000
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS docs (
+           id INTEGER PRIMARY KEY,
+           customer TEXT NOT NULL,
+           device TEXT NOT NULL,
+           ip TEXT,
+           source TEXT NOT NULL,
+           path TEXT,
+           digest TEXT,
+           indexed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           UNIQUE (customer, ip, source))''',
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts4 (text)''',
+    '''CREATE INDEX IF NOT EXISTS docs_device ON docs (customer, device, source)''',
+]
+
+# PRAGMA user_version of the current schema
+SCHEMA_VERSION = 1
+
+
+def normalise_line(line):
+
+    '''
+    Collapses runs of whitespace so indentation and trailing spaces do not
+    affect matching
+    '''
+
+    return " ".join(line.split())
+
+
+def phrase_query(text):
+
+    '''
+    Turns free text into an FTS phrase query, e.g. snmp-server community
+    public matches those words in that order on a single line
+    '''
+
+    return '"%s"' % text.replace('"', ' ')
+
+
+class SearchIndex(object):
+
+    '''
+    The search index, safe to share between the pipeline worker threads
+    '''
+
+    def __init__(self, filename="search.db"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._migrate()
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.execute("PRAGMA user_version=%d" % SCHEMA_VERSION)
+        self.conn.commit()
+
+    def _migrate(self):
+
+        '''
+        Rekeys a search.db from before the documents were keyed on IP.  Of the
+        documents that now share a key (a renamed device) only the latest is
+        kept.
+        '''
+
+        tables = [row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        if "docs" not in tables:
+            return
+        stale = self.conn.execute(
+            "SELECT id FROM docs d WHERE ip IS NOT NULL AND EXISTS (SELECT 1 FROM docs n "
+            "WHERE n.customer=d.customer AND n.ip=d.ip AND n.source=d.source AND "
+            "(n.indexed > d.indexed OR (n.indexed = d.indexed AND n.id > d.id)))").fetchall()
+        for (doc_id,) in stale:
+            self.conn.execute("DELETE FROM lines WHERE rowid BETWEEN ? AND ?",
+                              (doc_id * LINE_SPAN, doc_id * LINE_SPAN + LINE_SPAN - 1))
+            self.conn.execute("DELETE FROM docs WHERE id=?", (doc_id,))
+        self.conn.execute("ALTER TABLE docs RENAME TO docs_old")
+        self.conn.execute(SCHEMA[0])
+        self.conn.execute("INSERT INTO docs SELECT id, customer, device, ip, source, path, digest, indexed "
+                          "FROM docs_old")
+        self.conn.execute("DROP TABLE docs_old")
+
+    def add_lines(self, customer, device, source, lines, ip=None, path=None):
+
+        '''
+        Replaces the indexed lines for a document.  lines can be any iterable,
+        an open file is read a line at a time.  device is the hostname, ip
+        the key when there is one.  Returns False if the content is unchanged
+        since it was last indexed.
+        '''
+
+        digest = hashlib.sha1()
+        rows = []
+        for lineno, line in enumerate(lines):
+            if lineno >= LINE_SPAN - 1:
+                break
+            digest.update(line)
+            line = normalise_line(line)
+            if line and line != '!':
+                rows.append((lineno + 1, line))
+        digest = digest.hexdigest()
+
+        with self.lock:
+            cur = self.conn.cursor()
+            row = None
+            if ip:
+                cur.execute("SELECT id, digest, device, ip FROM docs WHERE customer=? AND ip=? AND source=?",
+                            (customer, ip, source))
+                row = cur.fetchone()
+            if not row:
+                # Indexed before the IP was known, or now indexed without it
+                cur.execute("SELECT id, digest, device, ip FROM docs "
+                            "WHERE customer=? AND device=? AND source=? AND (ip IS NULL OR ? IS NULL) "
+                            "ORDER BY ip IS NULL", (customer, device, source, ip))
+                row = cur.fetchone()
+                if row and not ip:
+                    ip = row[3]
+            if row and row[1:] == (digest, device, ip):
+                return False
+
+            if row:
+                doc_id = row[0]
+                cur.execute("UPDATE docs SET device=?, ip=?, path=?, digest=?, indexed=CURRENT_TIMESTAMP "
+                            "WHERE id=?", (device, ip, path, digest, doc_id))
+                cur.execute("DELETE FROM lines WHERE rowid BETWEEN ? AND ?",
+                            (doc_id * LINE_SPAN, doc_id * LINE_SPAN + LINE_SPAN - 1))
+            else:
+                cur.execute("INSERT INTO docs (customer, device, ip, source, path, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                            (customer, device, ip, source, path, digest))
+                doc_id = cur.lastrowid
+
+            base = doc_id * LINE_SPAN
+            cur.executemany("INSERT INTO lines (rowid, text) VALUES (?, ?)",
+                            ((base + lineno, line) for lineno, line in rows))
+            self.conn.commit()
+        return True
+
+    def add_file(self, customer, device, source, filename, ip=None):
+
+        '''
+        Indexes a file that has just been written
+        '''
+
+        fileh = open(filename, "rb")
+        try:
+            return self.add_lines(customer, device, source, fileh, ip=ip, path=filename)
+        finally:
+            fileh.close()
+
+    def search(self, text, customer=None, context=0, limit=500, raw=False):
+
+        '''
+        Returns a list of matches, each a dict with customer, device, ip,
+        source, path, lineno, line and context (a list of (lineno, line)).
+        text is treated as a phrase unless raw is set, in which case it is
+        passed to FTS as is (AND, OR, NEAR, prefix* etc).
+        '''
+
+        query = text if raw else phrase_query(text)
+        sql = '''SELECT lines.rowid, lines.text, docs.customer, docs.device, docs.ip,
+                        docs.source, docs.path
+                 FROM lines JOIN docs ON docs.id = lines.rowid / %d
+                 WHERE lines MATCH ?''' % LINE_SPAN
+        args = [query]
+        if customer:
+            sql += " AND docs.customer = ?"
+            args.append(customer)
+        sql += " ORDER BY docs.customer, docs.device, lines.rowid LIMIT ?"
+        args.append(limit)
+
+        with self.lock:
+            cur = self.conn.cursor()
+            matches = []
+            for rowid, line, cust, device, ip, source, path in cur.execute(sql, args).fetchall():
+                match = {'customer': cust, 'device': device, 'ip': ip,
+                         'source': source, 'path': path,
+                         'lineno': rowid % LINE_SPAN, 'line': line, 'context': []}
+                if context:
+                    lowest = max(rowid - context, rowid - rowid % LINE_SPAN)
+                    cur.execute("SELECT rowid, text FROM lines WHERE rowid BETWEEN ? AND ? ORDER BY rowid",
+                                (lowest, rowid + context))
+                    match['context'] = [(r % LINE_SPAN, t) for r, t in cur.fetchall()]
+                matches.append(match)
+        return matches
+
+    def close(self):
+        self.conn.close()
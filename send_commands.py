@@ -5,50 +5,143 @@ This module sends a command script to all devices held in a customer .info file
 Please see grab-configs.py for more info on constructing the .info file
 '''
 
-import paramiko
-import socket
-import re
-import datetime
-import time
-import sys
+import shutil
+import threading
 import getpass
 
-from grab_configs import status_update
-from grab_configs import raw_input_def
-from grab_configs import shell_send
-from grab_configs import print_flush
-from grab_configs import clean_ansi
-from grab_configs import get_defaults
+from toolkit import status_update
+from toolkit import raw_input_def
+from toolkit import get_defaults
+from session_cache import SessionCache
+from search_index import SearchIndex
+from show_parsers import load_templates
+from show_parsers import find_template
+from record_store import RecordStore
+from pipeline import read_inventory
+from pipeline import open_device
+from pipeline import close_device
+from pipeline import fetch
+from pipeline import write_stream
+from pipeline import part_filename
+from pipeline import discard
+from pipeline import run_pipeline
+from pipeline import count_inventory
+from pipeline import DeviceError
+from result_cache import ResultCache
+from result_cache import credential_scope
+from compute import ComputePool
+from compute import parse_file
+from pipeline import record_sessions
+from recording import SessionRecorder
+from recording import run_folder
+from metrics import Metrics
+from metrics import serve_metrics
+from concurrency import AdaptiveLimiter
+from config_render import ConfigTemplate
+from config_render import RenderError
+from config_render import load_vars
+from config_render import device_vars
 
 '''
 Functions
 '''
 
+# Several sessions finish at once, only one may append to command.log at a time
+log_lock = threading.Lock()
+
 def update_output_log(log_cust_dir, log_ip_addr, log_command_output):
 
     '''
-    This function updates the command.log
+    This function updates the command.log, log_command_output is an open file
+    which is copied across in chunks
     '''
 
     filename = "".join([log_cust_dir, "/command.log"])
-    log_fileh = open(filename, "a")
-    log_fileh.write("\n" + log_ip_addr + "\n")
-    log_fileh.write(log_command_output)
-    log_fileh.close()
+    with log_lock:
+        log_fileh = open(filename, "a")
+        log_fileh.write("\n" + log_ip_addr + "\n")
+        shutil.copyfileobj(log_command_output, log_fileh)
+        log_fileh.close()
     return
 
+def send_command(device, folder, username, password, cache, command, index=None,
+                 template=None, store=None, compute=None, results=None):
+
+    '''
+    Pipeline job for a single device.  The output is streamed into a scratch
+    file then appended to the command.log in one go so the output from
+    different devices does not interleave.  If there is a template for the
+    command the output is parsed into records as well.  The clean up and
+    parsing run on the compute pool if there is one (see compute.py).
+
+    With a ResultCache (see result_cache.py) fresh output from an earlier
+    run is used instead of contacting the device.
+    '''
+
+    scratch = part_filename(folder, device)
+    cached = None
+    if results:
+        scope = credential_scope(device, username)
+        (cached, age) = results.lookup(device['ip'], command, scope)
+
+    if cached:
+        shutil.copyfile(cached, scratch)
+    else:
+        session, shell = open_device(device, username, password, cache)
+        try:
+            write_stream(fetch(session, shell, device, command, wait=15), scratch)
+        except Exception:
+            discard(scratch)
+            raise
+        finally:
+            close_device(session, shell)
+
+    def then(records):
+        try:
+            if results and not cached:
+                results.put(device['ip'], command, scope, scratch)
+            store_output(device, folder, command, scratch, index, template, store, records,
+                         cache.get(device['ip']).get('hostname'))
+        finally:
+            discard(scratch)
+        if cached:
+            return "", "[ Output from cache, %ds old ]" % age, "Completed, cached."
+        return "", "[ Output captured ]", "Completed."
+
+    args = (scratch, template.name if template and store else None)
+    if compute:
+        return compute.submit(parse_file, args, then, lambda: discard(scratch))
+    try:
+        records = parse_file(*args)
+    except Exception:
+        discard(scratch)
+        raise
+    return then(records)
+
+def store_output(device, folder, command, scratch, index, template, store, records, name=None):
+
+    '''
+    This function appends the cleaned output to the command.log, indexes it
+    (under the device's IP, with its hostname if we know it) and stores the
+    parsed records
+    '''
+
+    output_fileh = open(scratch, "rb")
+    update_output_log(folder, device['ip'], output_fileh)
+    if index:
+        output_fileh.seek(0)
+        index.add_lines(folder, name or device['ip'], "command: " + command, output_fileh,
+                        ip=device['ip'], path="".join([folder, "/command.log"]))
+    output_fileh.close()
+    if template and store:
+        store.add(template, device['ip'], records)
+
 '''
 Main module loop
 '''
 
 if __name__ == "__main__":
 
-    ssh = paramiko.SSHClient()
-    # If key is not in known hosts we ignore the warning
-    # NOTE This may not be suitable for all and environments
-    ssh.set_missing_host_key_policy(
-            paramiko.AutoAddPolicy())
-
     # read defaults
 
     (def_cust, def_user) = get_defaults()
@@ -63,117 +156,116 @@ if __name__ == "__main__":
         username = raw_input_def("Input SSH username [%s]: " % def_user, def_user)
         password = getpass.getpass("Input SSH password: ")
         user_command = raw_input("Input command to execute on all devices: ")
+        in_flight = raw_input_def("Input max concurrent sessions [8]: ", "8")
+        metrics_port = raw_input_def("Input port to serve metrics on, blank for none []: ", "")
+        record = raw_input_def("Record the sessions for offline replay (y/n) [n]: ", "n").lower() == "y"
+        use_cache = raw_input_def("Use cached show output that is still fresh (y/n) [n]: ", "n").lower() == "y"
+        # Only a command the user asks to have filled in is templated, a
+        # literal {{ or }} (an include regex) is otherwise left alone
+        templated = False
+        if ConfigTemplate(user_command, "command").fields:
+            templated = raw_input_def("Fill in the {fields} of the command from each device's values, "
+                                      "{{ and }} for literal braces (y/n) [y]: ", "y").lower() == "y"
 
         print "\n"
         print cust
         print username
         print "**PASSWORD HIDDEN**"
         print user_command
+        print in_flight
+        print metrics_port
+        print "record %s" % record
+        print "cache %s" % use_cache
+        print "templated %s" % templated
 
         yesno = raw_input("\nAre these details correct [y/n]: ").lower()
         print
-        if yesno == "y":
+        if (yesno == "y" and in_flight.isdigit() and int(in_flight) > 0 and
+                (not metrics_port or metrics_port.isdigit())):
             break
 
 
     '''
-    Read the customer file to determine the folder and a list of IPs
+    Read the customer file to determine the folder, the devices are read
+    from the file as the workers become free
     '''
 
-    fileh = open(cust)
-    cust_dir = fileh.readline().strip()
-    ip_list = fileh.readlines()
-    fileh.close()
+    (cust_dir, devices) = read_inventory(cust)
+
+    # Started before any thread so the pool processes fork from a quiet parent
+    compute = ComputePool()
+
+    metrics = Metrics(count_inventory(cust))
+    if metrics_port:
+        serve_metrics(metrics, int(metrics_port))
+        print "Metrics on http://127.0.0.1:%s/metrics\n" % metrics_port
+
+    # Raw device output for replay_sessions.py, see recording.py
+    if record:
+        recordings = run_folder(cust_dir)
+        record_sessions(SessionRecorder(recordings, "send", user_command))
+        print "Sessions are recorded in %s\n" % recordings
+
+    # Host keys and per device negotiation details from previous runs
+    session_cache = SessionCache(cust_dir)
+    search_index = SearchIndex()
+
+    # Output of commands we have a template for is also stored as records
+    template = find_template(load_templates(), user_command)
+    record_store = None
+    if template:
+        print "Output will also be stored as records in %s/%s.csv\n" % (cust_dir, template.name)
+        record_store = RecordStore(cust_dir)
+
+    # Show output from earlier runs, see result_cache.py
+    result_cache = None
+    if use_cache:
+        result_cache = ResultCache(cust_dir)
+        ttl = result_cache.ttl(user_command)
+        if ttl:
+            print "Output less than %ds old is taken from %s/results\n" % (ttl, cust_dir)
+        else:
+            print "%s is not cached, see result_cache.py\n" % user_command
+
+    def report(device, name, screen, status):
+        print "%-15s > %s" % (device['ip'], screen)
+        status_update(cust_dir, device['ip'], name, status)
+
+    # {name} in the command is replaced with the device's value, see
+    # config_render.py
+    command_template = ConfigTemplate(user_command, "command")
+    sidecar = load_vars(cust_dir)
+
+    def job(device):
+        command = user_command
+        if templated:
+            hostname = session_cache.get(device['ip']).get('hostname')
+            try:
+                lines = command_template.render(device_vars(device, sidecar, hostname))
+            except RenderError as err:
+                raise DeviceError("!!! %s !!!" % err, "*** Render failed: %s ***" % err)
+            if not lines or not lines[0].strip():
+                raise DeviceError("!!! The command rendered empty !!!", "*** Render failed: empty command ***")
+            command = lines[0]
+        return send_command(device, cust_dir, username, password, session_cache,
+                            command, search_index, template, record_store, compute,
+                            result_cache)
 
     '''
-    Main loop to connect to each IP, grab the config, store the config
+    Connect to each device, send the command, store the output
     '''
 
-    for ip_addr in ip_list:
-        ip_addr = ip_addr.strip()
-
-        '''
-        Skip if ip_addr has been # out
-        '''
-
-        if '#' in ip_addr:
-            print "Skipping %s" % (ip_addr.split("#")[1])
-            status_update(cust_dir, ip_addr.split("#")[1], "", "Skipped.")
-            continue
-
-        '''
-        If the IP address contains a : then options have been added
-        currently only :hp is supported
-        :hp means we use an interactive shell to obtain the config
-        '''
-
-        hp = ""
-        if ":" in ip_addr:
-            ip_addr_list = ip_addr.split(":")
-            ip_addr = ip_addr_list[0]
-            if ip_addr_list[1] == "hp":
-                hp = True
-
-
-        '''
-        Open the SSH Connection with some error handling
-        '''
-
-        print_flush("Establishing connection to %-15s > " % (ip_addr))
-
-        try:
-            ssh.connect(ip_addr, username=username, password=password, timeout=8)
-        except paramiko.ssh_exception.AuthenticationException:
-            print "Authentication failed."
-            status_update(cust_dir, ip_addr, "", "Authentication failed.")
-            continue
-        except socket.error:
-            print "Could not connect."
-            status_update(cust_dir, ip_addr, "", "Connection error.")
-            continue
-
-        print_flush("[ Connection established ]")
-
-
-        '''
-        Send command and output to screen
-        '''
-
-        print_flush("[ sending command ]")
-
-        '''
-        HP does not support exec_command so we will use an interactive session
-        for HP devices. For cisco we will use the 'cleaner' exec_command method
-        '''
-
-        if not hp:
-            # Cisco Device
-            stdin, stdout, stderr = ssh.exec_command(user_command)
-            command_output = stdout.read()
-        else:
-            # HP Device
-            shell = ssh.invoke_shell(width=200, height=99999)
-            # Strip MOTD
-            output = shell.recv(2000)
-
-            # Press enter,turn off paging,grab config
-            shell_send("", 1, 1000, shell)
-            shell_send("no page", 1, 500, shell)
-            command_output = shell_send(user_command, 15, 65535, shell)
-            ssh.close()
-
-        command_output = clean_ansi(command_output)
-
-        '''
-        Store the output
-        '''
+    limiter = AdaptiveLimiter(int(in_flight))
+    run_pipeline(devices, job, report, int(in_flight), metrics, limiter)
+    compute.close()
 
-        update_output_log(cust_dir, ip_addr, command_output)
-        print " [ Output captured ]"
+    # Sites that could not take the full number of sessions
+    for site, limit in sorted(limiter.limits().items()):
+        print "Site %s was paced at %d sessions" % (site, limit)
 
-        '''
-        End of main program Loop, repeat for each IP address in the customer info file
-        '''
+    session_cache.save()
+    if result_cache:
+        result_cache.save()
 
     '''
     All done!
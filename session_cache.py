@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+'''
+This module holds the per customer session cache.  Two files are kept in the
+<customer dir>:
+
+known_hosts     - OpenSSH format host keys, one line per device IP
+session.cache   - JSON, per device IP the parameters that worked last time
+
+The host keys are loaded once into a dict so the check on each connect is a
+single lookup rather than a scan of the file.  New keys are trusted on first
+use and appended to known_hosts, a key that does not match the stored key is
+rejected.
+
+The per device parameters are used to order the key exchange, cipher and
+authentication attempts so the next connection goes straight to what worked.
+The hostname last seen in the config is kept as well so grab_configs.py can
+name the output file before the config arrives, and the digest of the
+normalised config so it can tell an unchanged config (see normalise.py).
+
+sample session.cache entry:
+
+{"172.16.255.1": {"kex": "diffie-hellman-group14-sha1",
+                  "cipher": "aes128-ctr",
+                  "auth": "keyboard-interactive",
+                  "hostname": "core-sw1",
+                  "digest": "<sha1 of the normalised config>"}}
+
+'''
+
+import json
+import threading
+
+
+class SessionCache(object):
+
+    '''
+    Host keys and negotiated parameters for every device in a customer dir
+    '''
+
+    def __init__(self, folder, strict=False):
+        self.hosts_filename = "".join([folder, "/known_hosts"])
+        self.params_filename = "".join([folder, "/session.cache"])
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.host_keys = {}
+        self.params = {}
+        self.dirty = False
+
+        try:
+            fileh = open(self.hosts_filename)
+        except IOError:
+            fileh = None
+        if fileh:
+            for line in fileh:
+                fields = line.split()
+                if len(fields) < 3 or line.startswith('#'):
+                    continue
+                self.host_keys[fields[0]] = (fields[1], fields[2])
+            fileh.close()
+
+        try:
+            fileh = open(self.params_filename)
+        except IOError:
+            return
+        try:
+            self.params = json.load(fileh)
+        except ValueError:
+            # Corrupt cache, start again rather than stop the run
+            self.params = {}
+        fileh.close()
+
+    def check_host_key(self, host_ip, key):
+
+        '''
+        Compares the key offered by the device against the stored key.
+        Unknown devices are added (unless strict), mismatches raise
+        BadHostKeyException.
+        '''
+
+        # Only reached once a device is connected, paramiko is loaded by then
+        import paramiko
+        from paramiko.hostkeys import HostKeyEntry
+
+        offered = (key.get_name(), key.get_base64())
+        with self.lock:
+            known = self.host_keys.get(host_ip)
+            if known == offered:
+                return
+            if known:
+                expected = HostKeyEntry.from_line(" ".join([host_ip, known[0], known[1]]))
+                raise paramiko.BadHostKeyException(host_ip, key, expected.key)
+            if self.strict:
+                raise paramiko.SSHException("Unknown host key for %s" % host_ip)
+            self.host_keys[host_ip] = offered
+            fileh = open(self.hosts_filename, "a")
+            fileh.write(" ".join([host_ip, offered[0], offered[1]]) + "\n")
+            fileh.close()
+
+    def get(self, host_ip):
+
+        '''
+        Returns a copy of the cached parameters for a device
+        '''
+
+        with self.lock:
+            return dict(self.params.get(host_ip, {}))
+
+    def update(self, host_ip, **kwargs):
+
+        '''
+        Records parameters for a device, the file is only written by save()
+        '''
+
+        with self.lock:
+            entry = self.params.setdefault(host_ip, {})
+            for name, value in kwargs.items():
+                if entry.get(name) != value:
+                    entry[name] = value
+                    self.dirty = True
+
+    def forget(self, host_ip, *names):
+
+        '''
+        Drops cached parameters that have stopped working for a device
+        '''
+
+        with self.lock:
+            entry = self.params.get(host_ip, {})
+            for name in names:
+                if name in entry:
+                    del entry[name]
+                    self.dirty = True
+
+    def save(self):
+
+        '''
+        Writes session.cache if anything changed during the run
+        '''
+
+        with self.lock:
+            if not self.dirty:
+                return
+            fileh = open(self.params_filename, "w")
+            json.dump(self.params, fileh, indent=1, sort_keys=True)
+            fileh.close()
+            self.dirty = False
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+'''
+This module turns the output of common show commands into records using the
+templates in the templates directory.  A template looks like this:
+
+# comment
+command ^sh(o|ow)? (ip )?arp$           regex matched against the command
+single                                   optional, one record per output
+block ^Device ID: {neighbour}            optional, a record per block of lines
+value address ip \d+\.\d+\.\d+\.\d+      value <name> <type> <regex>
+value mac mac [0-9a-fA-F.:-]+
+set ^BGP router identifier {router_id}   sets values kept for later records
+record ^Internet\s+{address}\s+...       each matching line is a record
+index mac                                optional, values to index in SQLite
+
+{name} in a set or record line is replaced by the value's regex as a named
+group.  Types are str, int, float, ip and mac (normalised to aaaa.bbbb.cccc).
+Values from set lines are carried into every following record, with single
+the values from all set lines make up one record for the whole output.  With
+block a line matching the block regex starts a new record, the values from
+it and the set lines below it make up the record.
+
+Templates are compiled once when loaded.
+'''
+
+import glob
+import os
+import re
+
+
+FIELD_RE = re.compile(r"\{(\w+)\}")
+
+
+def to_int(text):
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+
+def to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def to_mac(text):
+
+    '''
+    Normalises 00:11:22:33:44:55, 00-11-22-33-44-55 and 0011.2233.4455
+    to 0011.2233.4455
+    '''
+
+    digits = re.sub(r"[^0-9a-f]", "", text.lower())
+    if len(digits) != 12:
+        return text.lower()
+    return ".".join([digits[0:4], digits[4:8], digits[8:12]])
+
+
+CONVERTERS = {
+    'str': lambda text: text.strip(),
+    'ip': lambda text: text.strip(),
+    'int': to_int,
+    'float': to_float,
+    'mac': to_mac,
+}
+
+
+class TemplateError(Exception):
+
+    '''
+    Raised for a template that cannot be used
+    '''
+
+
+class Template(object):
+
+    '''
+    A compiled template
+    '''
+
+    def __init__(self, name, text):
+        self.name = name
+        self.command = None
+        self.single = False
+        self.block = None
+        self.values = []
+        self.types = {}
+        self.sets = []
+        self.records = []
+        self.indexes = []
+
+        regexes = {}
+        lines = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            keyword, _, rest = line.partition(' ')
+            if keyword == 'command':
+                self.command = re.compile(rest.strip(), re.I)
+            elif keyword == 'single':
+                self.single = True
+            elif keyword == 'value':
+                fields = rest.split(None, 2)
+                if len(fields) != 3 or fields[1] not in CONVERTERS:
+                    raise TemplateError("%s: bad value line: %s" % (name, line))
+                self.values.append(fields[0])
+                self.types[fields[0]] = fields[1]
+                regexes[fields[0]] = fields[2]
+            elif keyword == 'index':
+                self.indexes.extend(rest.split())
+            elif keyword in ('set', 'record', 'block'):
+                lines.append((keyword, rest.strip()))
+            else:
+                raise TemplateError("%s: line not understood: %s" % (name, line))
+
+        if not self.command:
+            raise TemplateError("%s: no command line" % name)
+        for field in self.indexes:
+            if field not in regexes:
+                raise TemplateError("%s: unknown index %s" % (name, field))
+
+        def expand(match):
+            field = match.group(1)
+            if field not in regexes:
+                raise TemplateError("%s: unknown value {%s}" % (name, field))
+            return "(?P<%s>%s)" % (field, regexes[field])
+
+        for keyword, pattern in lines:
+            compiled = re.compile(FIELD_RE.sub(expand, pattern))
+            if keyword == 'set':
+                self.sets.append(compiled)
+            elif keyword == 'block':
+                self.block = compiled
+            else:
+                self.records.append(compiled)
+
+    def convert(self, found):
+        return dict((field, CONVERTERS[self.types[field]](text))
+                    for field, text in found.items() if text is not None)
+
+    def parse(self, lines):
+
+        '''
+        Yields a dict per record found in an iterable of output lines, every
+        value of the template is present (None if it was not seen)
+        '''
+
+        empty = dict((field, None) for field in self.values)
+        carried = dict(empty)
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if self.block:
+                found = self.block.search(line)
+                if found:
+                    if any(value is not None for value in carried.values()):
+                        yield carried
+                    carried = dict(empty)
+                    carried.update(self.convert(found.groupdict()))
+                    continue
+            for pattern in self.sets:
+                found = pattern.search(line)
+                if found:
+                    carried.update(self.convert(found.groupdict()))
+                    break
+            else:
+                for pattern in self.records:
+                    found = pattern.search(line)
+                    if found:
+                        record = dict(carried)
+                        record.update(self.convert(found.groupdict()))
+                        yield record
+                        break
+
+        if (self.single or self.block) and any(value is not None for value in carried.values()):
+            yield carried
+
+
+def chunk_lines(chunks):
+
+    '''
+    Turns a stream of output chunks (see pipeline.py) into lines
+    '''
+
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line
+    if partial:
+        yield partial
+
+
+def load_templates(folder=None):
+
+    '''
+    Loads every <name>.tpl in the templates directory, returns a list of
+    Template
+    '''
+
+    if folder is None:
+        folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+    templates = []
+    for filename in sorted(glob.glob(os.path.join(folder, "*.tpl"))):
+        fileh = open(filename)
+        text = fileh.read()
+        fileh.close()
+        templates.append(Template(os.path.basename(filename)[:-4], text))
+    return templates
+
+
+def find_template(templates, command):
+
+    '''
+    Returns the template for a command, None if there is no template for it
+    '''
+
+    command = " ".join(command.split())
+    for template in templates:
+        if template.command.search(command):
+            return template
+    return None
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+'''
+This module is the telnet client used for legacy kit that has no SSH.  It
+replaces telnetlib (gone from newer Pythons) and the fixed one second sleeps
+the login used to be driven by:
+
+- reads never block, select says when there is something to read, so a
+  worker waits for the device's next prompt rather than a fixed time
+- telnet option negotiation (IAC) is answered: the device may echo and
+  suppress go-ahead, we send a VT100 terminal type and a 200 column window
+  with no paging, everything else is refused
+- login follows the prompts: Username, Password, ProCurve's "Press any key",
+  a rejected login is spotted by the device asking again or saying so
+
+TelnetSession has the read_very_eager/write/eof of telnetlib.Telnet so the
+shell code in pipeline.py serves SSH and telnet alike.  Given a JumpHost (see
+transport.py) the session runs over a direct-tcpip channel through the
+bastion.
+'''
+
+import re
+import select
+import socket
+import struct
+import time
+
+from normalise import PROMPT_TEXT
+from transport import BastionError
+
+
+CHUNK_SIZE = 32768
+
+IAC = chr(255)
+DONT = chr(254)
+DO = chr(253)
+WONT = chr(252)
+WILL = chr(251)
+SB = chr(250)
+SE = chr(240)
+
+ECHO = chr(1)
+SGA = chr(3)
+TTYPE = chr(24)
+NAWS = chr(31)
+
+# Options we let the device use, and options we offer to use
+REMOTE_OPTIONS = (ECHO, SGA)
+LOCAL_OPTIONS = (SGA, TTYPE, NAWS)
+
+TERMINAL = "VT100"
+WIDTH = 200
+
+USER_RE = re.compile(r"(?i)(username|user name|login)\s*:\s*\Z")
+PASS_RE = re.compile(r"(?i)password\s*:\s*\Z")
+ANYKEY_RE = re.compile(r"(?i)press any key to continue")
+FAIL_RE = re.compile(r"(?i)login invalid|login incorrect|authentication failed|access denied|bad passwords")
+# A prompt is a whole line, "core-sw1#" or "ProCurve Switch 2610# "
+PROMPT_RE = re.compile(r"(?:\A|[\r\n])%s[#>] ?\Z" % PROMPT_TEXT)
+PRIV_RE = re.compile(r"(?:\A|[\r\n])%s# ?\Z" % PROMPT_TEXT)
+
+# How far back a new read can complete a match
+LOOKBACK = 256
+
+# Seconds the device must stay quiet after a match.  A banner or a config
+# line split across reads can end in # or > as well as a prompt.
+SETTLE = 0.2
+
+
+class TelnetError(Exception):
+
+    '''
+    Raised when the device cannot be reached or does not answer as expected
+    '''
+
+
+class TelnetAuthError(TelnetError):
+
+    '''
+    Raised when the device rejects the login or the enable password
+    '''
+
+
+class TelnetSession(object):
+
+    '''
+    A telnet connection to a single device, directly or through a JumpHost
+    '''
+
+    def __init__(self, ip_addr, timeout=8, port=23, jump=None):
+        self.ip_addr = ip_addr
+        self.timeout = timeout
+        self.jump = jump
+        self.eof = False
+        self.pending = ''
+        self.remote = {}
+        self.local = {}
+
+        if jump:
+            try:
+                self.sock = jump.open_channel(ip_addr, port)
+            except BastionError:
+                raise
+            except Exception as err:
+                raise TelnetError("No channel through %s: %s" % (jump.address, err))
+        else:
+            self.sock = socket.create_connection((ip_addr, port), timeout)
+        # Only sends can wait, and no longer than the timeout
+        self.sock.settimeout(timeout)
+
+    def _send_raw(self, data):
+        self.sock.sendall(data)
+
+    def _negotiate(self, command, option):
+
+        '''
+        Answers a DO/DONT/WILL/WONT.  Only a change of state is answered,
+        answering a confirmation would loop forever.
+        '''
+
+        if command in (WILL, WONT):
+            state, options, yes, no = self.remote, REMOTE_OPTIONS, DO, DONT
+        else:
+            state, options, yes, no = self.local, LOCAL_OPTIONS, WILL, WONT
+        asked = command in (WILL, DO)
+        wanted = asked and option in options
+        if state.get(option, False) == wanted and (wanted or not asked):
+            return
+
+        state[option] = wanted
+        self._send_raw(IAC + (yes if wanted else no) + option)
+        if wanted and option == NAWS and command == DO:
+            # Height 0, the device does not page
+            size = struct.pack("!HH", WIDTH, 0).replace(IAC, IAC + IAC)
+            self._send_raw(IAC + SB + NAWS + size + IAC + SE)
+
+    def _subnegotiate(self, data):
+        if data[:2] == TTYPE + chr(1):
+            # TTYPE SEND, answer TTYPE IS
+            self._send_raw(IAC + SB + TTYPE + chr(0) + TERMINAL + IAC + SE)
+
+    def _process(self, data):
+
+        '''
+        Takes the telnet commands out of the data and answers them, returns
+        the text.  A command split across two reads is held until the rest
+        arrives.
+        '''
+
+        data = self.pending + data
+        self.pending = ''
+        text = []
+        pos = 0
+        while True:
+            iac = data.find(IAC, pos)
+            if iac < 0:
+                text.append(data[pos:])
+                break
+            text.append(data[pos:iac])
+            command = data[iac + 1:iac + 2]
+            if command == IAC:
+                text.append(IAC)
+                pos = iac + 2
+            elif command and command in (DO, DONT, WILL, WONT):
+                if iac + 2 >= len(data):
+                    self.pending = data[iac:]
+                    break
+                self._negotiate(command, data[iac + 2])
+                pos = iac + 3
+            elif command == SB:
+                end = data.find(IAC + SE, iac + 2)
+                if end < 0:
+                    self.pending = data[iac:]
+                    break
+                self._subnegotiate(data[iac + 2:end])
+                pos = end + 2
+            elif command:
+                # NOP, GA and the like carry nothing for us
+                pos = iac + 2
+            else:
+                self.pending = data[iac:]
+                break
+        return "".join(text).replace("\r\x00", "\r")
+
+    def wait(self, timeout):
+
+        '''
+        Waits up to timeout seconds for something to read, True if there is
+        '''
+
+        if self.eof:
+            return False
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def _recv(self):
+        try:
+            data = self.sock.recv(CHUNK_SIZE)
+        except socket.timeout:
+            return ''
+        except socket.error:
+            data = ''
+        if not data:
+            self.eof = True
+            return ''
+        return self._process(data)
+
+    def read_very_eager(self):
+
+        '''
+        Returns whatever text has arrived, '' if nothing has.  Never blocks.
+        '''
+
+        text = []
+        while self.wait(0):
+            text.append(self._recv())
+        return "".join(text)
+
+    def write(self, data):
+        self._send_raw(data.replace(IAC, IAC + IAC))
+
+    def expect(self, patterns, timeout):
+
+        '''
+        Reads until one of the regexes matches the end of the text read so
+        far and the device has gone quiet, or the timeout passes.  Returns
+        (index of the pattern or -1, text).
+        '''
+
+        text = ''
+        checked = 0
+        deadline = time.time() + timeout
+        while True:
+            # From the start of a line so the patterns can anchor on it
+            tail = text[text.rfind("\n", 0, max(0, checked - LOOKBACK)) + 1:]
+            checked = len(text)
+            matched = [index for index, pattern in enumerate(patterns) if pattern.search(tail)]
+            if matched and not self.wait(SETTLE):
+                return matched[0], text
+            if matched:
+                text += self._recv()
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0 or not self.wait(remaining):
+                return -1, text
+            text += self._recv()
+
+    def login(self, username, password):
+
+        '''
+        Answers the login prompts until the device shows its prompt, returns
+        everything it sent on the way (the banner)
+        '''
+
+        # A banner can say "access denied" too, the prompts come first and a
+        # failure only counts once the password has gone
+        patterns = [USER_RE, PASS_RE, ANYKEY_RE, PROMPT_RE, FAIL_RE]
+        banner = []
+        sent = []
+        while True:
+            index, text = self.expect(patterns, self.timeout)
+            banner.append(text)
+            if index < 0:
+                raise TelnetError("No login prompt")
+            if index == 3:
+                return "".join(banner)
+            if index == 4:
+                if "password" in sent:
+                    raise TelnetAuthError("Login rejected")
+                continue
+
+            # Asked again for something already sent, the login was rejected
+            answer = ("username", "password", "key")[index]
+            if answer in sent and answer != "key":
+                raise TelnetAuthError("Login rejected")
+            sent.append(answer)
+            if answer == "username":
+                self.write(username + "\r\n")
+            elif answer == "password":
+                self.write(password + "\r\n")
+            else:
+                self.write("\r\n")
+
+    def enable(self, secret):
+
+        '''
+        Enters enable mode, waits for the device's answer at each step
+        '''
+
+        self.write("enable 15\r\n")
+        index, text = self.expect([PASS_RE, PRIV_RE, FAIL_RE, PROMPT_RE], self.timeout)
+        if index == 0:
+            self.write(secret + "\r\n")
+            index, text = self.expect([PRIV_RE, PASS_RE, FAIL_RE, PROMPT_RE], self.timeout)
+            index = 1 if index == 0 else -1
+        if index != 1:
+            raise TelnetAuthError("Enable rejected")
+
+    def command(self, line, timeout):
+
+        '''
+        Sends a line and returns the answer once the prompt is back, or
+        whatever arrived within timeout seconds
+        '''
+
+        self.write(line + "\r\n")
+        return self.expect([PROMPT_RE], timeout)[1]
+
+    def close(self):
+        self.eof = True
+        self.sock.close()
+        if self.jump:
+            self.jump.release()
+            self.jump = None
@@ -0,0 +1,18 @@
+# show cdp neighbors detail (IOS), one record per neighbour
+#
+# Device ID: sw2.example.com
+#   IP address: 10.0.0.2
+# Platform: cisco WS-C2960-24TT-L,  Capabilities: Switch IGMP
+# Interface: GigabitEthernet0/1,  Port ID (outgoing port): GigabitEthernet0/24
+command ^sh(o|ow)? cdp nei(g|gh|ghb|ghbo|ghbor|ghbors)? det(a|ai|ail)?$
+value neighbour str \S+
+value neighbour_ip ip \d+\.\d+\.\d+\.\d+
+value platform str [^,]+
+value capabilities str .+
+value local_port str [^,]+
+value remote_port str .+
+block ^Device ID: ?{neighbour}
+set ^\s*IP(v4)? [Aa]ddress: {neighbour_ip}
+set ^Platform: {platform},\s+Capabilities: {capabilities}
+set ^Interface: {local_port},\s+Port ID \(outgoing port\): {remote_port}
+index neighbour
@@ -0,0 +1,24 @@
+# show interfaces (IOS), one record per interface with its counters
+#
+# GigabitEthernet0/1 is up, line protocol is up (connected)
+#      123 packets input, 4567 bytes, 0 no buffer
+#      0 input errors, 0 CRC, 0 frame, 0 overrun, 0 ignored
+#      890 packets output, 12345 bytes, 0 underruns
+#      0 output errors, 0 collisions, 1 interface resets
+command ^sh(o|ow)? int(e|er|erf|erfa|erfac|erface|erfaces)?$
+value interface str \S+
+value status str up|down|administratively down
+value protocol str up|down
+value in_packets int \d+
+value in_bytes int \d+
+value in_errors int \d+
+value crc int \d+
+value out_packets int \d+
+value out_bytes int \d+
+value out_errors int \d+
+set ^{interface} is {status}, line protocol is {protocol}
+set ^\s+{in_packets} packets input, {in_bytes} bytes
+set ^\s+{in_errors} input errors, {crc} CRC
+set ^\s+{out_packets} packets output, {out_bytes} bytes
+record ^\s+{out_errors} output errors
+index interface
@@ -0,0 +1,11 @@
+# show ip arp (IOS)
+#
+# Protocol  Address          Age (min)  Hardware Addr   Type   Interface
+# Internet  10.1.2.3               12   0011.2233.4455  ARPA   Vlan10
+command ^sh(o|ow)? (ip )?arp$
+value address ip \d+\.\d+\.\d+\.\d+
+value age int \d+|-
+value mac mac [0-9a-fA-F.:-]+
+value interface str \S*
+record ^Internet\s+{address}\s+{age}\s+{mac}\s+ARPA\s*{interface}\s*$
+index address mac
@@ -0,0 +1,15 @@
+# show ip bgp summary (IOS)
+#
+# BGP router identifier 10.0.0.1, local AS number 65001
+# Neighbor        V    AS MsgRcvd MsgSent   TblVer  InQ OutQ Up/Down  State/PfxRcd
+# 10.0.0.2        4 65002    1234    1230       55    0    0 1d02h           12
+command ^sh(o|ow)? (ip )?bgp sum(m|ma|mar|mary)?$
+value router_id ip \S+
+value local_as int \d+
+value neighbor ip \d+\.\d+\.\d+\.\d+
+value remote_as int \d+
+value up_down str \S+
+value state str \S+
+set ^BGP router identifier {router_id}, local AS number {local_as}
+record ^{neighbor}\s+4\s+{remote_as}\s+\d+\s+\d+\s+\d+\s+\d+\s+\d+\s+{up_down}\s+{state}\s*$
+index neighbor
@@ -0,0 +1,11 @@
+# show ip interface brief (IOS)
+#
+# Interface              IP-Address      OK? Method Status                Protocol
+# GigabitEthernet0/1     10.1.1.1        YES NVRAM  up                    up
+command ^sh(o|ow)? ip int(e|er|erf|erfa|erfac|erface)? br(i|ie|ief)?$
+value interface str \S+
+value address str \S+
+value method str \S+
+value status str up|down|administratively down|deleted
+value protocol str up|down
+record ^{interface}\s+{address}\s+\S+\s+{method}\s+{status}\s+{protocol}\s*$
@@ -0,0 +1,15 @@
+# show ip route (IOS)
+#
+# C        10.1.1.0/24 is directly connected, Vlan10
+# O IA     10.2.0.0/16 [110/2] via 10.1.1.2, 1d02h, Vlan10
+# S*       0.0.0.0/0 [1/0] via 10.0.0.1
+command ^sh(o|ow)? ip ro(u|ut|ute)?$
+value protocol str [A-Za-z]\*?( (IA|E1|E2|N1|N2|EX|L1|L2|ia|su))?
+value prefix str \d+\.\d+\.\d+\.\d+(/\d+)?
+value distance int \d+
+value metric int \d+
+value nexthop ip \d+\.\d+\.\d+\.\d+
+value interface str [^\s,]+
+record ^{protocol}\s+{prefix}\s+\[{distance}/{metric}\] via {nexthop}(, [^,]+)?(, {interface})?\s*$
+record ^{protocol}\s+{prefix}\s+is directly connected, {interface}
+index prefix nexthop
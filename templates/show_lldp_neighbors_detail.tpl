@@ -0,0 +1,22 @@
+# show lldp neighbors detail (IOS), one record per neighbour
+#
+# Local Intf: Gi0/1
+# Chassis id: 0011.2233.4455
+# Port id: Gi0/24
+# System Name: sw2.example.com
+# Management Addresses:
+#     IP: 10.0.0.2
+command ^sh(o|ow)? lldp nei(g|gh|ghb|ghbo|ghbor|ghbors)? det(a|ai|ail)?$
+value local_port str \S+
+value chassis_id str \S+
+value remote_port str \S+
+value neighbour str \S+
+value neighbour_ip ip \d+\.\d+\.\d+\.\d+
+value capabilities str \S+
+block ^Local Intf: {local_port}
+set ^Chassis id: {chassis_id}
+set ^Port id: {remote_port}
+set ^System Name: {neighbour}
+set ^\s+IP: {neighbour_ip}
+set ^System Capabilities: {capabilities}
+index neighbour
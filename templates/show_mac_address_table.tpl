@@ -0,0 +1,12 @@
+# show mac address-table (IOS), show mac-address-table on older releases
+#
+#  Vlan    Mac Address       Type        Ports
+#  ----    -----------       --------    -----
+#    10    0011.2233.4455    DYNAMIC     Gi0/1
+command ^sh(o|ow)? mac(-| )addr(e|es|ess)?-?(t|ta|tab|tabl|table)?$
+value vlan int \d+
+value mac mac [0-9a-fA-F.]{14}
+value type str \S+
+value port str \S+
+record ^\*?\s*{vlan}\s+{mac}\s+{type}\s+{port}\s*$
+index mac
@@ -0,0 +1,16 @@
+# show version (IOS), one record per device
+command ^sh(o|ow)? ver(s|si|sio|sion)?$
+single
+value hostname str \S+
+value version str [^,\s]+
+value uptime str .+
+value image str \S+
+value model str \S+
+value serial str \S+
+value config_register str \S+
+set Version {version}
+set ^{hostname} uptime is {uptime}
+set ^System image file is "{image}"
+set ^[Cc]isco {model} .*[Pp]rocessor
+set ^Processor board ID {serial}
+set ^Configuration register is {config_register}
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+'''
+This module holds the helpers shared by every tool: prompts, defaults, the
+activity.log, ANSI clean up and finding the hostname in a config.  It only
+uses the standard library so a tool that imports it starts quickly, the SSH
+and telnet libraries are loaded by pipeline.py and transport.py when a
+device is first contacted.
+'''
+
+import re
+import datetime
+import sys
+
+from activity_log import rotate_log
+from activity_log import record_activity
+
+
+def get_defaults():
+
+    '''this function reads in defaults for the user inputs customer dir and user name
+    tools.pref should exist in the same directory as the tools.
+
+    tools.pref is not required.
+
+    same tools.pref:
+
+    acme-ltd.info
+    username
+
+    '''
+
+    try:
+        fileh_def = open("tools.pref")
+    except IOError:
+        return ['', '']
+    prefs = fileh_def.read().split()
+    fileh_def.close()
+
+    try:
+        if prefs[1]:
+            pass
+    except IndexError:
+        prefs.append('')
+
+    return prefs
+
+
+def clean_ansi(clean):
+
+    '''
+    This functions cleans ANSI code from the output
+    '''
+
+    # Clean up the dirty HP formatting
+    clean = re.sub(r'\x1b\[[0-9]+?;[0-9]+?[A-z]', '', clean)
+    clean = re.sub(r'\x1b\[[0-9]+?[A-z]', '', clean)
+    clean = re.sub(r'\x1b\[\?[0-9]+?[A-z]', '', clean)
+    clean = re.sub(r'\x1b[A-z]', '\n', clean)
+    clean = clean.replace('\r\n', '\n')
+
+    return clean
+
+
+def clean_ansi_stream(chunks):
+
+    '''
+    Streaming version of clean_ansi.  An escape sequence or \r\n split across
+    two chunks is held back until the rest of it arrives.
+    '''
+
+    tail = ''
+    for chunk in chunks:
+        chunk = tail + chunk
+        cut = chunk.rfind('\x1b', max(0, len(chunk) - 12))
+        if cut == -1:
+            cut = len(chunk)
+            if chunk.endswith('\r'):
+                cut -= 1
+        tail = chunk[cut:]
+        yield clean_ansi(chunk[:cut])
+    if tail:
+        yield clean_ansi(tail)
+
+
+def status_update(folder, host_ip, name, status):
+
+    '''
+    This function updates the activity.log and the activity store (see
+    activity_log.py)
+    '''
+
+    su_filename = "".join([folder, "/activity.log"])
+    rotate_log(su_filename)
+    su_fileh = open(su_filename, "a")
+    su_status_msg = " ".join([str(datetime.datetime.now()).ljust(26), host_ip.ljust(15), ""])
+    if name:
+        # Only if we have a hostname, if not then something went wrong.
+        su_status_msg += " ".join([name, ""])
+    su_status_msg += "".join([status, "\n"])
+    su_fileh.write(su_status_msg)
+    su_fileh.close()
+    record_activity(folder, host_ip, name, status)
+    return
+
+
+def raw_input_def(prompt, default):
+
+    '''
+    Adds a default for inputs
+    '''
+
+    usr_input = raw_input(prompt)
+    if not usr_input:
+        # If the user hit enter without inputting details we return the default
+        return default
+    else:
+        return usr_input
+
+
+def print_flush(flush_output):
+    '''
+    prints without a newline and flushes the buffer so it appears on screen
+    without delay
+    '''
+    sys.stdout.write(flush_output)
+    sys.stdout.flush()
+    return
+
+
+def get_hostname(dev_output):
+
+    '''
+    This function searches for the hostname field inside the config which is
+    used as the filename.
+    '''
+
+    hostname_se = re.search(r"hostname (.*)", dev_output)
+    if not hostname_se:
+        return
+    else:
+        # HP store the hostname as "hostname" so we strip the "
+        return hostname_se.group(1).strip().strip('"')
+
+
+def sniff_hostname(chunks, found):
+
+    '''
+    Passes the chunks through unchanged, the first hostname seen is stored as
+    found['hostname'].  Only the last partial line is kept between chunks.
+    '''
+
+    partial = ''
+    for chunk in chunks:
+        if 'hostname' not in found:
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()[-1024:]
+            for line in lines:
+                name = get_hostname(line)
+                if name:
+                    found['hostname'] = name
+                    break
+        yield chunk
+
+    if 'hostname' not in found and partial:
+        name = get_hostname(partial)
+        if name:
+            found['hostname'] = name
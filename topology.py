@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+'''
+This module holds the cached view of the network built from CDP and LLDP,
+kept in <customer dir>/neighbours.json.  It is an adjacency list, per device
+IP the neighbour on each port:
+
+{"10.0.0.1": {"hostname": "core-sw1",
+              "updated": 1412345678.9,
+              "arp": true,
+              "ports": {"gi0/1": {"neighbour": "sw2",
+                                  "neighbour_ip": "10.0.0.2",
+                                  "remote_port": "gi0/24",
+                                  "chassis": "0011.2233.4455",
+                                  "platform": "cisco WS-C2960-24TT-L",
+                                  "capabilities": "Switch IGMP"}}}}
+
+Port names are kept in short form (see short_port) so names from the MAC
+table, CDP and LLDP can be compared.  arp is set once a device has answered
+an ARP query with entries, i.e. it routes.
+
+graph(), shortest_path() and blast_radius() work on the cache alone, no
+device is contacted.
+'''
+
+import collections
+import json
+import re
+import threading
+import time
+
+
+# Neighbours older than this are collected again
+MAX_AGE = 24 * 60 * 60
+
+PORT_RE = re.compile(r"^([A-Za-z-]+)\s*(\d[\d/.:]*)$")
+
+
+def short_port(name):
+
+    '''
+    GigabitEthernet0/1, Gig 0/1 and Gi0/1 all become gi0/1
+    '''
+
+    name = name.strip()
+    port_se = PORT_RE.match(name)
+    if not port_se:
+        return name.lower()
+    return port_se.group(1)[:2].lower() + port_se.group(2)
+
+
+class NeighbourCache(object):
+
+    '''
+    CDP/LLDP neighbours per device, safe to share between pipeline workers
+    '''
+
+    def __init__(self, folder):
+        self.filename = "".join([folder, "/neighbours.json"])
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.dirty = False
+        try:
+            fileh = open(self.filename)
+        except IOError:
+            return
+        try:
+            self.devices = json.load(fileh)
+        except ValueError:
+            self.devices = {}
+        fileh.close()
+
+    def stale(self, host_ip, max_age=MAX_AGE):
+
+        '''
+        True if the neighbours of a device need collecting again
+        '''
+
+        with self.lock:
+            entry = self.devices.get(host_ip)
+            return not entry or time.time() - entry.get('updated', 0) > max_age
+
+    def set_neighbours(self, host_ip, records):
+
+        '''
+        Replaces the neighbours of a device with the records from the CDP
+        and/or LLDP templates
+        '''
+
+        ports = {}
+        for record in records:
+            if not record.get('local_port'):
+                continue
+            neighbour = record.get('neighbour') or record.get('chassis_id')
+            ports[short_port(record['local_port'])] = {
+                'neighbour': neighbour.split('.')[0] if neighbour else None,
+                'neighbour_ip': record.get('neighbour_ip'),
+                'remote_port': short_port(record.get('remote_port') or ''),
+                'chassis': record.get('chassis_id') or neighbour,
+                'platform': record.get('platform'),
+                'capabilities': record.get('capabilities'),
+            }
+        with self.lock:
+            entry = self.devices.setdefault(host_ip, {})
+            entry['ports'] = ports
+            entry['updated'] = time.time()
+            self.dirty = True
+
+    def update(self, host_ip, **kwargs):
+
+        '''
+        Records other details for a device, e.g. hostname or arp
+        '''
+
+        with self.lock:
+            entry = self.devices.setdefault(host_ip, {})
+            for name, value in kwargs.items():
+                if entry.get(name) != value:
+                    entry[name] = value
+                    self.dirty = True
+
+    def get(self, host_ip):
+        with self.lock:
+            return dict(self.devices.get(host_ip, {}))
+
+    def uplinks(self, host_ip):
+
+        '''
+        The short names of the ports of a device that have a neighbour
+        '''
+
+        with self.lock:
+            return set(self.devices.get(host_ip, {}).get('ports', {}))
+
+    def graph(self):
+
+        '''
+        Returns the adjacency lists keyed on device name (the IP where we do
+        not know the name), and a dict of name -> management IP
+        '''
+
+        with self.lock:
+            names = dict((host_ip, entry.get('hostname') or host_ip)
+                         for host_ip, entry in self.devices.items())
+            graph = {}
+            addresses = dict((name, host_ip) for host_ip, name in names.items())
+            for host_ip, entry in self.devices.items():
+                here = names[host_ip]
+                graph.setdefault(here, set())
+                for port in entry.get('ports', {}).values():
+                    there = (names.get(port['neighbour_ip']) or port['neighbour'] or
+                             port['neighbour_ip'])
+                    if not there or there == here:
+                        continue
+                    graph[here].add(there)
+                    graph.setdefault(there, set()).add(here)
+                    if port['neighbour_ip']:
+                        addresses.setdefault(there, port['neighbour_ip'])
+        return graph, addresses
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            fileh = open(self.filename, "w")
+            json.dump(self.devices, fileh, indent=1, sort_keys=True)
+            fileh.close()
+            self.dirty = False
+
+
+def is_network_device(port):
+
+    '''
+    True if the neighbour on a port is a switch or router worth crawling,
+    phones and access points are left out
+    '''
+
+    capabilities = (port.get('capabilities') or '').replace(',', ' ').split()
+    if not capabilities:
+        return True
+    if 'Phone' in capabilities or 'T' in capabilities:
+        return False
+    return bool(set(capabilities) & set(['Router', 'Switch', 'R', 'B']))
+
+
+def shortest_path(graph, start, end):
+
+    '''
+    Breadth first search, returns the list of device names from start to
+    end or None if they are not connected
+    '''
+
+    if start not in graph or end not in graph:
+        return None
+    previous = {start: None}
+    queue = collections.deque([start])
+    while queue:
+        here = queue.popleft()
+        if here == end:
+            path = []
+            while here is not None:
+                path.append(here)
+                here = previous[here]
+            return path[::-1]
+        for there in graph[here]:
+            if there not in previous:
+                previous[there] = here
+                queue.append(there)
+    return None
+
+
+def blast_radius(graph, roots, failed):
+
+    '''
+    Returns the set of devices that can no longer reach any of the roots
+    (e.g. the core or the seed devices) if the failed device goes down
+    '''
+
+    reachable = set()
+    queue = collections.deque(root for root in roots if root in graph and root != failed)
+    reachable.update(queue)
+    while queue:
+        here = queue.popleft()
+        for there in graph[here]:
+            if there != failed and there not in reachable:
+                reachable.add(there)
+                queue.append(there)
+    return set(graph) - reachable - set([failed])
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+'''
+This module holds the connection layer shared by the network tools.
+
+SSHSession drives a paramiko Transport directly rather than going through
+SSHClient so that the session cache can be used to:
+
+- check the host key against known_hosts with a dict lookup
+- offer the key exchange and cipher that worked last time first
+- go straight to the authentication method the device accepted last time,
+  skipping password auth on kit that only allows keyboard-interactive
+
+Devices behind a bastion are reached through a JumpHost: one authenticated
+SSH connection to the bastion, each device session runs over a direct-tcpip
+channel opened on it (the equivalent of ssh -J), so the bastion handshake is
+done once per run rather than once per device.
+
+scp_put copies a file to a device over SCP, restore_configs.py uses it to
+put a stored config on flash.
+
+paramiko is imported by the functions that need it rather than at the top,
+the tools that only read files (and shell_send) do not pay for loading it.
+'''
+
+import os
+import socket
+import threading
+import time
+
+
+def shell_send(cmd, wait, buf, ssh_shell, shell_is_telnet):
+    '''
+    Sends a command to the SSH or telnet shell and waits. Adds a newline
+    (simulates pressing enter)
+    '''
+
+    if not shell_is_telnet:
+        ssh_shell.send(cmd + "\n")
+        # A replayed shell answers at once unless paced, see recording.py
+        getattr(ssh_shell, 'settle', time.sleep)(wait)
+        return ssh_shell.recv(buf)
+    else:
+        # Telnet returns as soon as the prompt is back, wait is the limit
+        return ssh_shell.command(cmd, wait)
+
+
+class BastionError(Exception):
+
+    '''
+    The bastion of a :jump device could not be reached or refused its login,
+    the device itself was never tried
+    '''
+
+
+def _prefer(offered, preferred):
+
+    '''
+    Moves the preferred algorithm to the front of the offered tuple
+    '''
+
+    if not preferred or preferred not in offered:
+        return offered
+    return (preferred,) + tuple(x for x in offered if x != preferred)
+
+
+def _record_kex(transport):
+
+    '''
+    Returns a list that gets the name of each key exchange the transport
+    agrees with the device.  paramiko drops its kex engine before
+    start_client returns, so the name is taken as the engine is made.
+    '''
+
+    agreed = []
+
+    def recorded(name, kex_class):
+        def start(transport):
+            agreed.append(name)
+            return kex_class(transport)
+        return start
+
+    # Same names, so the security options still validate against it
+    transport._kex_info = dict((name, recorded(name, kex_class))
+                               for name, kex_class in transport._kex_info.items())
+    return agreed
+
+
+class SSHSession(object):
+
+    '''
+    An authenticated SSH connection to a single device, directly or through
+    a JumpHost
+    '''
+
+    def __init__(self, ip_addr, username, password, cache, timeout=8, port=22, jump=None):
+        import paramiko
+
+        self.ip_addr = ip_addr
+        self.cache = cache
+        self.timeout = timeout
+        self.jump = jump
+
+        params = cache.get(ip_addr)
+        if jump:
+            sock = jump.open_channel(ip_addr, port)
+        else:
+            sock = socket.create_connection((ip_addr, port), timeout)
+
+        try:
+            self.transport = paramiko.Transport(sock)
+        except Exception:
+            sock.close()
+            self._release()
+            raise
+        try:
+            kex = _record_kex(self.transport)
+            options = self.transport.get_security_options()
+            options.kex = _prefer(options.kex, params.get("kex"))
+            options.ciphers = _prefer(options.ciphers, params.get("cipher"))
+
+            self.transport.start_client(timeout=timeout)
+            cache.check_host_key(ip_addr, self.transport.get_remote_server_key())
+
+            auth = self._auth(username, password, params.get("auth"))
+        except Exception:
+            self.close()
+            raise
+
+        agreed = {'cipher': self.transport.remote_cipher, 'auth': auth}
+        if kex:
+            agreed['kex'] = kex[-1]
+        cache.update(ip_addr, **agreed)
+
+    def _auth(self, username, password, cached_auth):
+
+        '''
+        Tries the cached auth method first then falls back to the others the
+        device allows. Returns the method that worked.
+        '''
+
+        import paramiko
+
+        def handler(title, instructions, prompt_list):
+            return [password for prompt in prompt_list]
+
+        methods = ["password", "keyboard-interactive"]
+        if cached_auth in methods:
+            methods.remove(cached_auth)
+            methods.insert(0, cached_auth)
+
+        while methods:
+            method = methods.pop(0)
+            try:
+                if method == "password":
+                    self.transport.auth_password(username, password)
+                else:
+                    self.transport.auth_interactive(username, handler)
+                return method
+            except paramiko.BadAuthenticationType as err:
+                # The device does not offer this method, try the next one
+                if cached_auth == method:
+                    self.cache.forget(self.ip_addr, "auth")
+                methods = [x for x in methods if x in err.allowed_types]
+
+        raise paramiko.AuthenticationException("No supported authentication method")
+
+    def exec_command(self, command):
+
+        '''
+        Runs a single command, returns a file like object for the output
+        '''
+
+        chan = self.transport.open_session(timeout=self.timeout)
+        chan.exec_command(command)
+        return chan.makefile("rb", -1)
+
+    def invoke_shell(self, width=200, height=99999):
+
+        '''
+        Opens an interactive shell, used for HP and enable mode
+        '''
+
+        chan = self.transport.open_session(timeout=self.timeout)
+        chan.get_pty(width=width, height=height)
+        chan.invoke_shell()
+        return chan
+
+    def _release(self):
+        if self.jump:
+            self.jump.release()
+            self.jump = None
+
+    def close(self):
+        self.transport.close()
+        self._release()
+
+
+def _scp_ack(chan):
+    code = chan.recv(1)
+    if code != "\0":
+        message = chan.recv(1024) if code else "connection closed"
+        raise IOError("SCP refused: %s" % message.strip())
+
+
+def scp_put(session, filename, remote_path, timeout=30):
+
+    '''
+    Copies a local file to the device over SCP (the sink side of scp -t),
+    e.g. to flash:restore.cfg.  Raises IOError if the device refuses it.
+    '''
+
+    chan = session.transport.open_session(timeout=session.timeout)
+    try:
+        chan.settimeout(timeout)
+        chan.exec_command("scp -t %s" % remote_path)
+        _scp_ack(chan)
+        chan.sendall("C0644 %d %s\n" % (os.path.getsize(filename),
+                                         remote_path.split(":")[-1].split("/")[-1]))
+        _scp_ack(chan)
+        fileh = open(filename, "rb")
+        for chunk in iter(lambda: fileh.read(32768), ''):
+            chan.sendall(chunk)
+        fileh.close()
+        chan.sendall("\0")
+        _scp_ack(chan)
+    finally:
+        chan.close()
+
+
+class JumpHost(object):
+
+    '''
+    A bastion shared by the pipeline workers.  The SSH connection to it is
+    opened on first use and reopened if it drops.  At most max_channels
+    device sessions run through it at once, further open_channel calls wait
+    for a session to close.
+    '''
+
+    def __init__(self, address, username, password, cache, max_channels=10, timeout=8, port=22):
+        self.address = address
+        self.username = username
+        self.password = password
+        self.cache = cache
+        self.timeout = timeout
+        self.port = port
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_channels)
+        self.session = None
+        # Set once the bastion refuses the login, it is not tried again
+        self.refused = None
+
+    def _transport(self):
+        with self.lock:
+            if self.session is None or not self.session.transport.is_active():
+                self.session = SSHSession(self.address, self.username, self.password,
+                                          self.cache, timeout=self.timeout, port=self.port)
+                # Keep the bastion from dropping us between waves of devices
+                self.session.transport.set_keepalive(30)
+            return self.session.transport
+
+    def open_channel(self, ip_addr, port=22):
+
+        '''
+        Returns a socket like channel to ip_addr:port through the bastion,
+        the caller must release() once done with it
+        '''
+
+        import paramiko
+
+        if self.refused:
+            raise self.refused
+        self.slots.acquire()
+        try:
+            transport = self._transport()
+        except paramiko.ssh_exception.AuthenticationException:
+            self.slots.release()
+            # Not the device's login, must not count towards its site's
+            # lockout, and retrying would lock the bastion account out
+            self.refused = BastionError("Authentication failed on bastion %s" % self.address)
+            raise self.refused
+        except Exception as err:
+            self.slots.release()
+            raise BastionError("Could not connect to bastion %s: %s" % (self.address, err))
+        try:
+            return transport.open_channel("direct-tcpip", (ip_addr, port),
+                                          ("127.0.0.1", 0), timeout=self.timeout)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self):
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            if self.session:
+                self.session.close()
+                self.session = None